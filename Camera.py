@@ -1,130 +1,787 @@
 import numpy
-import pickle
 import time
 import os, sys
-from dateutil.relativedelta import relativedelta
+import contextlib
+import threading
 
-sys.path.insert(0, './lib')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
 
 # from FakeControllers import *       # for testing without using equipment
 from MotorController import *
 from AdcController import *
 
 from ScanDataStruct import ScanData
+from ScanFile import ScanFile, ScanFileWriter, save_scan, SCAN_FILE_EXTENSION
+from HardwareSession import HardwareSession
+from ScanPlanner import ScanPlanner, ScanTimer, format_duration
+from AcquisitionPipeline import Pipeline, RowAssembler
+from AdaptiveScan import Quadtree, serpentine_order
+from FlyScan import stage_positions, bin_readings
+from RegionPlanner import plan_regions, unplanned_travel, region_corners, manhattan, chebyshev
+from Reducers import get_reducer, get_standard_error, reduce_mean
 from CustomExceptions import ImageDimensionError
 
 import numpy as np
-from matplotlib import pyplot as plt
 
 # to check if image exceeds the limits of the stepper array
 IMAGE_LIMITS = ((0, 50), (0, 50))
 
+# Camera settings saved with scans, restored when resuming a scan
+SCAN_SETTINGS = ('SAMPLING_FUNC', 'N_SAMPLES', 'SAMPLING_MODE', 'SEQUENTIAL_TARGET_SE', 'SEQUENTIAL_MIN_SAMPLES',
+                'SERPENTINE', 'BACKLASH_OFFSETS', 'SETTLE_TIME', 'SETTLE_MODE', 'SETTLE_TOLERANCE', 'SETTLE_WINDOW',
+                'SETTLE_MAX_WAIT', 'RAW_CAPTURE', 'RAW_DTYPE', 'FLY_SCAN', 'FLY_VELOCITY', 'FLY_SENSOR_LAG')
+
 # decorator to initialise controllers at start and end of calls
+# within a session (Camera.session) the devices are already open, so only checked before the scan
+# the scan is timed from after the devices are connected, as reconnecting homes the stage
 def initialise_controllers(func):
     def wrapped_function(self, *args, **kwargs):
-        # test motor controller connection
         try:
-            self.motors.test_instrument_connection()
-        except MotorControllerError:
-            self.motors.open_instrument()
-        # connect to adc
-        self.adc.open()
-        result = func(self, *args, **kwargs)
-        self.adc.close()
+            if self.hardware_session is not None:
+                self.hardware_session.begin_scan()
+                try:
+                    self._start_scan_timer()
+                    result = func(self, *args, **kwargs)
+                finally:
+                    self.hardware_session.end_scan()
+            else:
+                # test motor controller connection
+                try:
+                    self.motors.test_instrument_connection()
+                except MotorControllerError:
+                    self.motors.open_instrument()
+                # connect to adc
+                self.adc.open()
+                self._start_scan_timer()
+                result = func(self, *args, **kwargs)
+                self.adc.close()
+        finally:
+            self.motors.profile = self.adc.profile = None
+        # refine scan time estimates from completed scans
+        self.scan_timer.gpib_update(self.motors.round_trips, self.motors.writes)
+        self.scan_timer.stop()
+        if result is not None:
+            self.planner.record(self.scan_timer)
+            self._log_profile(func.__name__)
         return result
     return wrapped_function
 
 class Camera:
-    # Initialisation
-    def __init__(self, reset_positions=True):
-        self.motors = MotorController()
-        self.adc = AdcController()
+    # Initialisation, motors and adc can be given to use other controllers (e.g. simulated hardware)
+    # gpib_address and adc_card select the devices when several rigs are connected (see MotorController,
+    # AdcController and RigPool)
+    def __init__(self, reset_positions=True, motors=None, adc=None, gpib_address=None, adc_card=0):
+        self.motors = MotorController(address=gpib_address) if motors is None else motors
+        self.adc = AdcController(card=adc_card) if adc is None else adc
         self.SAMPLING_FUNC = 'rms'
         self.N_SAMPLES = 20
+        # 'fixed' takes N_SAMPLES per pixel, 'sequential' samples until the standard error of the sampling
+        # function's estimate reaches SEQUENTIAL_TARGET_SE, taking between SEQUENTIAL_MIN_SAMPLES and N_SAMPLES
+        self.SAMPLING_MODE = 'fixed'
+        self.SEQUENTIAL_TARGET_SE = 1.0
+        self.SEQUENTIAL_MIN_SAMPLES = 5
+        # serpentine raster scans alternate rows in reverse to avoid flyback on axis 1
+        self.SERPENTINE = False
+        # offsets (mm) applied to axis 1 positions for (forward, reverse) rows to correct backlash
+        self.BACKLASH_OFFSETS = (0, 0)
+        # pause (s) after each step for sensor to adjust to new position and prevent smearing
+        self.SETTLE_TIME = 0.05
+        # 'fixed' waits SETTLE_TIME after each step, 'adaptive' polls the adc until readings are stable
+        self.SETTLE_MODE = 'fixed'
+        # adaptive settling: readings are stable when the means of consecutive windows of SETTLE_WINDOW
+        # readings differ by at most SETTLE_TOLERANCE (adc counts), waiting at most SETTLE_MAX_WAIT (s)
+        self.SETTLE_TOLERANCE = 2
+        self.SETTLE_WINDOW = 4
+        self.SETTLE_MAX_WAIT = 0.05
+        # keep every adc sample of each pixel (as RAW_DTYPE, the K8055 adc is 8 bit) and the time each pixel was
+        # sampled, so the image can be recalculated with another sampling function without rescanning
+        self.RAW_CAPTURE = False
+        self.RAW_DTYPE = 'uint8'
+        # fly scans move along each row of scan_image in one move while reading the adc continuously, binning
+        # the readings onto the pixels by the stage position at the time of each reading. FLY_VELOCITY (mm/s)
+        # is the stage velocity if known, None takes the stage to move at a constant speed over the whole move.
+        # Readings are placed where the stage was FLY_SENSOR_LAG seconds earlier, for the sensor's response time
+        self.FLY_SCAN = False
+        self.FLY_VELOCITY = None
+        self.FLY_SENSOR_LAG = 0.015
+        # acquire in a separate thread to processing of the samples
+        self.PIPELINED = True
+        self.PIPELINE_QUEUE_SIZE = 64
+        self.pipeline = None
         self.end_flag = False
+        # 2d scans not given a save_path are checkpointed here row by row, so can be resumed (None to disable)
+        self.CHECKPOINT_FILE = 'ScanData/last_image_backup.scanbin'
+        # scan time estimates, refined from the timings of previous scans
+        self.planner = ScanPlanner.load()
+        self.scan_timer = ScanTimer()
+        # latency profile of each completed scan is appended here (see ScanProfile), None to disable
+        self.PROFILE_FILE = 'ScanData/scan_profile.csv'
+        # open HardwareSession while in a session, otherwise devices are opened and closed for each scan
+        self.hardware_session = None
 
     # Scan Image where arguments: start_pos, img_size and pixel_size are all 2 element tuples or lists
+    # gui_prog is emitted with the index of each row completed, gui_row with (index, values) of each row
+    # rows are appended to a scan file at save_path (CHECKPOINT_FILE if not given) as they are completed,
+    # so the scan can be continued with resume_scan if it is aborted or stopped by a fault
     @initialise_controllers
     def scan_image(self, start_pos, img_size, pixel_size,
-                    display_time=True, gui_prog=None):
+                    display_time=True, gui_prog=None, gui_row=None, save_path=None):
         self.check2dDimensions(start_pos, img_size, pixel_size)
-        # move axis 0 to start
-        self.motors.move_absolute(0, start_pos[0])
-        # scan over range
-        pixel_array = []
-        scan_range = int(img_size[0]/pixel_size[0])
-        # for time remaining
-        if display_time:
-            start_time = time.time()
-        for i in range(scan_range):
-            row = self._scan_axis(1, start_pos[1], img_size[1], pixel_size[1])
-            # handle aborted scan
-            if row is None:
-                return None
-            else:
-                pixel_array += [row]
-            self.motors.move(0, pixel_size[0])
-            if display_time and i > 0:
-                # calculate time remaining
-                fraction_complete = i/scan_range
-                elapsed_time = time.time() - start_time
-                t_remaining = relativedelta(seconds=round((1/fraction_complete - 1) * elapsed_time))
-                print('{perc}% complete: {t_m}m, {t_s}s remaining.'.format(perc=round(fraction_complete*100, 2),
-                                                            t_m=t_remaining.minutes, t_s=t_remaining.seconds))
-            # update gui progress bar (don't update if exiting)
-            if gui_prog is not None and not self.end_flag:
-                gui_prog.emit(i)
+        # for time remaining
+        if display_time:
+            print('Estimated scan time: {}'.format(format_duration(
+                self.estimate_scan_image(start_pos, img_size, pixel_size))))
+        rows = int(img_size[0]/pixel_size[0])
+        columns = int(img_size[1]/pixel_size[1]) + 1
+        writer = self._open_checkpoint(save_path, pixel_size, start_pos, img_size, (rows, columns))
+        assembler = self._scan_rows(start_pos, img_size, pixel_size, 0, writer, display_time, gui_prog, gui_row)
+        # handle aborted scan
+        if assembler is None:
+            return None
         # return data object
-        return ScanData(pixel_size, start_pos, img_size, pixel_array, time.time())
+        data = ScanData(pixel_size, start_pos, img_size, assembler.rows, time.time(),
+                        settle_times=assembler.info['settle_time'],
+                        sample_counts=assembler.info.get('sample_count'),
+                        raw_samples=self._raw_samples, pixel_times=assembler.info.get('timestamp'))
+        if writer is not None:
+            writer.finish(data.timestamp)
+        return data
 
+    # Continue a 2d scan from the scan file (checkpoint) of a scan that was aborted or stopped by a fault.
+    # The settings the scan was started with are restored, the stage re-homed as positions may have been
+    # lost, and scanning continues from the first row not completed, appending to the same file.
+    # Returns ScanData of the whole scan (with data memory mapped from the file)
+    @initialise_controllers
+    def resume_scan(self, checkpoint, display_time=True, gui_prog=None, gui_row=None):
+        scan_file = ScanFile(checkpoint)
+        scan_file.check_resumable()
+        header = scan_file.header
+        first_row = scan_file.rows_written
+        scan_file.close()
+        # the scan's settings are only used for the rest of this scan, the camera's are restored after
+        previous = {name: getattr(self, name) for name in header['settings'] if hasattr(self, name)}
+        try:
+            for name, value in header['settings'].items():
+                setattr(self, name, tuple(value) if isinstance(value, list) else value)
+            start_pos, img_size, pixel_size = (tuple(header[k]) for k in ('start', 'scan_range', 'step'))
+            self.check2dDimensions(start_pos, img_size, pixel_size)
+            self.motors.init_positions()
+            # homing isn't part of the scan's timing
+            self._start_scan_timer()
+            if display_time:
+                print('Resuming from row {} of {}, estimated time remaining: {}'.format(
+                    first_row + 1, header['shape'][0], format_duration(self.estimate_scan_image(
+                        (start_pos[0] + first_row*pixel_size[0], start_pos[1]),
+                        (img_size[0] - first_row*pixel_size[0], img_size[1]), pixel_size))))
+            writer = ScanFileWriter.resume(checkpoint)
+            if self._scan_rows(start_pos, img_size, pixel_size, first_row, writer, display_time, gui_prog,
+                                gui_row) is None:
+                return None
+        finally:
+            for name, value in previous.items():
+                setattr(self, name, value)
+        writer.finish(time.time())
+        # read into memory, as the checkpoint is overwritten by the next scan
+        scan_file = ScanFile(checkpoint)
+        try:
+            return scan_file.to_scandata(copy=True)
+        finally:
+            scan_file.close()
 
-    # Scan row
+    # Scan row, saved to a scan file at save_path if given
     @initialise_controllers
-    def scan_row(self, axis, other_axis_pos, start_pos, scan_range, step_size):
+    def scan_row(self, axis, other_axis_pos, start_pos, scan_range, step_size, save_path=None):
         self.check1dDimensions(axis, other_axis_pos, start_pos, scan_range, step_size)
         # move other axis to start
         if other_axis_pos is not None:
-            self.motors.move_absolute(int(not axis), other_axis_pos)
+            self._move_absolute(int(not axis), other_axis_pos)
         # scan row and plot output
-        data = self._scan_axis(axis, start_pos, scan_range, step_size)
-        if data is None:
+        assembler = RowAssembler(1, int(scan_range/step_size) + 1)
+        completed = self._run_pipeline(lambda emit: self._acquire_axis(emit, 0, axis, start_pos, scan_range,
+                                                                        step_size), assembler)
+        if not completed:
             return None
         else:
-            return ScanData(step_size, start_pos, scan_range, data, time.time(), axis, other_axis_pos)
+            sample_counts = assembler.info.get('sample_count')
+            pixel_times = assembler.info.get('timestamp')
+            data = ScanData(step_size, start_pos, scan_range, assembler.rows[0], time.time(), axis, other_axis_pos,
+                            settle_times=assembler.info['settle_time'][0],
+                            sample_counts=sample_counts[0] if sample_counts is not None else None,
+                            raw_samples=self._raw_samples[0] if self._raw_samples is not None else None,
+                            pixel_times=pixel_times[0] if pixel_times is not None else None)
+            if save_path is not None:
+                save_scan(data, save_path, self._scan_settings())
+            return data
+
+    # Coarse-to-fine scan: samples a grid of coarse pixels (min_pixel*2**levels across) then splits cells
+    # whose difference to a neighbour exceeds gradient_threshold, or whose value exceeds intensity_threshold,
+    # into 4 until reaching min_pixel. Returns ScanData resampled to min_pixel, with the multi-resolution
+    # cells in data.cells (see AdaptiveScan.resample_cells to resample at other pixel sizes)
+    @initialise_controllers
+    def scan_adaptive(self, start_pos, img_size, min_pixel, levels=3, gradient_threshold=None,
+                        intensity_threshold=None, display_time=True, gui_prog=None, save_path=None):
+        self.check2dDimensions(start_pos, img_size, (min_pixel, min_pixel))
+        if gradient_threshold is None and intensity_threshold is None:
+            raise ValueError('At least one of gradient_threshold or intensity_threshold must be set for adaptive scan')
+        tree = Quadtree((int(img_size[0]/min_pixel), int(img_size[1]/min_pixel) + 1), levels)
+        points = tree.initial_points()
+        for level in range(levels + 1):
+            if display_time:
+                print('Pass {} of {}: {} pixels at {}mm'.format(level + 1, levels + 1, len(points),
+                                                                min_pixel * 2**(levels - level)))
+            points = serpentine_order(points)
+            assembler = RowAssembler(1, len(points))
+            if not self._run_pipeline(lambda emit: self._acquire_points(emit, points, start_pos, min_pixel),
+                                        assembler):
+                return None
+            tree.add_values(points, assembler.rows[0])
+            # update gui progress bar with passes completed
+            if gui_prog is not None and not self.end_flag:
+                self._emit(gui_prog, level)
+            points = tree.refine(gradient_threshold, intensity_threshold)
+            if not points:
+                break
+        if display_time:
+            print('{} pixels measured, {} in full resolution image'.format(len(tree.values),
+                                                                        tree.shape[0]*tree.shape[1]))
+            print(self.scan_timer.profile.summary())
+        data = ScanData((min_pixel, min_pixel), start_pos, img_size, tree.grid(), time.time(),
+                        cells=tree.cells(start_pos, min_pixel))
+        if save_path is not None:
+            save_scan(data, save_path, self._scan_settings())
+        return data
 
+    # keep the motors and adc open across scans, checking them every keepalive seconds while idle (None for no
+    # checks) and reconnecting any which stop responding. Returns the HardwareSession
+    def open_session(self, keepalive=HardwareSession.KEEPALIVE_INTERVAL):
+        if self.hardware_session is None:
+            session = HardwareSession(self.motors, self.adc, keepalive)
+            session.open()
+            self.hardware_session = session
+        return self.hardware_session
+
+    def close_session(self):
+        if self.hardware_session is not None:
+            self.hardware_session.close()
+            self.hardware_session = None
+
+    # context manager for a session, e.g.
+    #   with camera.session():
+    #       for start in starts:
+    #           camera.scan_image(start, size, pixel)
+    @contextlib.contextmanager
+    def session(self, keepalive=HardwareSession.KEEPALIVE_INTERVAL):
+        self.open_session(keepalive)
+        try:
+            yield self
+        finally:
+            self.close_session()
+
+    # check the devices of the open session now, reconnecting any which have failed. Returns the session
+    # status: {'motors': ok, 'adc': ok, 'checked': time}
+    def health_check(self):
+        if self.hardware_session is None:
+            raise RuntimeError('No session open, see Camera.open_session.')
+        return self.hardware_session.health_check()
+
+    # Scan several regions as one job, regions is a list of (start_pos, img_size, pixel_size) as for scan_image.
+    # The regions are scanned in the order, and each entered at the corner, that keeps the stage travel between
+    # them short (see RegionPlanner). Returns a list of ScanData in the order the regions were given, saved as
+    # region<index>.scanbin in save_dir if given. gui_prog is emitted with the number of regions completed
+    @initialise_controllers
+    def scan_regions(self, regions, display_time=True, gui_prog=None, save_dir=None):
+        regions = [(tuple(start_pos), tuple(img_size), tuple(pixel_size)) for start_pos, img_size, pixel_size in regions]
+        # check every region is within IMAGE_LIMITS before moving
+        for region in regions:
+            self.check2dDimensions(*region)
+        distance = self._travel_distance()
+        plan, travel = plan_regions(regions, self.motors.position, self.SERPENTINE, distance)
+        if display_time:
+            print('{} regions, {:.1f}mm of travel between regions ({:.1f}mm in the order given)'.format(
+                len(regions), travel, unplanned_travel(regions, self.motors.position, self.SERPENTINE, distance)))
+            print('Estimated scan time: {}'.format(format_duration(self._estimate_regions(regions, plan))))
+        acquire = self._acquire_image_fly if self.FLY_SCAN else self._acquire_image
+        self.scan_timer.fly = self.FLY_SCAN
+        scans = [None]*len(regions)
+        for k, (index, (descending, flip)) in enumerate(plan):
+            start_pos, img_size, pixel_size = regions[index]
+            assembler = RowAssembler(int(img_size[0]/pixel_size[0]), int(img_size[1]/pixel_size[1]) + 1)
+            if not self._run_pipeline(lambda emit: acquire(emit, start_pos, img_size, pixel_size, 0, descending,
+                                                            flip), assembler):
+                return None
+            scans[index] = ScanData(pixel_size, start_pos, img_size, assembler.rows, time.time(),
+                                    name='region {}'.format(index), settle_times=assembler.info['settle_time'],
+                                    sample_counts=assembler.info.get('sample_count'),
+                                    raw_samples=self._raw_samples, pixel_times=assembler.info.get('timestamp'))
+            if save_dir is not None:
+                save_scan(scans[index], os.path.join(save_dir, 'region{}{}'.format(index, SCAN_FILE_EXTENSION)),
+                            self._scan_settings())
+            if display_time:
+                print('Region {} complete, {} of {}'.format(index, k + 1, len(regions)))
+            if gui_prog is not None and not self.end_flag:
+                self._emit(gui_prog, k)
+        if display_time:
+            print(self.scan_timer.profile.summary())
+        return scans
+
     # Close communication with motors
     def close(self):
+        self.close_session()
         self.motors.close()
 
-    # Plot data stored in 'last_image_backup'
-    def plot_backup(self, start=(0,0), step=(0,0)):
-        with open('last_image_backup', 'rb') as f:
-            data = pickle.load(f)
-        self._plot_row(data, start, step)
+    # Plot rows of the last 2d scan saved in CHECKPOINT_FILE (or another scan file), complete or not
+    def plot_backup(self, checkpoint=None):
+        # pyplot (and a gui backend) only loaded when plotting
+        from matplotlib import pyplot as plt
+        scan_file = ScanFile(self.CHECKPOINT_FILE if checkpoint is None else checkpoint)
+        try:
+            data = scan_file.to_scandata(copy=True)
+        finally:
+            scan_file.close()
+        plt.imshow(numpy.transpose(data.data), extent=[data.start[0], data.start[0] + data.step[0]*len(data.data),
+                                                        data.start[1] + data.scan_range[1], data.start[1]])
+        plt.colorbar()
+        plt.show()
 
     def set_sampling_variables(self, samples, samplefunc):
         self.N_SAMPLES = samples
         self.SAMPLING_FUNC = samplefunc
 
+    # serpentine: scan odd rows in reverse, offsets: (forward, reverse) axis 1 backlash correction in mm
+    def set_raster_mode(self, serpentine, offsets=(0, 0)):
+        self.SERPENTINE = serpentine
+        self.BACKLASH_OFFSETS = tuple(offsets)
+
+    # sequential: sample each pixel until the standard error of the estimate is at most target_se (adc
+    # counts), taking at least n_min samples and at most N_SAMPLES
+    def set_sequential_sampling(self, sequential, target_se=1.0, n_min=5):
+        if sequential:
+            # check sampling function supports it
+            get_standard_error(self.SAMPLING_FUNC)
+        self.SAMPLING_MODE = 'sequential' if sequential else 'fixed'
+        self.SEQUENTIAL_TARGET_SE = target_se
+        self.SEQUENTIAL_MIN_SAMPLES = n_min
+
+    # expected samples per pixel, sequential sampling uses the mean from previous scans
+    def expected_samples(self):
+        if self.SAMPLING_MODE == 'sequential':
+            return min(self.planner.model.get('sequential_samples', self.N_SAMPLES), self.N_SAMPLES)
+        return self.N_SAMPLES
+
+    # mode: 'fixed' or 'adaptive', tolerance in adc counts, max_wait in seconds
+    def set_settle_mode(self, mode, tolerance=2, max_wait=0.05, window=4):
+        if mode not in ('fixed', 'adaptive'):
+            raise ValueError('"{}" not valid value for settle mode, options are: fixed, adaptive'.format(mode))
+        self.SETTLE_MODE = mode
+        self.SETTLE_TOLERANCE = tolerance
+        self.SETTLE_MAX_WAIT = max_wait
+        self.SETTLE_WINDOW = window
+
+    # expected wait (s) after each step, adaptive settling uses the mean measured in previous scans
+    def expected_settle_time(self):
+        if self.SETTLE_MODE == 'adaptive':
+            return min(self.planner.model.get('adaptive_settle', self.SETTLE_MAX_WAIT), self.SETTLE_MAX_WAIT)
+        return self.SETTLE_TIME
+
+    # raw capture: keep every sample (as dtype, 'uint16' for adcs above 8 bit) and time of each pixel in
+    # ScanData.raw_samples and ScanData.pixel_times
+    def set_raw_capture(self, enabled, dtype='uint8'):
+        self.RAW_CAPTURE = enabled
+        self.RAW_DTYPE = numpy.dtype(dtype).name
+
+    # fly: scan_image reads continuously while moving along each row rather than stepping between pixels,
+    # velocity: stage velocity (mm/s) if known, sensor_lag: response time (s) of the sensor
+    def set_fly_scan(self, fly, velocity=None, sensor_lag=0.015):
+        self.FLY_SCAN = fly
+        self.FLY_VELOCITY = velocity
+        self.FLY_SENSOR_LAG = sensor_lag
+
+    # batch: write moves of several axes before reading the responses so they move at the same time (see
+    # MotorController.BATCH_COMMANDS, check the controller supports it first)
+    def set_motor_batching(self, batch):
+        self.motors.BATCH_COMMANDS = batch
+
+    # pipelined: acquire in a separate thread to reduction, storage and progress updates
+    # queue_size: maximum number of pixels waiting to be processed
+    def set_pipeline(self, pipelined, queue_size=64):
+        self.PIPELINED = pipelined
+        self.PIPELINE_QUEUE_SIZE = queue_size
+
+    # estimated duration (s) of scan_image with the current settings
+    def estimate_scan_image(self, start_pos, img_size, pixel_size):
+        return self._estimate_image(start_pos, img_size, pixel_size, self.motors.position)
+
+    # estimated duration (s) of scan_regions with the current settings
+    def estimate_scan_regions(self, regions):
+        plan, travel = plan_regions(regions, self.motors.position, self.SERPENTINE, self._travel_distance())
+        return self._estimate_regions(regions, plan)
+
+    def _estimate_regions(self, regions, plan):
+        t = 0
+        position = self.motors.position
+        for index, direction in plan:
+            t += self._estimate_image(*regions[index], position=position)
+            position = region_corners(regions[index], direction, self.SERPENTINE)[1]
+        return t
+
+    # position: where the stage starts from, None if it needs homing
+    def _estimate_image(self, start_pos, img_size, pixel_size, position):
+        if self.FLY_SCAN:
+            return self.planner.estimate_fly_2d(start_pos, img_size, pixel_size, self.expected_settle_time(),
+                                                self.SERPENTINE, position)
+        return self.planner.estimate_2d(start_pos, img_size, pixel_size, self.expected_samples(),
+                                        self.expected_settle_time(), self.SERPENTINE, position)
+
+    # measure of stage travel between positions, both axes move at once if batching
+    def _travel_distance(self):
+        return chebyshev if self.motors.BATCH_COMMANDS else manhattan
+
+    # estimated duration (s) of scan_row with the current settings
+    def estimate_scan_row(self, axis, other_axis_pos, start_pos, scan_range, step_size):
+        return self.planner.estimate_1d(axis, other_axis_pos, start_pos, scan_range, step_size,
+                                        self.expected_samples(), self.expected_settle_time(), self.motors.position)
+
+    # run source (moving and sampling) through reduction and storage into assembler
+    # returns the result of source, False if the scan was aborted
+    def _run_pipeline(self, source, assembler):
+        self._reducer = get_reducer(self.SAMPLING_FUNC)
+        if self.SAMPLING_MODE == 'sequential':
+            get_standard_error(self.SAMPLING_FUNC)
+        # ring of sample buffers, enough to cover all pixels in the pipeline at once
+        self._sample_buffers = numpy.empty((self.PIPELINE_QUEUE_SIZE + 3, self.N_SAMPLES))
+        self._next_buffer = 0
+        # raw capture: samples of each pixel are copied here by the reduce stage, padded with 0 if sequential
+        self._raw_samples = None
+        if self.RAW_CAPTURE:
+            self._raw_samples = numpy.zeros((len(assembler.rows), len(assembler.rows[0]), self.N_SAMPLES),
+                                            self.RAW_DTYPE)
+        self.pipeline = Pipeline(source, [('reduce', self._reduce_pixel), ('store', assembler.store)],
+                                self.PIPELINE_QUEUE_SIZE, self.PIPELINED)
+        return self.pipeline.run()
 
-    # Scan along an axis and return list of values
-    def _scan_axis(self, axis, start_pos, scan_range, step_size):
-        data = []
-        # move to start
-        self.motors.move_absolute(axis, start_pos)
+    # scan rows from first_row of a 2d image, appending them to writer if not None
+    # returns RowAssembler with the rows scanned, None if the scan was aborted
+    def _scan_rows(self, start_pos, img_size, pixel_size, first_row, writer, display_time, gui_prog, gui_row):
+        start_time = time.time()
+        rows = int(img_size[0]/pixel_size[0])
+        columns = int(img_size[1]/pixel_size[1]) + 1
+        # progress reported by consumer as each row is completed
+        assembler = RowAssembler(rows, columns, lambda i, row: self._row_completed(
+            i, row, rows, first_row, start_time, display_time, gui_prog, gui_row, writer, assembler,
+            self._row_end_position(i, start_pos, img_size, pixel_size)))
+        acquire = self._acquire_image_fly if self.FLY_SCAN else self._acquire_image
+        self.scan_timer.fly = self.FLY_SCAN
+        try:
+            completed = self._run_pipeline(lambda emit: acquire(emit, start_pos, img_size, pixel_size, first_row),
+                                            assembler)
+        finally:
+            # rows completed so far are kept in the file if the scan is aborted or fails
+            if writer is not None:
+                writer.close()
+        if display_time:
+            print(self.pipeline.summary())
+            self.scan_timer.gpib_update(self.motors.round_trips, self.motors.writes)
+            print(self.scan_timer.gpib_summary())
+            print(self.scan_timer.profile.summary())
+        return assembler if completed else None
+
+    # scan file for a 2d scan at save_path, or CHECKPOINT_FILE if None. The scan goes ahead without a
+    # checkpoint if CHECKPOINT_FILE can't be written
+    def _open_checkpoint(self, save_path, pixel_size, start_pos, img_size, shape):
+        path = save_path if save_path is not None else self.CHECKPOINT_FILE
+        if path is None:
+            return None
+        try:
+            return ScanFileWriter(path, pixel_size, start_pos, img_size, shape, fields=self._scan_fields(),
+                                    settings=self._scan_settings())
+        except OSError:
+            if save_path is not None:
+                raise
+            print('Could not write checkpoint file "{}", scan will not be resumable.'.format(path))
+            return None
+
+    # move and sample over image from first_row, emitting (row, column, samples, info) for each pixel
+    # descending scans the rows from last to first, flip starts the first row (every row if not serpentine)
+    # from the far end, so a region can be entered at any corner (see RegionPlanner)
+    def _acquire_image(self, emit, start_pos, img_size, pixel_size, first_row=0, descending=False, flip=False):
+        rows = int(img_size[0]/pixel_size[0])
+        row_index = lambda i: rows - 1 - i if descending else i
+        # move axis 0 to start
+        self._move_absolute(0, start_pos[0] + row_index(first_row)*pixel_size[0])
+        for i in range(first_row, rows):
+            # odd rows scanned in reverse when using serpentine raster
+            reverse = (self.SERPENTINE and i % 2 == 1) != flip
+            offset = self.BACKLASH_OFFSETS[int(reverse)]
+            if i > first_row:
+                # step to next row and move to its start together (at the same time if batching commands)
+                row_start = self._row_start(start_pos[1], img_size[1], pixel_size[1], reverse, offset)
+                self._move_batch([(0, -pixel_size[0] if descending else pixel_size[0]),
+                                    (1, row_start - self.motors.position[1])])
+            if not self._acquire_axis(emit, row_index(i), 1, start_pos[1], img_size[1], pixel_size[1], reverse,
+                                        offset, at_start=i > first_row):
+                return False
+        return True
+
+    # fly scan over image from first_row: axis 1 moves along each row in one move while the adc is read,
+    # then the readings are binned onto the row's pixels, emitting (row, column, samples, info) for each pixel
+    # descending and flip as for _acquire_image
+    def _acquire_image_fly(self, emit, start_pos, img_size, pixel_size, first_row=0, descending=False, flip=False):
+        rows = int(img_size[0]/pixel_size[0])
+        row_index = lambda i: rows - 1 - i if descending else i
+        columns = int(img_size[1]/pixel_size[1]) + 1
+        # perf_counter to time since epoch, for pixel timestamps
+        epoch = time.time() - time.perf_counter()
+        self._move_absolute(0, start_pos[0] + row_index(first_row)*pixel_size[0])
+        for i in range(first_row, rows):
+            reverse = (self.SERPENTINE and i % 2 == 1) != flip
+            first = start_pos[1] + self.BACKLASH_OFFSETS[int(reverse)]
+            row_start, row_end = self._fly_row_ends(first, pixel_size[1], columns, reverse)
+            if i > first_row:
+                self._move_batch([(0, -pixel_size[0] if descending else pixel_size[0]),
+                                    (1, row_start - self.motors.position[1])])
+            else:
+                self._move_absolute(1, row_start)
+            settle_time = self._settle()
+            t = time.perf_counter()
+            times, values, t0, t1 = self._fly_move(1, row_end - row_start)
+            read_time = (time.perf_counter() - t)/len(values)
+            positions = stage_positions(times - self.FLY_SENSOR_LAG, t0, t1, row_start, row_end, self.FLY_VELOCITY)
+            pixels = bin_readings(positions, first, pixel_size[1], columns)
+            for column in (range(columns - 1, -1, -1) if reverse else range(columns)):
+                samples = values[pixels[column]]
+                info = {'settle_time': settle_time if column == (columns - 1 if reverse else 0) else 0.0,
+                        'sample_count': len(samples)}
+                if self.RAW_CAPTURE:
+                    info['timestamp'] = epoch + float(numpy.mean(times[pixels[column]]))
+                self.scan_timer.read(len(samples), len(samples)*read_time)
+                emit((row_index(i), column, samples, info))
+            # abort scan
+            if self.end_flag:
+                self.end_flag = False
+                return False
+        return True
+
+    # move axis by distance in one move while reading the adc continuously, the move is made from another
+    # thread as the GPIB query only returns once it is complete. Returns (times of readings, readings, time the
+    # move was sent, time it completed) as perf_counter times
+    def _fly_move(self, axis, distance):
+        move = {}
+        def run():
+            move['t0'] = time.perf_counter()
+            try:
+                self.motors.move(axis, distance)
+            except Exception as e:
+                move['error'] = e
+            move['t1'] = time.perf_counter()
+        mover = threading.Thread(target=run, name='fly move')
+        mover.start()
+        times, values = self.adc.sample_continuous(mover.is_alive)
+        mover.join()
+        if 'error' in move:
+            raise move['error']
+        self.scan_timer.move(distance, move['t1'] - move['t0'])
+        return times, values, move['t0'], move['t1']
+
+    # (start, end) positions of axis 1 for a fly scan row with its first pixel at first, travelling half a
+    # pixel beyond the first and last pixels so they are sampled across their width
+    def _fly_row_ends(self, first, step_size, columns, reverse):
+        low = max(first - step_size/2, IMAGE_LIMITS[1][0])
+        high = min(first + (columns - 0.5)*step_size, IMAGE_LIMITS[1][1])
+        return (high, low) if reverse else (low, high)
+
+    # stage position once row i of a 2d scan (see _acquire_image) has been acquired, the end of the row
+    def _row_end_position(self, i, start_pos, img_size, pixel_size):
+        reverse = self.SERPENTINE and i % 2 == 1
+        offset = self.BACKLASH_OFFSETS[int(reverse)]
+        if self.FLY_SCAN:
+            columns = int(img_size[1]/pixel_size[1]) + 1
+            end = self._fly_row_ends(start_pos[1] + offset, pixel_size[1], columns, reverse)[1]
+        else:
+            end = self._row_start(start_pos[1], img_size[1], pixel_size[1], not reverse, offset)
+        return [start_pos[0] + i*pixel_size[0], end]
+
+    # position of the first pixel of a row, the far end if reversed
+    def _row_start(self, start_pos, scan_range, step_size, reverse, offset):
+        if reverse:
+            return start_pos + int(scan_range/step_size)*step_size + offset
+        return start_pos + offset
+
+    # Scan along an axis emitting (row, column, samples, info) for each pixel, columns numbered from start_pos
+    # info is a dict of per pixel measurements (settle_time, sample_count if sampling sequentially)
+    # reverse scans from the far end back to start_pos, offset is added to every position on the axis
+    # at_start: already at the first pixel. returns False if scan aborted
+    def _acquire_axis(self, emit, row, axis, start_pos, scan_range, step_size, reverse=False, offset=0,
+                        at_start=False):
+        n_steps = int(scan_range/step_size)
+        # move to start (far end of row if reversed)
+        if not at_start:
+            self._move_absolute(axis, self._row_start(start_pos, scan_range, step_size, reverse, offset))
+        if reverse:
+            step_size = -step_size
+            columns = range(n_steps, -1, -1)
+        else:
+            columns = range(n_steps + 1)
         # read first value
-        data.append(self.adc.read(self.N_SAMPLES, self.SAMPLING_FUNC))
-        # iterate over rest of values moving then adding value to the list
-        for i in range(int(scan_range/step_size)):
-            self.motors.move(axis, step_size)
-            # add 50ms pause for sensor to adjust to new position and prevent smearing.
-            time.sleep(0.05)
-            data.append(self.adc.read(self.N_SAMPLES, self.SAMPLING_FUNC))
+        samples, info = self._measure_pixel(0.0)
+        emit((row, columns[0], samples, info))
+        # iterate over rest of values moving then sampling
+        for column in columns[1:]:
+            self._move(axis, step_size)
+            # pause for sensor to adjust to new position and prevent smearing.
+            samples, info = self._measure_pixel(self._settle())
+            emit((row, column, samples, info))
             # abort scan
             if self.end_flag:
                 self.end_flag = False
-                return None
-        return data
+                return False
+        return True
+
+    # move to and sample each (i, j) point on a grid of pixel_size, emitting (0, index, samples, info)
+    def _acquire_points(self, emit, points, start_pos, pixel_size):
+        for k, (i, j) in enumerate(points):
+            self._move_batch([(0, start_pos[0] + i*pixel_size - self.motors.position[0]),
+                                (1, start_pos[1] + j*pixel_size - self.motors.position[1])])
+            samples, info = self._measure_pixel(self._settle())
+            emit((0, k, samples, info))
+            # abort scan
+            if self.end_flag:
+                self.end_flag = False
+                return False
+        return True
+
+    # reduce samples of a pixel to its value
+    def _reduce_pixel(self, item):
+        row, column, samples, info = item
+        if self._raw_samples is not None:
+            # fly scan pixels can have more readings than N_SAMPLES, only the first N_SAMPLES are kept
+            n = min(len(samples), self.N_SAMPLES)
+            self._raw_samples[row, column, :n] = samples[:n]
+        t = time.perf_counter()
+        value = float(self._reducer(samples))
+        self.scan_timer.profile.record('reduce', time.perf_counter() - t)
+        return row, column, value, info
+
+    # called by the consumer as each row of a 2d scan is completed
+    # rows before first_row were scanned before the scan was resumed
+    # position is where the stage was when the row was completed (the consumer runs behind the acquisition,
+    # so the motor controller's position has moved on)
+    def _row_completed(self, i, row, rows, first_row, start_time, display_time, gui_prog, gui_row, writer,
+                        assembler, position):
+        if writer is not None:
+            writer.append_row(row, **{field: self._raw_samples[i] if field == 'raw' else assembler.info[field][i]
+                                        for field in writer.header['fields'][1:]})
+            # checkpoint records where the stage was when the row was completed
+            writer.update_header(checkpoint={'rows_completed': i + 1, 'position': position})
+        if display_time and i > first_row:
+            # calculate time remaining
+            fraction_complete = (i + 1 - first_row)/(rows - first_row)
+            elapsed_time = time.time() - start_time
+            t_m, t_s = divmod(round((1/fraction_complete - 1) * elapsed_time), 60)
+            print('{perc}% complete: {t_m}m, {t_s}s remaining.'.format(perc=round((i + 1)/rows*100, 2),
+                                                        t_m=t_m, t_s=t_s))
+        # update gui progress bar and live image (don't update if exiting)
+        if gui_prog is not None and not self.end_flag:
+            self._emit(gui_prog, i)
+        if gui_row is not None and not self.end_flag:
+            self._emit(gui_row, i, list(row))
+
+    # emit a GUI signal, timing it as it runs the connected slots directly if they are in the same thread
+    def _emit(self, signal, *args):
+        t = time.perf_counter()
+        signal.emit(*args)
+        self.scan_timer.profile.record('gui_emit', time.perf_counter() - t)
+
+    # time a scan from now, the controllers record GPIB and adc latencies into the scan's profile while it runs
+    def _start_scan_timer(self):
+        self.scan_timer = ScanTimer(self.SETTLE_MODE, self.SAMPLING_MODE)
+        self.scan_timer.gpib_start(self.motors.round_trips, self.motors.writes)
+        self.motors.profile = self.adc.profile = self.scan_timer.profile
+
+    # append the profile of the completed scan to PROFILE_FILE, labelled with the scan method
+    def _log_profile(self, label):
+        if self.PROFILE_FILE is None:
+            return
+        try:
+            self.scan_timer.profile.append_csv(self.PROFILE_FILE, label)
+        except OSError:
+            # profile is still available in scan_timer
+            pass
+
+    # per pixel values saved in scan files
+    def _scan_fields(self):
+        fields = ['data', 'settle_time']
+        if self.SAMPLING_MODE == 'sequential' or self.FLY_SCAN:
+            fields.append('sample_count')
+        if self.RAW_CAPTURE:
+            fields += ['timestamp', ('raw', self.RAW_DTYPE, (self.N_SAMPLES,))]
+        return fields
+
+    # settings saved with scan files
+    def _scan_settings(self):
+        return {name: getattr(self, name) for name in SCAN_SETTINGS}
+
+    # move axis by distance, timing moves for scan time estimates
+    def _move(self, axis, distance):
+        t = time.perf_counter()
+        self.motors.move(axis, distance)
+        if distance != 0:
+            self.scan_timer.move(distance, time.perf_counter() - t)
+
+    # move several axes, moves is a list of (axis, distance), at the same time if the motor controller is
+    # batching commands (timed as one move of the longest distance)
+    def _move_batch(self, moves):
+        moves = [(axis, distance) for axis, distance in moves if distance != 0]
+        if not self.motors.BATCH_COMMANDS or len(moves) < 2:
+            for axis, distance in moves:
+                self._move(axis, distance)
+            return
+        distance = max(abs(distance) for axis, distance in moves)
+        t = time.perf_counter()
+        # responses aren't read until the time the travel is expected to take
+        self.motors.move_batch(moves, expected_duration=distance*self.planner.model['move_per_mm'])
+        self.scan_timer.move(distance, time.perf_counter() - t)
+
+    def _move_absolute(self, axis, to_position):
+        self._move(axis, to_position - self.motors.position[axis])
+
+    # wait for sensor to adjust to the new position, returns time waited
+    def _settle(self):
+        t = time.perf_counter()
+        if self.SETTLE_MODE == 'adaptive':
+            self._wait_for_stable_reading(t + self.SETTLE_MAX_WAIT)
+        else:
+            time.sleep(self.SETTLE_TIME)
+        waited = time.perf_counter() - t
+        self.scan_timer.settle(waited)
+        return waited
+
+    # poll the adc until the means of consecutive windows of readings agree within SETTLE_TOLERANCE
+    # returns False if deadline reached first
+    def _wait_for_stable_reading(self, deadline):
+        previous = None
+        while time.perf_counter() < deadline:
+            current = float(reduce_mean(self.adc.sample(self.SETTLE_WINDOW)))
+            if previous is not None and abs(current - previous) <= self.SETTLE_TOLERANCE:
+                return True
+            previous = current
+        return False
+
+    # take samples for a pixel into the next buffer of the ring, returns (samples, info)
+    def _measure_pixel(self, settle_time):
+        buffer = self._sample_buffers[self._next_buffer]
+        self._next_buffer = (self._next_buffer + 1) % len(self._sample_buffers)
+        info = {'settle_time': settle_time}
+        if self.RAW_CAPTURE:
+            info['timestamp'] = time.time()
+        t = time.perf_counter()
+        if self.SAMPLING_MODE == 'sequential':
+            samples = self.adc.sample_sequential(self.SAMPLING_FUNC, self.SEQUENTIAL_TARGET_SE,
+                                                self.SEQUENTIAL_MIN_SAMPLES, self.N_SAMPLES, buffer)
+            info['sample_count'] = len(samples)
+        else:
+            samples = self.adc.sample(self.N_SAMPLES, buffer)
+        self.scan_timer.read(len(samples), time.perf_counter() - t)
+        return samples, info
 
     def check2dDimensions(self, start, img_size, step):
         img_end = (start[0]+img_size[0], start[1]+img_size[1])
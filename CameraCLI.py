@@ -0,0 +1,167 @@
+# Command line interface for the camera, see docs/CLI.txt
+# usage: python CameraCLI.py 2d 20 15 25 25 0.1 --n_sample=40 -max -heat1
+# Only the modules needed for the scan are imported, Qt and pyplot are only loaded to display the plot
+# (saved images use matplotlib's Agg backend)
+import argparse
+import datetime
+import os
+import sys
+import time
+
+PROGRAM_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(PROGRAM_DIRECTORY, 'lib'))
+
+DATA_PREFIX = 'scan'
+
+# command line option: PlotStyles display name
+CMAP_OPTIONS = (('inferno', 'Inferno'), ('heat1', 'Heat 1'), ('heat2', 'Heat 2'), ('grey1', 'Grayscale'),
+                ('grey2', 'Grayscale Reversed'))
+INTERPOLATION_OPTIONS = (('nearest', 'Nearest'), ('linear', 'Linear'), ('cubic', 'Cubic'), ('sinc', 'Sinc'))
+SAMPLE_FUNC_OPTIONS = ('rms', 'rms2', 'max', 'average')
+
+def timetostring(time_int):
+    return datetime.datetime.fromtimestamp(int(time_int)).strftime('%Y-%m-%d-%H-%M-%S')
+
+
+# options shared by 1d and 2d scans, single dash flags as documented in docs/CLI.txt
+def add_options(parser):
+    parser.add_argument('--n_sample', type=int, default=20, help='samples per pixel (default 20)')
+    group = parser.add_mutually_exclusive_group()
+    for name in SAMPLE_FUNC_OPTIONS:
+        group.add_argument('-' + name, dest='sample_func', action='store_const', const=name,
+                            help='sampling function {}'.format(name))
+    group.add_argument('--sample_func', dest='sample_func', help='any other sampling function (see Reducers)')
+    parser.add_argument('-save_image', action='store_true', help='save an image of the plot to Images/')
+    parser.add_argument('-save_csv', action='store_true', help='save data as .csv to CsvData/')
+    group = parser.add_mutually_exclusive_group()
+    for option, name in CMAP_OPTIONS:
+        group.add_argument('-' + option, dest='cmap', action='store_const', const=name,
+                            help='{} colour map'.format(name))
+    group = parser.add_mutually_exclusive_group()
+    for option, name in INTERPOLATION_OPTIONS:
+        group.add_argument('-' + option, dest='interpolation', action='store_const', const=name,
+                            help='{} interpolation'.format(name.lower()))
+    parser.add_argument('--simulate', action='store_true', help='use the simulated hardware backend')
+    parser.set_defaults(sample_func='rms', cmap='Inferno', interpolation='Nearest')
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='CameraCLI', allow_abbrev=False,
+                                    description='Scan with the MWIR scanning camera without the GUI.')
+    subparsers = parser.add_subparsers(dest='mode')
+    subparsers.required = True
+    parser_1d = subparsers.add_parser('1d', allow_abbrev=False, help='scan along one axis')
+    parser_1d.add_argument('axis', choices=('x', 'y'))
+    parser_1d.add_argument('other_axis_pos', type=float, help='position of the other axis (mm)')
+    parser_1d.add_argument('start', type=float, help='start position (mm)')
+    parser_1d.add_argument('range', type=float, help='range of scan (mm)')
+    parser_1d.add_argument('step', type=float, help='step size (mm)')
+    add_options(parser_1d)
+    parser_2d = subparsers.add_parser('2d', allow_abbrev=False, help='scan an image')
+    parser_2d.add_argument('start_x', type=float, help='x start position (mm)')
+    parser_2d.add_argument('start_y', type=float, help='y start position (mm)')
+    parser_2d.add_argument('range_x', type=float, help='x range of scan (mm)')
+    parser_2d.add_argument('range_y', type=float, help='y range of scan (mm)')
+    parser_2d.add_argument('step_x', type=float, help='x step size (mm)')
+    parser_2d.add_argument('step_y', type=float, nargs='?', help='y step size (mm), defaults to step_x')
+    add_options(parser_2d)
+    return parser
+
+
+# message for errors from the hardware or scan settings, as shown by the GUI, None for other errors
+def error_message(e):
+    from CustomExceptions import (ImageDimensionError, AdcError, MotorControllerInvalidCommandError,
+                                    MotorControllerConnectionError, MotorControllerError, VisaIOError)
+    messages = (
+        (ImageDimensionError, 'Invalid settings for image dimensions.'),
+        (AdcError, 'Cannot connect to ADC board, ensure USB is plugged in.'),
+        (MotorControllerInvalidCommandError, 'Communication with motor controller failed, try switching on and off and restarting software.'),
+        (MotorControllerConnectionError, 'Cannot connect to motor controller, ensure USB is plugged in.'),
+        (MotorControllerError, 'Unexpected behaviour from Motor Control Unit, try resetting the unit.'),
+        (VisaIOError, 'Lost connection to motor controller (timed out), ensure USB is plugged in.'),
+    )
+    for error, message in messages:
+        if isinstance(e, error):
+            return message
+    return None
+
+
+# simulated scans don't update the timing model or profile log of the equipment
+def make_camera(simulate):
+    from Camera import Camera
+    if simulate:
+        from SimulatedHardware import simulated_controllers
+        from ScanPlanner import ScanPlanner
+        motors, adc, stage = simulated_controllers()
+        camera = Camera(motors=motors, adc=adc)
+        camera.planner = ScanPlanner(None)
+        camera.PROFILE_FILE = None
+        return camera
+    return Camera()
+
+
+def scan(camera, args):
+    camera.set_sampling_variables(args.n_sample, args.sample_func)
+    from ScanFile import SCAN_FILE_EXTENSION
+    save_path = 'ScanData/{pre}-{t}-{mode}{ext}'.format(pre=DATA_PREFIX, t=timetostring(time.time()),
+                                                        mode=args.mode, ext=SCAN_FILE_EXTENSION)
+    if args.mode == '1d':
+        return camera.scan_row(int(args.axis == 'y'), args.other_axis_pos, args.start, args.range, args.step,
+                                save_path=save_path)
+    step_y = args.step_y if args.step_y is not None else args.step_x
+    return camera.scan_image((args.start_x, args.start_y), (args.range_x, args.range_y), (args.step_x, step_y),
+                            save_path=save_path)
+
+
+def output(data, args):
+    if args.save_csv:
+        import numpy
+        path = 'CsvData/data-{}.csv'.format(timetostring(data.timestamp))
+        numpy.savetxt(path, data.data, fmt='%.17g', delimiter=',')
+        print('Data saved to {}'.format(path))
+    if args.save_image:
+        from PlotStyles import save_image
+        path = 'Images/image-{}.png'.format(timetostring(data.timestamp))
+        save_image(data, path, args.interpolation, args.cmap)
+        print('Image saved to {}'.format(path))
+    if not args.save_csv and not args.save_image:
+        from matplotlib import pyplot
+        from PlotStyles import draw_scan
+        draw_scan(pyplot.gca(), data, args.interpolation, args.cmap)
+        pyplot.show()
+
+
+def main(argv):
+    args = make_parser().parse_args(argv)
+    # ScanData, Images and CsvData are in the program directory, as for the GUI
+    os.chdir(PROGRAM_DIRECTORY)
+    from Reducers import get_reducer
+    try:
+        get_reducer(args.sample_func)
+    except ValueError as e:
+        print(e)
+        return 2
+    camera = make_camera(args.simulate)
+    try:
+        data = scan(camera, args)
+    except KeyboardInterrupt:
+        # the acquisition thread stops at the next pixel, the devices are closed once it has
+        camera.end_flag = True
+        if camera.pipeline is not None:
+            camera.pipeline.wait()
+        print('Scan aborted.')
+        return 1
+    except Exception as e:
+        message = error_message(e)
+        if message is None:
+            raise
+        print('{}\n{}: {}'.format(message, type(e).__name__, e))
+        return 1
+    finally:
+        camera.close()
+    output(data, args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,19 +1,20 @@
-import os, sys, datetime, csv, time, ctypes
+import os, sys, datetime, time, ctypes, pickle
 from PyQt5.QtWidgets import (QWidget, QLabel, QHBoxLayout, QVBoxLayout, QGridLayout,
                             QComboBox, QTabWidget, QDialog, QProgressDialog,
                             QFileDialog, QMenu, QMenuBar, QAction, QMainWindow,
                             QApplication)
-from PyQt5.QtCore import pyqtSignal, QThread
+from PyQt5.QtCore import pyqtSignal, QThread, QTimer
 from PyQt5.QtGui import QIcon
 
 # if FakeControllers is imported this is overwritten.
 DATA_PREFIX = 'scan'
 
 from Camera import *
-from GUI.PlotCanvas import PlotCanvas
+import PlotStyles
 from GUI.SettingsTabs import SettingsTab1D, SettingsTab2D
-from GUI.ScanThreads import Scan2DThread, Scan1DThread
+from GUI.ScanThreads import Scan2DThread, Scan1DThread, ResumeScanThread
 from GUI.ErrorMessage import ErrorMessage
+from ScanFile import ScanFile, ScanFileError, load_scan, load_legacy, SCAN_FILE_EXTENSION, LEGACY_EXTENSION
 
 # function to get printable date from timestamp
 def timetostring(time_int, forfile=False):
@@ -24,8 +25,8 @@ class CameraGUI(QMainWindow):
 
     def __init__(self):
         super().__init__()
-        self.initUI()
         self.camera = Camera()
+        self.initUI()
 
     def initUI(self):
         # main layout
@@ -40,8 +41,8 @@ class CameraGUI(QMainWindow):
         hBoxMain.addLayout(self.init_plot_panel())
         # tabs for settings
         settingsTabs = QTabWidget()
-        self.settings2d = SettingsTab2D(self.scan_2D)
-        self.settings1d = SettingsTab1D(self.scan_1D)
+        self.settings2d = SettingsTab2D(self.scan_2D, self.camera)
+        self.settings1d = SettingsTab1D(self.scan_1D, self.camera)
         settingsTabs.addTab(self.settings2d, '2D')
         settingsTabs.addTab(self.settings1d, '1D')
         hBoxMain.addWidget(settingsTabs)
@@ -62,6 +63,12 @@ class CameraGUI(QMainWindow):
         openAction.setStatusTip('Open a saved data file.')
         openAction.triggered.connect(self.open_file)
         fileMenu.addAction(openAction)
+        # resume scan action
+        resumeAction = QAction('&Resume Scan', self)
+        resumeAction.setShortcut('Ctrl+R')
+        resumeAction.setStatusTip('Continue an aborted or failed 2D scan from its saved rows.')
+        resumeAction.triggered.connect(self.resume_scan)
+        fileMenu.addAction(resumeAction)
         # save image file action
         saveAction = QAction('&Save As Image', self)
         saveAction.setShortcut('Ctrl+S')
@@ -76,17 +83,18 @@ class CameraGUI(QMainWindow):
         fileMenu.addAction(saveCsvAction)
 
     def init_plot_panel(self):
-        # plot items
-        self.plot_canvas = PlotCanvas()
+        # plot items, the canvas is created once the window is shown (see init_plot_canvas)
+        self._plot_canvas = None
+        self.plot_placeholder = QLabel('Loading plot...')
         self.plot_info = QLabel('No plot to display.\n\n')
         # 2d settings
         self.plot_settings_2d = QWidget()
         plot_settings_2d_layout = QHBoxLayout(self.plot_settings_2d)
         self.interpolation_control = QComboBox()
-        self.interpolation_control.addItems(list(PlotCanvas.INTERPOLATIONS.keys()))
+        self.interpolation_control.addItems(list(PlotStyles.INTERPOLATIONS.keys()))
         self.interpolation_control.currentIndexChanged.connect(self.update_plot_2d)
         self.colour_control = QComboBox()
-        self.colour_control.addItems(list(PlotCanvas.CMAPS.keys()))
+        self.colour_control.addItems(list(PlotStyles.CMAPS.keys()))
         self.colour_control.currentIndexChanged.connect(self.update_plot_2d)
         plot_settings_2d_layout.addWidget(QLabel('Interpolation mode: '))
         plot_settings_2d_layout.addWidget(self.interpolation_control)
@@ -94,12 +102,30 @@ class CameraGUI(QMainWindow):
         plot_settings_2d_layout.addWidget(self.colour_control)
         self.plot_settings_2d.setVisible(False)
         # vbox for plot
-        vBoxPlot = QVBoxLayout()
-        vBoxPlot.addStretch(1)
-        vBoxPlot.addWidget(self.plot_canvas)
-        vBoxPlot.addWidget(self.plot_info)
-        vBoxPlot.addWidget(self.plot_settings_2d)
-        return vBoxPlot
+        self.plot_layout = QVBoxLayout()
+        self.plot_layout.addStretch(1)
+        self.plot_layout.addWidget(self.plot_placeholder)
+        self.plot_layout.addWidget(self.plot_info)
+        self.plot_layout.addWidget(self.plot_settings_2d)
+        QTimer.singleShot(0, self.init_plot_canvas)
+        return self.plot_layout
+
+    # matplotlib's Qt backend takes longer to import than the rest of the GUI, so it is imported after the
+    # window is first shown and the canvas replaces the placeholder (or when the canvas is first used if sooner)
+    def init_plot_canvas(self):
+        if self._plot_canvas is None:
+            from GUI.PlotCanvas import PlotCanvas
+            self._plot_canvas = PlotCanvas()
+            self.plot_layout.replaceWidget(self.plot_placeholder, self._plot_canvas)
+            self.plot_placeholder.deleteLater()
+            # lay out now so the figure has its size before anything is drawn
+            self.plot_layout.activate()
+            self._plot_canvas.show()
+        return self._plot_canvas
+
+    @property
+    def plot_canvas(self):
+        return self.init_plot_canvas()
 
     def scan_2D(self, step, start, scan_range, samples, samplefunc):
         # disable button
@@ -110,11 +136,51 @@ class CameraGUI(QMainWindow):
         self.progress_dialog = QProgressDialog('2D Scan in progress.', 'Abort', 0, int(scan_range[0]/step[0])-1)
         self.progress_dialog.setWindowTitle('Scan Progress')
         self.progress_dialog.setMinimumDuration(500)
-        # run scan in parallel to gui
-        self.scan_thread = Scan2DThread(step, start, scan_range, self.camera)
+        # run scan in parallel to gui, rows are saved to file as they are scanned
+        fileName = 'ScanData/{pre}-{t}-2d{ext}'.format(
+            pre=DATA_PREFIX, t=timetostring(time.time(), True), ext=SCAN_FILE_EXTENSION)
+        self.scan_thread = Scan2DThread(step, start, scan_range, self.camera, fileName)
         self.progress_dialog.canceled.connect(self.scan_2d_canceled)
         self.scan_thread.return_data.connect(self.scan_2d_completed)
         self.scan_thread.progress.connect(self.progress_dialog.setValue)
+        # show rows on plot as they are scanned
+        self.plot_canvas.start_live_2d(start, scan_range, step, self.interpolation_control.currentText(),
+                                        self.colour_control.currentText())
+        self.scan_thread.row_data.connect(self.plot_canvas.update_live_row)
+        self.scan_thread.error_passback.connect(lambda e, msg: self.scan_error(e, msg, self.settings2d.button))
+        self.scan_thread.start()
+
+    def resume_scan(self):
+        fileName = QFileDialog.getOpenFileName(self, 'Select an incomplete 2D scan to resume.', 'ScanData/',
+                                                'Scan data (*{})'.format(SCAN_FILE_EXTENSION))
+        if fileName[0] == '':
+            return
+        try:
+            scan_file = ScanFile(fileName[0])
+            scan_file.check_resumable()
+        except ScanFileError as e:
+            ErrorMessage(e, 'Scan cannot be resumed from this file.\nSee "Show Details" for info.')
+            return
+        header = scan_file.header
+        rows = scan_file.field('data')
+        # disable button
+        self.settings2d.button.setEnabled(False)
+        # start progress dialog
+        self.progress_dialog = QProgressDialog('Resuming 2D scan.', 'Abort', 0, header['shape'][0]-1)
+        self.progress_dialog.setWindowTitle('Scan Progress')
+        self.progress_dialog.setMinimumDuration(500)
+        self.progress_dialog.setValue(scan_file.rows_written)
+        self.scan_thread = ResumeScanThread(fileName[0], self.camera)
+        self.progress_dialog.canceled.connect(self.scan_2d_canceled)
+        self.scan_thread.return_data.connect(self.scan_2d_completed)
+        self.scan_thread.progress.connect(self.progress_dialog.setValue)
+        # show rows already scanned then the rest as they are scanned
+        self.plot_canvas.start_live_2d(header['start'], header['scan_range'], header['step'],
+                                        self.interpolation_control.currentText(), self.colour_control.currentText())
+        for i, row in enumerate(rows):
+            self.plot_canvas.update_live_row(i, list(row))
+        scan_file.close()
+        self.scan_thread.row_data.connect(self.plot_canvas.update_live_row)
         self.scan_thread.error_passback.connect(lambda e, msg: self.scan_error(e, msg, self.settings2d.button))
         self.scan_thread.start()
 
@@ -122,16 +188,15 @@ class CameraGUI(QMainWindow):
         self.data = data
         # show result
         self.update_plot_2d()
-        # save data to file
-        fileName = 'ScanData/{pre}-{t}-2d.scandat'.format(
-            pre=DATA_PREFIX, t=timetostring(self.data.timestamp, True))
-        with open(fileName, 'wb') as f:
-            pickle.dump(self.data, f)
+        # estimates refined using timings from this scan
+        self.settings2d.updateEstimate()
         # enable button
         self.settings2d.button.setEnabled(True)
 
     def scan_2d_canceled(self):
         self.scan_thread.abort()
+        # rows still in flight from the scan are ignored
+        self.plot_canvas.stop_live()
         # self.progress_dialog.close()
         self.settings2d.button.setEnabled(True)
 
@@ -159,7 +224,9 @@ class CameraGUI(QMainWindow):
         self.progress_dialog.setRange(0, 0)
         self.progress_dialog.setValue(0)
         self.progress_dialog.show()
-        self.scan_thread = Scan1DThread(axis, other_axis_pos, step, start, scan_range, self.camera)
+        fileName = 'ScanData/{pre}-{t}-1d{ext}'.format(
+            pre=DATA_PREFIX, t=timetostring(time.time(), True), ext=SCAN_FILE_EXTENSION)
+        self.scan_thread = Scan1DThread(axis, other_axis_pos, step, start, scan_range, self.camera, fileName)
         self.scan_thread.return_data.connect(self.scan_1d_completed)
         self.progress_dialog.canceled.connect(self.scan_1d_canceled)
         self.scan_thread.error_passback.connect(lambda e, msg: self.scan_error(e, msg, self.settings1d.button))
@@ -170,11 +237,8 @@ class CameraGUI(QMainWindow):
         self.data = data
         # show result
         self.update_plot_1d()
-        # save data to file
-        fileName = 'ScanData/{pre}-{t}-1d.scandat'.format(
-            pre=DATA_PREFIX, t=timetostring(self.data.timestamp, True))
-        with open(fileName, 'wb') as f:
-            pickle.dump(self.data, f)
+        # estimates refined using timings from this scan
+        self.settings1d.updateEstimate()
         # enable button
         self.settings1d.button.setEnabled(True)
 
@@ -196,28 +260,28 @@ class CameraGUI(QMainWindow):
         self.plot_settings_2d.setVisible(False)
 
     def open_file(self):
-        fileName = QFileDialog.getOpenFileName(self, 'Select a data file to open.',
-                                                'ScanData/', 'Scan data (*.scandat)')
+        fileName = QFileDialog.getOpenFileName(self, 'Select a data file to open.', 'ScanData/',
+                                                'Scan data (*{} *{})'.format(SCAN_FILE_EXTENSION, LEGACY_EXTENSION))
         if fileName[0] == '':
             return
-        with open(fileName[0], 'rb') as f:
-            try:
-                data = pickle.load(f)
-            except pickle.UnpicklingError as e:
-                ErrorMessage(e, 'Could not load file. \nFile may be corrupted.')
-                return
-        if type(data) is ScanData:
-            self.data = data
-            try:
-                if data.scan_axis is not None:
-                    self.update_plot_1d()
-                else:
-                    self.update_plot_2d()
-            except AttributeError:
-                # first scans performed didn't implement scan_axis (but are all 2d)
+        try:
+            if fileName[0].endswith(LEGACY_EXTENSION):
+                # only ScanData is loaded from old pickled files
+                data = load_legacy(fileName[0])
+            else:
+                data = load_scan(fileName[0])
+        except (ScanFileError, pickle.UnpicklingError) as e:
+            ErrorMessage(e, 'Could not load file. \nFile may be corrupted.')
+            return
+        self.data = data
+        try:
+            if data.scan_axis is not None:
+                self.update_plot_1d()
+            else:
                 self.update_plot_2d()
-        else:
-            ErrorMessage(None, 'File loaded but does not contain correct ScanData type.')
+        except AttributeError:
+            # first scans performed didn't implement scan_axis (but are all 2d)
+            self.update_plot_2d()
 
     def save_file(self):
 
@@ -234,9 +298,8 @@ class CameraGUI(QMainWindow):
                     'CSV File (*.csv)')
         if fileName[0] == '':
             return
-        with open(fileName[0], 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerows(self.data.data)
+        # %.17g keeps full precision without the exponent of numpy's default format
+        numpy.savetxt(fileName[0], self.data.data, fmt='%.17g', delimiter=',')
 
     # close necessary features when app exited
     def closeEvent(self, event):
@@ -245,6 +308,7 @@ class CameraGUI(QMainWindow):
 
     # if error in scan, displays message and enables button
     def scan_error(self, e, msg, button):
+        self.plot_canvas.stop_live()
         ErrorMessage(e, msg)
         button.setEnabled(True)
 
@@ -1,27 +1,21 @@
 from PyQt5.QtWidgets import QSizePolicy
+from PyQt5.QtCore import QTimer
 
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
-from matplotlib import pyplot
 
 import numpy
-from collections import OrderedDict
+import time
+
+import PlotStyles
+from ImagePyramid import ImagePyramid
 
 class PlotCanvas(FigureCanvas):
 
-    INTERPOLATIONS = OrderedDict([
-        ('Nearest'              ,   'nearest'),
-        ('Linear'               ,   'bilinear'),
-        ('Cubic'                ,   'bicubic'),
-        ('Sinc'                 ,   'sinc')
-    ])
-    CMAPS = OrderedDict([
-        ('Inferno'              ,   'inferno'),
-        ('Heat 1'               ,   'gist_heat'),
-        ('Grayscale'            ,   'gray'),
-        ('Heat 2'               ,   'hot'),
-        ('Grayscale Reversed'   ,   'Greys')
-    ])
+    INTERPOLATIONS = PlotStyles.INTERPOLATIONS
+    CMAPS = PlotStyles.CMAPS
+    # minimum time (s) between redraws of the image while scanning
+    LIVE_REDRAW_INTERVAL = 0.5
 
 
     def __init__(self, dpi=100):
@@ -30,6 +24,12 @@ class PlotCanvas(FigureCanvas):
 
         # function None when nothing to show on plot.
         self.draw_plot_func = None
+        # image updated row by row during a scan, None when not scanning
+        self.live_image = None
+        self.live_background = None
+        # pyramid of the 2d scan shown and the scan, kept while the same scan is redrawn (e.g. colour map changes)
+        self.pyramid = None
+        self.pyramid_data = None
 
         self.show_initial_figure()
 
@@ -37,14 +37,22 @@ class PlotCanvas(FigureCanvas):
 
         # connect mouse click
         self.fig.canvas.mpl_connect('button_press_event', self.clicked)
+        # background for blitting live image must be recaptured after a full redraw (e.g. resize)
+        self.fig.canvas.mpl_connect('draw_event', self._capture_live_background)
+        # redraw of rows received within LIVE_REDRAW_INTERVAL of the last redraw
+        self.live_timer = QTimer()
+        self.live_timer.setSingleShot(True)
+        self.live_timer.timeout.connect(self._redraw_live)
 
         # set figure sizing properties
         FigureCanvas.setSizePolicy(self, QSizePolicy.Expanding, QSizePolicy.Expanding)
         FigureCanvas.updateGeometry(self)
 
+    # pyplot is only imported once a plot is opened in its own window, saving its import at startup
     def clicked(self, event):
         if self.draw_plot_func != None:
-            self.draw_plot_func()
+            from matplotlib import pyplot
+            self.draw_plot_func(pyplot)
             if self.plot_axis == None:
                 pyplot.xlabel('x position (mm)')
                 pyplot.ylabel('y position (mm)')
@@ -57,32 +65,85 @@ class PlotCanvas(FigureCanvas):
     def show_initial_figure(self):
         pass
 
+    # set up empty image to be filled in by update_live_row during a 2d scan
+    def start_live_2d(self, start, scan_range, step, interp, cmap):
+        self.live_data = numpy.full((int(scan_range[0]/step[0]), int(scan_range[1]/step[1]) + 1), numpy.nan)
+        self.live_last_redraw = 0
+        self.axis.cla()
+        self.axis.grid(False)
+        extent = [start[0], start[0]+scan_range[0], start[1]+scan_range[1], start[1]]
+        # animated so the image is left out of full draws and can be blitted over the background
+        self.live_image = self.axis.imshow(numpy.transpose(self.live_data), interpolation=self.INTERPOLATIONS[interp],
+                                            cmap=self.CMAPS[cmap], extent=extent, animated=True)
+        self.axis.axis(extent)
+        self.draw_plot_func = None
+        self.draw()
+
+    # store row i of the live image, redrawing at most once every LIVE_REDRAW_INTERVAL
+    def update_live_row(self, i, row):
+        if self.live_image is None:
+            return
+        self.live_data[i] = row
+        wait = self.LIVE_REDRAW_INTERVAL - (time.perf_counter() - self.live_last_redraw)
+        if wait <= 0:
+            self._redraw_live()
+        elif not self.live_timer.isActive():
+            self.live_timer.start(int(wait*1000))
+
+    def _redraw_live(self):
+        if self.live_image is None or self.live_background is None:
+            return
+        self.live_last_redraw = time.perf_counter()
+        self.live_image.set_data(numpy.transpose(self.live_data))
+        if not numpy.isnan(self.live_data).all():
+            self.live_image.set_clim(numpy.nanmin(self.live_data), numpy.nanmax(self.live_data))
+        # blit image over saved background rather than redrawing whole figure
+        self.restore_region(self.live_background)
+        self.axis.draw_artist(self.live_image)
+        self.blit(self.axis.bbox)
+
+    def _capture_live_background(self, event):
+        if self.live_image is not None:
+            self.live_background = self.copy_from_bbox(self.axis.bbox)
+            self.axis.draw_artist(self.live_image)
+
+    # end live updating, image is then drawn as normal (the rows scanned so far if the scan was stopped)
+    def stop_live(self):
+        self.live_timer.stop()
+        if self.live_image is not None:
+            self.live_image.set_animated(False)
+            self.draw_idle()
+        self.live_image = None
+        self.live_background = None
+
+    # image drawn from the scan's pyramid at the canvas' resolution, redrawing the same scan only redraws the
+    # downsampled level shown
     def update_plot_2d(self, data, interp, cmap):
+        self.stop_live()
+        if self.pyramid_data is not data:
+            self.pyramid = ImagePyramid(data.data)
+            self.pyramid_data = data
+        pyramid = self.pyramid
         self.axis.cla()
         self.axis.grid(False)
-        imshow_args = {
-            'X': numpy.transpose(data.data),
-            'interpolation': self.INTERPOLATIONS[interp],
-            'cmap': self.CMAPS[cmap],
-            'extent': [data.start[0], data.start[0]+data.scan_range[0], data.start[1]+data.scan_range[1], data.start[1]] }
-        self.axis.imshow(**imshow_args)
-        self.axis.axis(imshow_args['extent'])
+        PlotStyles.draw_pyramid(self.axis, data, pyramid, interp, cmap)
         self.draw()
-        # create function for showing figure in interactive window
-        self.draw_plot_func = lambda: pyplot.imshow(**imshow_args)
+        # create function for showing figure in interactive window, the pyramid is shared with it
+        self.draw_plot_func = lambda pyplot: PlotStyles.draw_pyramid(pyplot.gca(), data, pyramid, interp, cmap)
         # indicate 2d
         self.plot_axis = None
 
     def update_plot_1d(self, data):
+        self.stop_live()
+        self.pyramid = None
+        self.pyramid_data = None
         self.plot_axis = 'y' if data.scan_axis else 'x'
         self.axis.cla()
         self.axis.set_aspect('auto')
-        self.axis.axis([data.start, data.start+data.scan_range, 0, max(data.data)])
+        self.axis.axis([data.start, data.start+data.scan_range, 0, numpy.nanmax(data.data)])
         self.axis.grid(True)
-        plot_args = [numpy.arange(data.start, data.start+data.scan_range+data.step, data.step), data.data]
-        # in a couple of edge cases there's an off by one error here from integer division in different places
-        plot_args[0] = plot_args[0][:len(plot_args[1])]
+        plot_args = [data.positions, data.data]
         self.axis.set_xlabel('{} position (mm)'.format(self.plot_axis))
         self.axis.plot(*plot_args)
         self.draw()
-        self.draw_plot_func = lambda: pyplot.plot(*plot_args)
+        self.draw_plot_func = lambda pyplot: pyplot.plot(*plot_args)
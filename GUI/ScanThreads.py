@@ -1,5 +1,7 @@
 from PyQt5.QtCore import pyqtSignal, QThread
 from ScanDataStruct import ScanData
+from ScanFile import ScanFileError
+import CustomExceptions
 from CustomExceptions import *
 import types
 
@@ -22,9 +24,12 @@ def camera_exception_handler(func):
         except MotorControllerError as e:
             # unexpected behaviour from Control Unit
             self.error_passback.emit(e, 'Unexpected behaviour from Motor Control Unit, try resetting the unit.')
-        except VisaIOError as e:
+        except CustomExceptions.VisaIOError as e:
             # lost connection to MotorController and timed out
             self.error_passback.emit(e, 'Lost connection to motor controller (timed out), ensure USB is plugged in.')
+        except ScanFileError as e:
+            # checkpoint file can't be resumed
+            self.error_passback.emit(e, 'Could not resume scan from file.\nSee "Show Details" for info.')
 
     return wrapped_scan_thread
 
@@ -32,15 +37,18 @@ def camera_exception_handler(func):
 class Scan2DThread(QThread):
 
     progress = pyqtSignal(int)
+    # index and values of each row as it is completed
+    row_data = pyqtSignal(int, list)
     return_data = pyqtSignal(ScanData)
     error_passback = pyqtSignal(Exception, str)
 
-    def __init__(self, step, start, scan_range, camera):
+    def __init__(self, step, start, scan_range, camera, save_path=None):
         QThread.__init__(self)
         self.step = step
         self.start_pos = start
         self.scan_range = scan_range
         self.camera = camera
+        self.save_path = save_path
 
     def abort(self):
         self.camera.end_flag = True
@@ -50,7 +58,22 @@ class Scan2DThread(QThread):
         # ensure flag is set to False (fixes problems with QProgressDialog exiting)
         self.camera.end_flag = False
         data = self.camera.scan_image(self.start_pos, self.scan_range, self.step, display_time=False,
-                                    gui_prog=self.progress)
+                                    gui_prog=self.progress, gui_row=self.row_data, save_path=self.save_path)
+        if data is not None:
+            self.return_data.emit(data)
+
+# continues a 2d scan from its checkpoint file
+class ResumeScanThread(Scan2DThread):
+
+    def __init__(self, checkpoint, camera):
+        Scan2DThread.__init__(self, None, None, None, camera)
+        self.checkpoint = checkpoint
+
+    @camera_exception_handler
+    def run(self):
+        self.camera.end_flag = False
+        data = self.camera.resume_scan(self.checkpoint, display_time=False, gui_prog=self.progress,
+                                        gui_row=self.row_data)
         if data is not None:
             self.return_data.emit(data)
 
@@ -59,7 +82,7 @@ class Scan1DThread(QThread):
     return_data = pyqtSignal(ScanData)
     error_passback = pyqtSignal(Exception, str)
 
-    def __init__(self, axis, other_axis_pos, step, start, scan_range, camera):
+    def __init__(self, axis, other_axis_pos, step, start, scan_range, camera, save_path=None):
         QThread.__init__(self)
         self.axis = axis
         self.other_axis_pos = other_axis_pos
@@ -67,6 +90,7 @@ class Scan1DThread(QThread):
         self.start_pos = start
         self.scan_range = scan_range
         self.camera = camera
+        self.save_path = save_path
 
     def abort(self):
         self.camera.end_flag = True
@@ -74,6 +98,7 @@ class Scan1DThread(QThread):
     @camera_exception_handler
     def run(self):
         self.camera.end_flag = False
-        data = self.camera.scan_row(self.axis, self.other_axis_pos, self.start_pos, self.scan_range, self.step)
+        data = self.camera.scan_row(self.axis, self.other_axis_pos, self.start_pos, self.scan_range, self.step,
+                                    save_path=self.save_path)
         if data is not None:
             self.return_data.emit(data)
@@ -1,13 +1,16 @@
 from PyQt5.QtWidgets import (QWidget, QLabel, QHBoxLayout, QVBoxLayout, QGridLayout,
                             QCheckBox, QSpinBox, QDoubleSpinBox, QComboBox, QRadioButton,
                             QFrame, QPushButton, QTabWidget)
+from ScanPlanner import format_duration
 
 
 class BlankSettingsTab(QWidget):
 
-    def __init__(self, scan_func):
+    def __init__(self, scan_func, camera):
         super().__init__()
         self.scan_func = scan_func
+        # camera used for scan time estimates
+        self.camera = camera
         self.vLayout = QVBoxLayout()
         self.addAxisSelect()
         self.addResolutionControl()
@@ -16,8 +19,17 @@ class BlankSettingsTab(QWidget):
         self.vLayout.addWidget(HLine())
         self.addSamplingControl()
         self.vLayout.addWidget(HLine())
+        self.addEstimateControl()
+        self.vLayout.addWidget(HLine())
         self.addButton()
         self.setLayout(self.vLayout)
+        # update estimate when any setting changes
+        for control in self.findChildren(QSpinBox) + self.findChildren(QDoubleSpinBox):
+            if control is not self.budget_control:
+                control.valueChanged.connect(lambda x: self.updateEstimate())
+        for control in self.findChildren(QRadioButton):
+            control.toggled.connect(lambda x: self.updateEstimate())
+        self.updateEstimate()
 
     # empty methods
     def addAxisSelect(self):
@@ -28,6 +40,38 @@ class BlankSettingsTab(QWidget):
         pass
     def addButton(self):
         pass
+    def estimate(self):
+        return None
+    def fitResolution(self, budget):
+        pass
+    def fitSamples(self, budget):
+        pass
+
+    # scan time estimate and controls to fit the scan into a time budget
+    def addEstimateControl(self):
+        layout = QGridLayout()
+        self.estimate_label = QLabel()
+        layout.addWidget(self.estimate_label, 0, 0, 1, -1)
+        layout.addWidget(QLabel('Time budget (min): '), 1, 0, 1, 1)
+        self.budget_control = QSpinBox()
+        self.budget_control.setRange(1, 99999)
+        self.budget_control.setValue(60)
+        layout.addWidget(self.budget_control, 1, 1, 1, 1)
+        fit_resolution = QPushButton('Fit resolution')
+        fit_resolution.clicked.connect(lambda: self.fitResolution(self.budget_control.value()*60))
+        layout.addWidget(fit_resolution, 2, 0, 1, 1)
+        fit_samples = QPushButton('Fit samples')
+        fit_samples.clicked.connect(lambda: self.fitSamples(self.budget_control.value()*60))
+        layout.addWidget(fit_samples, 2, 1, 1, 1)
+        self.vLayout.addLayout(layout)
+
+    def updateEstimate(self):
+        try:
+            estimate = self.estimate()
+        except (ZeroDivisionError, ValueError):
+            estimate = None
+        self.estimate_label.setText('Estimated scan time: {}'.format(
+            '-' if estimate is None else format_duration(estimate)))
 
     # sampling control
     def addSamplingControl(self):
@@ -42,7 +86,8 @@ class BlankSettingsTab(QWidget):
         # sampling mode select
         layout.addWidget(QLabel('Sampling function: '), 1, 0, 1, 1)
         self.sampling_mode = QComboBox()
-        self.sampling_mode.addItems(['RMS', 'Squared RMS', 'Average', 'Sum', 'Max'])
+        self.sampling_mode.addItems(['RMS', 'Squared RMS', 'Average', 'Sum', 'Max', 'Median',
+                                    'Trimmed Mean', '90th Percentile'])
         layout.addWidget(self.sampling_mode, 1, 1, 1, 1)
 
         self.vLayout.addLayout(layout)
@@ -52,7 +97,10 @@ class BlankSettingsTab(QWidget):
                     'RMS'           :   'rms',
                     'Average'       :   'average',
                     'Sum'           :   'sum',
-                    'Max'           :   'max'}
+                    'Max'           :   'max',
+                    'Median'        :   'median',
+                    'Trimmed Mean'  :   'trimmed_mean',
+                    '90th Percentile':  'percentile'}
         return methods[self.sampling_mode.currentText()]
 
 class SettingsTab2D(BlankSettingsTab):
@@ -136,6 +184,33 @@ class SettingsTab2D(BlankSettingsTab):
         # add to top layout
         self.vLayout.addLayout(layout)
 
+    def getSettings2D(self):
+        return ((self.x_start_control.value(), self.y_start_control.value()),
+                (self.x_range_control.value(), self.y_range_control.value()),
+                (self.dx_control.value()/1000, self.dy_control.value()/1000))
+
+    def estimate(self):
+        start, img_size, pixel_size = self.getSettings2D()
+        return self.camera.planner.estimate_2d(start, img_size, pixel_size, self.n_samples.value(),
+                    self.camera.expected_settle_time(), self.camera.SERPENTINE, self.camera.motors.position)
+
+    # set smallest pixel size (dx = dy) that fits in budget seconds
+    def fitResolution(self, budget):
+        start, img_size, pixel_size = self.getSettings2D()
+        suggested = self.camera.planner.suggest_pixel_size(start, img_size, self.n_samples.value(), budget,
+                    self.camera.expected_settle_time(), self.camera.SERPENTINE, self.camera.motors.position)
+        if suggested is not None:
+            self.dx_control.setValue(int(round(suggested*1000)))
+            self.dy_control.setValue(int(round(suggested*1000)))
+
+    # set largest number of samples that fits in budget seconds
+    def fitSamples(self, budget):
+        start, img_size, pixel_size = self.getSettings2D()
+        suggested = self.camera.planner.suggest_n_samples_2d(start, img_size, pixel_size, budget,
+                    self.camera.expected_settle_time(), self.camera.SERPENTINE, self.camera.motors.position)
+        if suggested is not None:
+            self.n_samples.setValue(suggested)
+
     def addButton(self):
         self.button = QPushButton('2D Scan')
         self.button.clicked.connect(lambda: self.scan_func((self.dx_control.value()/1000, self.dy_control.value()/1000),
@@ -213,6 +288,29 @@ class SettingsTab1D(BlankSettingsTab):
         # add to top layout
         self.vLayout.addLayout(layout)
 
+    def getSettings1D(self):
+        return (int(self.scan_y.isChecked()), self.other_axis_pos_control.value(), self.start_control.value(),
+                self.range_control.value(), self.step_control.value()/1000)
+
+    def estimate(self):
+        return self.camera.planner.estimate_1d(*self.getSettings1D(), self.n_samples.value(),
+                    self.camera.expected_settle_time(), self.camera.motors.position)
+
+    # set smallest step size that fits in budget seconds
+    def fitResolution(self, budget):
+        axis, other_axis_pos, start, scan_range, step = self.getSettings1D()
+        suggested = self.camera.planner.suggest_step_size(axis, other_axis_pos, start, scan_range,
+                    self.n_samples.value(), budget, self.camera.expected_settle_time(), self.camera.motors.position)
+        if suggested is not None:
+            self.step_control.setValue(int(round(suggested*1000)))
+
+    # set largest number of samples that fits in budget seconds
+    def fitSamples(self, budget):
+        suggested = self.camera.planner.suggest_n_samples_1d(*self.getSettings1D(), budget,
+                    self.camera.expected_settle_time(), self.camera.motors.position)
+        if suggested is not None:
+            self.n_samples.setValue(suggested)
+
     def addButton(self):
         self.button = QPushButton('1D Scan')
         self.button.clicked.connect(lambda: self.scan_func(int(self.scan_y.isChecked()),
@@ -0,0 +1,161 @@
+# Producer/consumer pipeline separating hardware I/O from processing of the acquired data.
+# The source (moving and sampling) runs in its own thread and pushes items into a bounded queue,
+# each following stage runs in its own thread taking items from the previous queue. The depth of each
+# queue and the time spent waiting on it are recorded so stalls can be identified.
+import queue
+import threading
+import time
+
+import numpy
+
+# marks the end of the stream
+_END = object()
+
+
+class PipelineAborted(Exception):
+    # raised inside the source when a later stage has failed
+    pass
+
+
+class QueueStats:
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.items = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        # time producer spent blocked on a full queue, and consumer spent waiting for items
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    # record depth seen by an item as it is added
+    def put(self, depth, wait):
+        self.items += 1
+        self.depth_total += depth
+        self.max_depth = max(self.max_depth, depth)
+        self.put_wait += wait
+
+    def mean_depth(self):
+        return self.depth_total/self.items if self.items else 0
+
+    def summary(self):
+        return '{name}: {items} items, depth mean {mean:.1f} max {max}/{size}, producer blocked {put:.3f}s, ' \
+            'consumer idle {get:.3f}s'.format(name=self.name, items=self.items, mean=self.mean_depth(),
+                                            max=self.max_depth, size=self.maxsize, put=self.put_wait,
+                                            get=self.get_wait)
+
+
+class Pipeline:
+
+    # source(emit) produces items by calling emit(item), its return value is returned by run
+    # stages is a list of (name, func), func(item) returns the item for the next stage or None to drop it
+    # if threaded is False all stages run in the calling thread as each item is emitted
+    def __init__(self, source, stages, queue_size=64, threaded=True):
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.threaded = threaded
+        self.stats = [QueueStats(name, queue_size) for name, func in stages]
+        self._failed = threading.Event()
+        self._errors = []
+        self._threads = []
+
+    def run(self):
+        if not self.threaded:
+            return self.source(self._emit_inline)
+        queues = [queue.Queue(self.queue_size) for s in self.stages]
+        threads = [threading.Thread(target=self._run_stage, args=(k, queues), daemon=True)
+                    for k in range(len(self.stages))]
+        for t in threads:
+            t.start()
+        result = []
+        acquisition = threading.Thread(target=self._run_source, args=(queues, result), daemon=True)
+        self._threads = [acquisition] + threads
+        acquisition.start()
+        acquisition.join()
+        for t in threads:
+            t.join()
+        if self._errors:
+            raise self._errors[0]
+        return result[0]
+
+    # wait for the threads of a run the calling thread left early (e.g. on KeyboardInterrupt) to finish, the
+    # source must have been told to stop
+    def wait(self):
+        for t in self._threads:
+            t.join()
+
+    def _emit_inline(self, item):
+        for name, func in self.stages:
+            item = func(item)
+            if item is None:
+                return
+
+    def _put(self, k, queues, item):
+        t = time.perf_counter()
+        queues[k].put(item)
+        self.stats[k].put(queues[k].qsize(), time.perf_counter() - t)
+
+    def _run_source(self, queues, result):
+        def emit(item):
+            if self._failed.is_set():
+                raise PipelineAborted()
+            self._put(0, queues, item)
+        try:
+            result.append(self.source(emit))
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            self._errors.insert(0, e)
+            self._failed.set()
+        finally:
+            queues[0].put(_END)
+
+    def _run_stage(self, k, queues):
+        func = self.stages[k][1]
+        last = k == len(self.stages) - 1
+        while True:
+            t = time.perf_counter()
+            item = queues[k].get()
+            self.stats[k].get_wait += time.perf_counter() - t
+            if item is _END:
+                if not last:
+                    queues[k+1].put(_END)
+                return
+            # after a failure keep draining the queue so the source isn't blocked
+            if self._failed.is_set():
+                continue
+            try:
+                item = func(item)
+                if item is not None and not last:
+                    self._put(k+1, queues, item)
+            except Exception as e:
+                self._errors.append(e)
+                self._failed.set()
+
+    def summary(self):
+        return '\n'.join(s.summary() for s in self.stats)
+
+
+# consumer collecting (row, column, value, info) items into a (rows, columns) array, calls
+# row_completed(i, row) as each row is filled. Each entry of the info dicts is collected into an array of the
+# same shape in self.info[key]. Pixels not scanned are nan
+class RowAssembler:
+
+    def __init__(self, rows, columns, row_completed=None):
+        self.rows = numpy.full((rows, columns), numpy.nan)
+        self.filled = [0]*rows
+        self.info = {}
+        self.row_completed = row_completed
+
+    def store(self, item):
+        i, j, value, info = item
+        self.rows[i][j] = value
+        for key, v in info.items():
+            if key not in self.info:
+                self.info[key] = numpy.full(self.rows.shape, numpy.nan)
+            self.info[key][i][j] = v
+        self.filled[i] += 1
+        if self.filled[i] == len(self.rows[i]) and self.row_completed is not None:
+            self.row_completed(i, self.rows[i])
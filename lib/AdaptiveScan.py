@@ -0,0 +1,95 @@
+# Coarse-to-fine (quadtree) scanning. The image is first sampled on a coarse grid, then cells whose
+# intensity or difference to their neighbours passes a threshold are split into 4 and the new corners
+# sampled, repeating until the finest pixel size. Positions are handled as indices on the finest grid.
+import numpy
+
+
+class Quadtree:
+
+    # shape: (rows, columns) of the finest grid, coarse cells are 2**levels fine pixels across
+    def __init__(self, shape, levels):
+        self.shape = shape
+        self.levels = levels
+        self.size = 2**levels
+        # leaf cells (i, j) -> size in fine pixels, and values measured at cell origins
+        self.leaves = {}
+        self.values = {}
+        self.level_size = self.size
+
+    # origins of the coarse cells, these need measuring first
+    def initial_points(self):
+        points = [(i, j) for i in range(0, self.shape[0], self.size) for j in range(0, self.shape[1], self.size)]
+        for p in points:
+            self.leaves[p] = self.size
+        return points
+
+    def add_values(self, points, values):
+        for p, v in zip(points, values):
+            self.values[p] = v
+
+    # split cells of the current level which pass a threshold, returns the new points to be measured
+    # gradient_threshold: maximum difference to a neighbouring cell, intensity_threshold: cell value
+    def refine(self, gradient_threshold=None, intensity_threshold=None):
+        s = self.level_size
+        if s <= 1:
+            return []
+        grid = self.grid()
+        h = s // 2
+        new_points = []
+        for (i, j), size in list(self.leaves.items()):
+            if size != s or not self._passes(grid, i, j, s, gradient_threshold, intensity_threshold):
+                continue
+            del self.leaves[(i, j)]
+            for di, dj in ((0, 0), (h, 0), (0, h), (h, h)):
+                child = (i + di, j + dj)
+                # drop children starting outside the image
+                if child[0] >= self.shape[0] or child[1] >= self.shape[1]:
+                    continue
+                self.leaves[child] = h
+                if child not in self.values:
+                    new_points.append(child)
+        self.level_size = h
+        return new_points
+
+    def _passes(self, grid, i, j, s, gradient_threshold, intensity_threshold):
+        value = self.values[(i, j)]
+        if intensity_threshold is not None and value >= intensity_threshold:
+            return True
+        if gradient_threshold is not None:
+            # values of the cells bordering this one
+            neighbours = [grid[n] for n in ((i - 1, j), (i + s, j), (i, j - 1), (i, j + s))
+                            if 0 <= n[0] < self.shape[0] and 0 <= n[1] < self.shape[1]]
+            if neighbours and max(abs(value - n) for n in neighbours) >= gradient_threshold:
+                return True
+        return False
+
+    # values on the finest grid, each leaf filling the pixels it covers
+    def grid(self):
+        grid = numpy.empty(self.shape)
+        for (i, j), size in sorted(self.leaves.items(), key=lambda leaf: -leaf[1]):
+            grid[i:i+size, j:j+size] = self.values[(i, j)]
+        return grid
+
+    # leaves as (x, y, size, value) in mm
+    def cells(self, start, pixel_size):
+        return [(start[0] + i*pixel_size, start[1] + j*pixel_size, size*pixel_size, self.values[(i, j)])
+                for (i, j), size in self.leaves.items()]
+
+
+# order points to scan rows alternately forwards and backwards
+def serpentine_order(points):
+    return sorted(points, key=lambda p: (p[0], p[1] if p[0] % 2 == 0 else -p[1]))
+
+
+# regular grid (rows of values) from (x, y, size, value) cells at pixel_size (x, y), each pixel takes the
+# value of the smallest cell covering it, same shape as Camera.scan_image at that pixel size
+def resample_cells(cells, start, img_size, pixel_size):
+    shape = (int(img_size[0]/pixel_size[0]), int(img_size[1]/pixel_size[1]) + 1)
+    grid = numpy.full(shape, numpy.nan)
+    for x, y, size, value in sorted(cells, key=lambda c: -c[2]):
+        i0 = max(int(numpy.ceil((x - start[0])/pixel_size[0] - 1e-9)), 0)
+        i1 = int(numpy.ceil((x + size - start[0])/pixel_size[0] - 1e-9))
+        j0 = max(int(numpy.ceil((y - start[1])/pixel_size[1] - 1e-9)), 0)
+        j1 = int(numpy.ceil((y + size - start[1])/pixel_size[1] - 1e-9))
+        grid[i0:i1, j0:j1] = value
+    return grid
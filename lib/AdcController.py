@@ -1,48 +1,98 @@
-import math
 import ctypes
+import functools
+import time
+import numpy
 
 from CustomExceptions import AdcError
+from Reducers import get_reducer, get_standard_error
 
 ADC_CHANNEL_USED = 2       # 1 or 2
 
 class AdcController():
 
-    # initialise process
-    def __init__(self):
-        ADC_DLL = ctypes.WinDLL('K8055D.dll')
+    # initialise process, dll can be replaced by a simulated device (see SimulatedHardware)
+    # card is the board's address (0-3, set by its SK5/SK6 jumpers) when several boards are connected. The dll
+    # reads from the board opened last, so only one board can be used per process (see RigPool)
+    def __init__(self, dll=None, card=0):
+        ADC_DLL = ctypes.WinDLL('K8055D.dll') if dll is None else dll
+        self.card = card
         # create dll functions for use
         self.f_search = ADC_DLL.SearchDevices
         self.f_open = ADC_DLL.OpenDevice
-        self.read_channel = lambda: ADC_DLL.ReadAnalogChannel(ADC_CHANNEL_USED)
+        # partial avoids the overhead of a python function call per sample
+        self.read_channel = functools.partial(ADC_DLL.ReadAnalogChannel, ADC_CHANNEL_USED)
         self.close = ADC_DLL.CloseDevice
+        # buffer sample_sequential returns samples in when no out is given, grown if more samples are requested
+        self._buffer = numpy.empty(0)
+        # ScanProfile recording the time per sample of each read, set by Camera during scans
+        self.profile = None
 
     def open(self):
-        # This assumes only one K8055 board is connected to computer
-        if self.f_open(0) == -1:
-            raise AdcError('Connection to board unsuccessful.')
+        if self.f_open(self.card) == -1:
+            raise AdcError('Connection to board {} unsuccessful.'.format(self.card))
+
+    # check board is still connected, SearchDevices returns a bit for each card address found
+    def is_connected(self):
+        return bool(self.f_search() & (1 << self.card))
 
-    # read samples in from ADC and apply func to find value to return
+    # read samples in from ADC and apply func to find value to return (see Reducers for options)
     def read(self, n, func='max'):
-        # take samples
-        samples = []
-        for i in range(n):
-            samples += [self.read_channel()]
-        # apply chosen func
-        if func == 'max':
-            # choose maximum value
-            return max(samples)
-        elif func == 'average':
-            # average values
-            return sum(samples)/n
-        elif func == 'rms2':
-            # mean square of values
-            samples_sq = [s*s for s in samples]
-            return sum(samples_sq)/n
-        elif func == 'rms':
-            samples_sq = [s*s for s in samples]
-            return math.sqrt(sum(samples_sq)/n)
-        elif func == 'sum':
-            # sum of values
-            return sum(samples)
+        reducer = get_reducer(func)
+        return float(reducer(self.sample(n)))
+
+    # take n samples, copied into out (array of length n) if given
+    def sample(self, n, out=None):
+        t = time.perf_counter()
+        # fromiter calls read_channel n times without a python loop. It can't fill out itself, but copying
+        # its array is quicker than filling out a sample at a time
+        samples = numpy.fromiter(iter(self.read_channel, None), numpy.float64, count=n)
+        if out is None:
+            out = samples
         else:
-            raise ValueError('"{}" not valid value for "func" in AdcControl.read'.format(func))
+            out[:] = samples
+        if self.profile is not None and n:
+            self.profile.record('adc_sample', (time.perf_counter() - t)/n)
+        return out
+
+    # read in chunks of samples until running() returns False (at least one chunk is read), for sampling
+    # while the stage moves. Returns (times, samples) arrays, the perf_counter time of each sample is spread
+    # evenly over the time its chunk took
+    def sample_continuous(self, running, chunk=16):
+        times, chunks = [], []
+        offsets = (numpy.arange(chunk) + 0.5)/chunk
+        while True:
+            t = time.perf_counter()
+            chunks.append(numpy.fromiter(iter(self.read_channel, None), numpy.float64, count=chunk))
+            duration = time.perf_counter() - t
+            times.append(t + offsets*duration)
+            if self.profile is not None:
+                self.profile.record('adc_sample', duration/chunk)
+            if not running():
+                break
+        return numpy.concatenate(times), numpy.concatenate(chunks)
+
+    # take samples until the standard error of func's estimate is at most target_se, taking between
+    # n_min and n_max samples. After the first n_min samples the number still needed is predicted from
+    # the standard error so far. Samples are read in chunks (see sample) and copied to out (length >= n_max) if
+    # given, returns the samples taken
+    def sample_sequential(self, func, target_se, n_min, n_max, out=None):
+        standard_error = get_standard_error(func)
+        if out is None:
+            if self._buffer.size < n_max:
+                self._buffer = numpy.empty(n_max)
+            out = self._buffer
+        t = time.perf_counter()
+        n = min(max(n_min, 2), n_max)
+        out[:n] = numpy.fromiter(iter(self.read_channel, None), numpy.float64, count=n)
+        while n < n_max:
+            se = standard_error(out[:n])
+            if se <= target_se:
+                break
+            # standard error falls as 1/sqrt(n)
+            needed = int(n * (se/target_se)**2) + 1 if numpy.isfinite(se) else 2*n
+            k = min(max(needed - n, 1), n_max - n)
+            out[n:n+k] = numpy.fromiter(iter(self.read_channel, None), numpy.float64, count=k)
+            n += k
+        if self.profile is not None:
+            self.profile.record('adc_sample', (time.perf_counter() - t)/n)
+        return out[:n]
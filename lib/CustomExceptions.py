@@ -1,5 +1,10 @@
-# import VisaIOError
-from pyvisa.errors import VisaIOError
+# VisaIOError (raised by pyvisa when the GPIB connection times out) is imported on first use rather than with
+# this module, as importing pyvisa is slow and it isn't needed until the motor controller is opened
+def __getattr__(name):
+    if name == 'VisaIOError':
+        from pyvisa.errors import VisaIOError
+        return VisaIOError
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 class MotorControllerError(Exception):
 # Unexpected behaviour of motor stage controller
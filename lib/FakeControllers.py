@@ -3,15 +3,23 @@ import time
 
 DATA_PREFIX = 'fake'
 
-import visa
+import numpy
 from CustomExceptions import *
+# sampling and reduction shared with the real controller
+from AdcController import AdcController as _AdcController
 
 class MotorController:
+    BATCH_COMMANDS = False
+
     # Initialisation
-    def __init__(self):
+    def __init__(self, resource_manager=None, address=None):
         # empty variables show connection is not yet established
         self.instrument = None
         self.position = [None, None]
+        self.address = address
+        self.round_trips = 0
+        self.writes = 0
+        self.profile = None
 
     # open connection to instrument
     def open_instrument(self):
@@ -20,7 +28,7 @@ class MotorController:
         self.init_positions()
 
     # test connection to instrument, allow several attempts as errors may occur after connection established.
-    def test_instrument_connection(self, attempts=5):
+    def test_instrument_connection(self, attempts=5, use_cache=True):
         # check connection has been established previously
         if self.instrument is None:
             raise MotorControllerError('Must connect controller before connection can be tested.')
@@ -30,7 +38,14 @@ class MotorController:
         pass
 
     # move axis by given distance (in mm)
-    def move(self, axis, distance):
+    def move(self, axis, distance, uncalibrated=False, wait=True, expected_duration=0):
+        pass
+
+    def move_batch(self, moves, wait=True, expected_duration=0):
+        for axis, distance in moves:
+            self.move(axis, distance)
+
+    def wait_for_moves(self):
         pass
 
     # send axis to endstop (positive for max, negative for min), resets position to 0
@@ -61,12 +76,15 @@ class AdcError(Exception):
 # Covering any problems with the ADC controller
     pass
 
-class AdcController():
+class AdcController(_AdcController):
 
     # initialise process
-    def __init__(self):
-        pass
+    def __init__(self, dll=None, card=0):
         # will need to start subprocess when not running simple control.
+        self.read_channel = self._get_val
+        self.card = card
+        self._buffer = numpy.empty(0)
+        self.profile = None
 
     def open(self):
         pass
@@ -75,32 +93,9 @@ class AdcController():
         pass
         # kill subprocess
 
-    # read samples in from ADC and apply func to find value to return
-    def read(self, n, func='max'):
-        # take samples
-        samples = []
-        for i in range(n):
-            samples += [self._get_val()]
-        # apply chosen func
-        if func == 'max':
-            # choose maximum value
-            return max(samples)
-        elif func == 'average':
-            # average values
-            return sum(samples)/n
-        elif func == 'rms2':
-            # mean square of values
-            samples_sq = [s*s for s in samples]
-            return sum(samples_sq)/n
-        elif func == 'rms':
-            samples_sq = [s*s for s in samples]
-            return math.sqrt(sum(samples_sq)/n)
-        elif func == 'sum':
-            # sum of values
-            return sum(samples)
-        else:
-            raise ValueError('"{}" not valid value for "func" in AdcControl.read'.format(func))
-
+    def is_connected(self):
+        return True
+
     def _get_val(self):
         # get output, decode to regular string and strip whitespace characters
         return random.randint(0,100)
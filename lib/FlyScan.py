@@ -0,0 +1,38 @@
+# Resampling for fly scans: the adc is read continuously while the stage moves along a whole row in one move,
+# each reading is timestamped, and the readings are binned onto the pixel grid using where the stage was
+# when each was taken.
+import numpy
+
+
+# positions (mm) of the stage at times (perf_counter) during a move from start to end, t0 and t1 are the times
+# the move command was sent and returned. With velocity None the stage is taken to move at a constant speed
+# over the whole move, otherwise at velocity (mm/s) with the command and acceleration overhead split evenly
+# before and after the travel
+def stage_positions(times, t0, t1, start, end, velocity=None):
+    duration = t1 - t0
+    if velocity is None:
+        travel_start, travel_time = t0, duration
+    else:
+        travel_time = min(abs(end - start)/velocity, duration)
+        travel_start = t0 + (duration - travel_time)/2
+    if travel_time <= 0:
+        return numpy.full(len(times), float(end))
+    fraction = numpy.clip((numpy.asarray(times) - travel_start)/travel_time, 0, 1)
+    return start + (end - start)*fraction
+
+
+# split readings taken at positions into n_pixels pixels of width step, pixel j centred at first + j*step
+# returns a list of the indices of each pixel's readings, in the order they were taken. A pixel without
+# readings (the stage crossed it between two readings) takes the reading nearest its centre
+def bin_readings(positions, first, step, n_pixels):
+    positions = numpy.asarray(positions)
+    index = numpy.rint((positions - first)/step).astype(int)
+    inside = numpy.flatnonzero((index >= 0) & (index < n_pixels))
+    # stable sort keeps the readings of each pixel in time order
+    order = inside[numpy.argsort(index[inside], kind='stable')]
+    bounds = numpy.searchsorted(index[order], numpy.arange(n_pixels + 1))
+    pixels = [order[bounds[j]:bounds[j + 1]] for j in range(n_pixels)]
+    for j, readings in enumerate(pixels):
+        if len(readings) == 0 and len(positions):
+            pixels[j] = numpy.array([numpy.argmin(numpy.abs(positions - (first + j*step)))])
+    return pixels
@@ -0,0 +1,138 @@
+# Keeps the motor controller and adc connected across many scans, instead of opening and closing them for
+# every scan. A keepalive thread checks the devices while idle and reconnects any that have stopped responding,
+# and each scan checks the devices first so a fault during one scan doesn't stop the next.
+# usage (see Camera.session):
+#   with camera.session():
+#       camera.scan_image(...)
+#       camera.scan_row(...)
+import threading
+import time
+
+import CustomExceptions
+from CustomExceptions import MotorControllerError, MotorControllerConnectionError, AdcError
+
+
+# errors meaning a device has lost its connection, a function so pyvisa is only imported once an error is caught
+def connection_errors():
+    return (MotorControllerError, MotorControllerConnectionError, AdcError, CustomExceptions.VisaIOError)
+
+
+class HardwareSession:
+    # seconds between keepalive checks while idle
+    KEEPALIVE_INTERVAL = 30
+    # reconnection attempts before giving up, and pause (s) between them
+    RECONNECT_ATTEMPTS = 3
+    RECONNECT_DELAY = 1
+
+    # keepalive: seconds between checks while no scan is running, None for no keepalive thread
+    def __init__(self, motors, adc, keepalive=KEEPALIVE_INTERVAL):
+        self.motors = motors
+        self.adc = adc
+        self.keepalive = keepalive
+        # held while scanning so the keepalive never talks to the devices during a scan
+        self.lock = threading.Lock()
+        self.active = False
+        # result of the last health check, reconnections made and the last connection error
+        self.status = {'motors': False, 'adc': False, 'checked': None}
+        self.reconnects = 0
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # connect both devices (homing the stage if the controller wasn't connected) and start the keepalive
+    def open(self):
+        with self.lock:
+            self._connect(*self._check(use_cache=True))
+        self.active = True
+        if self.keepalive is not None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._keepalive_loop, name='HardwareSession keepalive',
+                                            daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self.lock:
+            self.active = False
+            self.adc.close()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # called at the start of each scan: waits for any keepalive check to finish, then reconnects devices which
+    # aren't responding. The connection test uses the motor controller's cache, so costs nothing mid-session
+    def begin_scan(self):
+        self.lock.acquire()
+        try:
+            self._connect(*self._check(use_cache=True))
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def end_scan(self):
+        self.lock.release()
+
+    # check both devices now (sending *IDN? even if the controller responded recently), reconnecting any which
+    # have failed. Returns the status dict, raises the connection error if a device can't be reconnected
+    def health_check(self):
+        with self.lock:
+            self._connect(*self._check(use_cache=False))
+        return dict(self.status)
+
+    # (motors ok, adc ok), recorded in status
+    def _check(self, use_cache):
+        try:
+            self.motors.test_instrument_connection(use_cache=use_cache)
+            motors_ok = True
+        except connection_errors() as e:
+            self.last_error = e
+            motors_ok = False
+        adc_ok = self.active and self.adc.is_connected()
+        self.status = {'motors': motors_ok, 'adc': adc_ok, 'checked': time.time()}
+        return motors_ok, adc_ok
+
+    # (re)connect the devices which aren't ok, reopening the motor controller homes the stage
+    def _connect(self, motors_ok, adc_ok):
+        if motors_ok and adc_ok:
+            return
+        for attempt in range(self.RECONNECT_ATTEMPTS):
+            try:
+                if not motors_ok:
+                    self.motors.close()
+                    self.motors.open_instrument()
+                    motors_ok = True
+                if not adc_ok:
+                    self.adc.close()
+                    self.adc.open()
+                    adc_ok = True
+                break
+            except connection_errors() as e:
+                self.last_error = e
+                if attempt == self.RECONNECT_ATTEMPTS - 1:
+                    self.status.update(motors=motors_ok, adc=adc_ok)
+                    raise
+                time.sleep(self.RECONNECT_DELAY)
+        # the first connection of a session isn't counted
+        if self.active:
+            self.reconnects += 1
+        self.status.update(motors=True, adc=True)
+
+    def _keepalive_loop(self):
+        while not self._stop.wait(self.keepalive):
+            # skip the check if a scan is running
+            if not self.lock.acquire(blocking=False):
+                continue
+            try:
+                self._connect(*self._check(use_cache=False))
+            except connection_errors():
+                # kept in last_error, the next scan tries to reconnect again
+                pass
+            finally:
+                self.lock.release()
@@ -0,0 +1,67 @@
+# Downsampled copies of a 2d scan's data (half, quarter, ... resolution) so a large scan is displayed at the
+# resolution of the screen rather than the scan's. Level 0 is the data itself (not copied), each level above
+# is the mean of 2x2 pixels of the level below, ignoring nan pixels. Levels are made when first needed and kept,
+# a level being a quarter the size of the one below, so all levels together take a third of the data's memory.
+import math
+
+import numpy
+
+# levels are made until the longest axis has at most this many pixels
+MIN_SIZE = 64
+# rows of a level averaged at once (even), limiting memory when the data is memory mapped
+CHUNK_ROWS = 2048
+
+
+# mean of each 2x2 block of a 2d array, the last row or column on its own if the size is odd
+def halve(a):
+    rows, columns = a.shape
+    result = numpy.empty(((rows + 1)//2, (columns + 1)//2))
+    for first in range(0, rows, CHUNK_ROWS):
+        block = numpy.array(a[first:first + CHUNK_ROWS], dtype=numpy.float64)
+        if block.shape[0] % 2 or block.shape[1] % 2:
+            padded = numpy.full((block.shape[0] + block.shape[0] % 2, block.shape[1] + block.shape[1] % 2),
+                                numpy.nan)
+            padded[:block.shape[0], :block.shape[1]] = block
+            block = padded
+        valid = numpy.isfinite(block)
+        block[~valid] = 0
+        total = block[0::2, 0::2] + block[1::2, 0::2] + block[0::2, 1::2] + block[1::2, 1::2]
+        count = valid[0::2, 0::2]*1 + valid[1::2, 0::2] + valid[0::2, 1::2] + valid[1::2, 1::2]
+        # blocks of only nan pixels stay nan
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            result[first//2:first//2 + total.shape[0]] = total/count
+    return result
+
+
+class ImagePyramid:
+
+    def __init__(self, data):
+        self.levels = [data]
+        self.shape = data.shape
+        longest = max(self.shape)
+        self.n_levels = 1 + (math.ceil(math.log2(longest/MIN_SIZE)) if longest > MIN_SIZE else 0)
+
+    # level k (0 is the data), made from the level below if it hasn't been yet
+    def level(self, k):
+        k = min(max(k, 0), self.n_levels - 1)
+        while len(self.levels) <= k:
+            self.levels.append(halve(self.levels[-1]))
+        return self.levels[k]
+
+    # coarsest level with at least one pixel per screen pixel, region_size: (x, y) pixels of the data shown on
+    # screen_size: (x, y) screen pixels
+    def choose_level(self, region_size, screen_size):
+        ratio = min(region/max(screen, 1) for region, screen in zip(region_size, screen_size))
+        if ratio < 2:
+            return 0
+        return min(int(math.log2(ratio)), self.n_levels - 1)
+
+    # part of level k covering the data pixels rows [i0, i1) and columns [j0, j1). Returns the part and the
+    # data pixels it covers (i0, i1, j0, j1), rounded out to whole pixels of the level
+    def crop(self, k, rows, columns):
+        k = min(max(k, 0), self.n_levels - 1)
+        a = self.level(k)
+        f = 2**k
+        i0, i1 = max(rows[0]//f, 0), min(-(-rows[1]//f), a.shape[0])
+        j0, j1 = max(columns[0]//f, 0), min(-(-columns[1]//f), a.shape[1])
+        return a[i0:i1, j0:j1], (i0*f, min(i1*f, self.shape[0]), j0*f, min(j1*f, self.shape[1]))
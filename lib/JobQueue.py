@@ -0,0 +1,245 @@
+# Queue of scan jobs kept on disk, so queued jobs survive the program being closed, and a scheduler which runs
+# them one after another on a Camera (e.g. overnight). Each job is a JSON file in the queue directory, holding
+# the Camera scan method to call with its arguments, Camera settings to use for the job, its priority and its
+# progress. Results are saved as a scan file per job in the same directory.
+import json
+import os
+import time
+import traceback
+import uuid
+
+from HardwareSession import connection_errors
+from ScanFile import ScanFile, ScanFileError, SCAN_FILE_EXTENSION
+
+JOB_DIRECTORY = 'ScanData/jobs'
+
+# scan methods which can be queued, and the argument each takes for where to save its result
+JOB_METHODS = {
+    'scan_image'    :   'save_path',
+    'scan_row'      :   'save_path',
+    'scan_adaptive' :   'save_path',
+    'scan_regions'  :   'save_dir',
+}
+
+# job status
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+# set Camera settings (attribute: value, lists as tuples as they are read from json), returns the previous
+# values so they can be restored with apply_settings(camera, previous)
+def apply_settings(camera, settings):
+    previous = {}
+    for name, value in settings.items():
+        if not name.isupper() or not hasattr(camera, name):
+            raise ValueError('"{}" is not a Camera setting'.format(name))
+        previous[name] = getattr(camera, name)
+        setattr(camera, name, tuple(value) if isinstance(value, list) else value)
+    return previous
+
+
+class JobQueue:
+
+    def __init__(self, directory=JOB_DIRECTORY):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    # queue a call of a Camera scan method (see JOB_METHODS), e.g.
+    #   queue.add('scan_image', ((10, 10), (20, 20), (0.1, 0.1)), settings={'N_SAMPLES': 50})
+    # settings: Camera settings (attribute: value) used for this job only
+    # jobs with higher priority run first, jobs of the same priority in the order added
+    # retries: times a job is run again after losing connection to the hardware. Returns the job id
+    def add(self, method, args=(), kwargs=None, settings=None, priority=0, retries=2, name=None):
+        if method not in JOB_METHODS:
+            raise ValueError('"{}" can not be queued, options are: {}'.format(method, ', '.join(JOB_METHODS)))
+        job_id = '{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), uuid.uuid4().hex[:6])
+        job = {
+            'id': job_id,
+            'name': name,
+            'method': method,
+            'args': list(args),
+            'kwargs': kwargs if kwargs is not None else {},
+            'settings': settings if settings is not None else {},
+            'priority': priority,
+            'retries': retries,
+            'status': QUEUED,
+            'attempts': 0,
+            'added': time.time(),
+            'started': None,
+            'finished': None,
+            'result': None,
+            'error': None,
+        }
+        self.update(job)
+        return job_id
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, job_id + '.json')
+
+    # path of the scan file (directory for scan_regions) a job's result is saved to
+    def result_path(self, job):
+        if JOB_METHODS[job['method']] == 'save_dir':
+            return os.path.join(self.directory, job['id'])
+        return os.path.join(self.directory, job['id'] + SCAN_FILE_EXTENSION)
+
+    def get(self, job_id):
+        with open(self._path(job_id)) as f:
+            return json.load(f)
+
+    # save a job, written to a temporary file first so a job file is never left half written
+    def update(self, job):
+        tmp_path = self._path(job['id']) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f, indent=4)
+        os.replace(tmp_path, self._path(job['id']))
+
+    # all jobs (with status if given) in the order they will run
+    def jobs(self, status=None):
+        jobs = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.json'):
+                try:
+                    job = self.get(file_name[:-len('.json')])
+                except (OSError, ValueError):
+                    continue
+                if status is None or job['status'] == status:
+                    jobs.append(job)
+        return sorted(jobs, key=lambda job: (-job['priority'], job['added'], job['id']))
+
+    # next job to run, None if none are queued
+    def next_job(self):
+        queued = self.jobs(QUEUED)
+        return queued[0] if queued else None
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job['status'] == QUEUED:
+            job['status'] = CANCELLED
+            self.update(job)
+
+    # run a failed or cancelled job again
+    def requeue(self, job_id):
+        job = self.get(job_id)
+        job.update(status=QUEUED, attempts=0, error=None)
+        self.update(job)
+
+    # jobs left running when the program stopped are queued again, scan_image jobs continue from their last row
+    def recover(self):
+        recovered = self.jobs(RUNNING)
+        for job in recovered:
+            job['status'] = QUEUED
+            self.update(job)
+        return recovered
+
+
+class Scheduler:
+    # seconds to wait before running a job again after losing connection to the hardware
+    RETRY_DELAY = 10
+
+    def __init__(self, camera, queue=None):
+        self.camera = camera
+        self.queue = JobQueue() if queue is None else queue
+        self.stopped = False
+
+    # run queued jobs until none are left (or until stop is called if wait, checking for new jobs every
+    # poll_interval seconds). The camera's devices are kept open across jobs (see Camera.session)
+    # returns the jobs run
+    def run(self, wait=False, poll_interval=5):
+        self.stopped = False
+        self.queue.recover()
+        opened = self.camera.hardware_session is None
+        if opened:
+            self.camera.open_session()
+        finished = []
+        try:
+            while not self.stopped:
+                job = self.queue.next_job()
+                if job is None:
+                    if not wait:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+                finished.append(self.run_job(job))
+        finally:
+            if opened:
+                self.camera.close_session()
+        return finished
+
+    # stop after the current job, aborting its scan (the job is queued again, and continues from the rows
+    # already scanned if it is a scan_image job)
+    def stop(self):
+        self.stopped = True
+        self.camera.end_flag = True
+
+    # run a job, retrying after connection errors, returns the job with its status updated
+    def run_job(self, job):
+        job.update(status=RUNNING, started=time.time(), error=None)
+        self.queue.update(job)
+        while True:
+            job['attempts'] += 1
+            try:
+                result = self._run(job)
+            # lost connection to the hardware, the job is retried
+            except connection_errors() as e:
+                job['error'] = '{}: {}'.format(type(e).__name__, e)
+                if self.stopped:
+                    job['status'] = QUEUED
+                    break
+                if job['attempts'] > job['retries']:
+                    job['status'] = FAILED
+                    break
+                self.queue.update(job)
+                time.sleep(self.RETRY_DELAY)
+                continue
+            except Exception as e:
+                # invalid job, running it again won't help
+                job['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+                job['status'] = FAILED
+                break
+            if result is None:
+                # aborted
+                job['status'] = QUEUED
+            else:
+                job['status'] = DONE
+                job['result'] = self.queue.result_path(job)
+            break
+        job['finished'] = time.time()
+        self.queue.update(job)
+        return job
+
+    # call the job's scan method with its settings, returns the method's result
+    def _run(self, job):
+        camera = self.camera
+        camera.end_flag = False
+        previous = apply_settings(camera, job['settings'])
+        try:
+            path = self.queue.result_path(job)
+            if job['method'] == 'scan_image' and self._resumable(path):
+                return camera.resume_scan(path, display_time=False)
+            kwargs = dict(job['kwargs'])
+            kwargs[JOB_METHODS[job['method']]] = path
+            if JOB_METHODS[job['method']] == 'save_dir':
+                os.makedirs(path, exist_ok=True)
+            if job['method'] in ('scan_image', 'scan_adaptive', 'scan_regions'):
+                kwargs.setdefault('display_time', False)
+            return getattr(camera, job['method'])(*job['args'], **kwargs)
+        finally:
+            apply_settings(camera, previous)
+
+    # a previous attempt of a scan_image job left rows in its result file
+    @staticmethod
+    def _resumable(path):
+        try:
+            scan_file = ScanFile(path)
+        except (OSError, ScanFileError):
+            return False
+        try:
+            scan_file.check_resumable()
+            return scan_file.rows_written > 0
+        except ScanFileError:
+            return False
+        finally:
+            scan_file.close()
@@ -0,0 +1,157 @@
+# Mosaics of several 2d scans (tiles) placed on one grid by their start and step, e.g. a scene larger than
+# IMAGE_LIMITS scanned in parts, or passes at different pixel sizes. Tiles are resampled onto the grid
+# (bilinear) and overlaps blended. The mosaic is built a chunk of rows at a time and written to a scan file,
+# reading only the rows of each tile the chunk covers, so neither the tiles nor the mosaic need to fit in
+# memory. The result is a normal scan file, memory mapped by load_scan (view parts with scan.roi).
+# usage: python Mosaic.py mosaic.scanbin tile1.scanbin tile2.scanbin [...] [--pixel=0.1] [--blend=feather]
+import os
+import sys
+import time
+
+import numpy
+
+from ScanDataStruct import ScanData
+from ScanFile import ScanFileWriter, load_scan, load_legacy, LEGACY_EXTENSION
+
+# feather: overlaps fade from one tile to the next, weighted by distance (mm) to each tile's edge
+# average: mean of the overlapping tiles
+# last: later tiles are drawn over earlier ones
+BLEND_MODES = ('feather', 'average', 'last')
+
+# memory (bytes) used for the chunk of the mosaic being built
+CHUNK_MEMORY = 64*2**20
+
+# positions closer than this (mm) are the same
+_EPS = 1e-9
+
+
+# ScanData of a tile given as ScanData or the path of a scan file
+def _open_tile(tile):
+    if isinstance(tile, ScanData):
+        scan = tile
+    elif os.path.splitext(tile)[1] == LEGACY_EXTENSION:
+        scan = load_legacy(tile)
+    else:
+        scan = load_scan(tile)
+    if scan.scan_axis is not None:
+        raise ValueError('Only 2D scans can be added to a mosaic, "{}" is 1D'.format(
+            tile if isinstance(tile, str) else scan.name))
+    return scan
+
+
+# grid covering all tiles, returns (start, pixel_size, shape). pixel_size defaults to the smallest step of the
+# tiles along each axis, so no tile loses resolution
+def mosaic_grid(tiles, pixel_size=None):
+    if pixel_size is None:
+        pixel_size = tuple(min(tile.step[axis] for tile in tiles) for axis in (0, 1))
+    elif not isinstance(pixel_size, (tuple, list)):
+        pixel_size = (pixel_size, pixel_size)
+    coordinates = [[tile.x for tile in tiles], [tile.y for tile in tiles]]
+    start = tuple(float(min(c[0] for c in coordinates[axis])) for axis in (0, 1))
+    end = tuple(float(max(c[-1] for c in coordinates[axis])) for axis in (0, 1))
+    shape = tuple(int(round((end[axis] - start[axis])/pixel_size[axis])) + 1 for axis in (0, 1))
+    return start, tuple(pixel_size), shape
+
+
+# fractional indices of positions along a tile axis, snapped to whole pixels where the grids line up
+def _fractional_index(positions, coordinates, step):
+    f = numpy.clip((positions - coordinates[0])/step, 0, len(coordinates) - 1)
+    nearest = numpy.rint(f)
+    return numpy.where(numpy.abs(f - nearest) < 1e-6, nearest, f)
+
+
+# linear interpolation, taking a where w is 0 and b where w is 1 so a nan neighbour isn't spread
+def _lerp(a, b, w):
+    return numpy.where(w == 0, a, numpy.where(w == 1, b, a*(1 - w) + b*w))
+
+
+# bilinear interpolation of data at fractional indices (fx, fy), only the rows and columns needed are read
+def _bilinear(data, fx, fy):
+    i0 = numpy.minimum(numpy.floor(fx).astype(int), max(data.shape[0] - 2, 0))
+    j0 = numpy.minimum(numpy.floor(fy).astype(int), max(data.shape[1] - 2, 0))
+    wx = (fx - i0)[:, numpy.newaxis]
+    wy = (fy - j0)[numpy.newaxis, :]
+    rows = slice(i0[0], min(i0[-1] + 2, data.shape[0]))
+    columns = slice(j0[0], min(j0[-1] + 2, data.shape[1]))
+    block = numpy.asarray(data[rows, columns], dtype=numpy.float64)
+    i0, j0 = i0 - rows.start, j0 - columns.start
+    i1 = numpy.minimum(i0 + 1, block.shape[0] - 1)
+    j1 = numpy.minimum(j0 + 1, block.shape[1] - 1)
+    top = _lerp(block[i0][:, j0], block[i0][:, j1], wy)
+    bottom = _lerp(block[i1][:, j0], block[i1][:, j1], wy)
+    return _lerp(top, bottom, wx)
+
+
+# add the part of a tile within grid positions xs (rows of the chunk), ys to the chunk's weighted total
+def _add_tile(tile, xs, ys, total, weight, blend):
+    rows = numpy.flatnonzero((xs >= tile.x[0] - _EPS) & (xs <= tile.x[-1] + _EPS))
+    columns = numpy.flatnonzero((ys >= tile.y[0] - _EPS) & (ys <= tile.y[-1] + _EPS))
+    if len(rows) == 0 or len(columns) == 0:
+        return
+    # positions are in order, so the grid pixels covered are a block of the chunk
+    block = (slice(rows[0], rows[-1] + 1), slice(columns[0], columns[-1] + 1))
+    x, y = xs[block[0]], ys[block[1]]
+    values = _bilinear(tile.data, _fractional_index(x, tile.x, tile.step[0]),
+                        _fractional_index(y, tile.y, tile.step[1]))
+    valid = numpy.isfinite(values)
+    if blend == 'last':
+        total[block][valid] = values[valid]
+        weight[block][valid] = 1
+        return
+    if blend == 'feather':
+        # distance to the tile's edge, half a pixel at the edge pixels so every pixel counts
+        dx = numpy.minimum(x - tile.x[0], tile.x[-1] - x) + tile.step[0]/2
+        dy = numpy.minimum(y - tile.y[0], tile.y[-1] - y) + tile.step[1]/2
+        w = numpy.minimum.outer(dx, dy)
+    else:
+        w = numpy.ones(values.shape)
+    w[~valid] = 0
+    total[block] += numpy.where(valid, values, 0)*w
+    weight[block] += w
+
+
+# build a mosaic of tiles (ScanData or scan file paths, .scanbin or .scandat) in a scan file at path
+# pixel_size: (x, y) or a single value (mm), defaults to the smallest tile step. chunk_rows: rows of the
+# mosaic built at once, by default as many as fit in CHUNK_MEMORY. Pixels no tile covers are nan
+# returns the mosaic as ScanData, memory mapped from the file
+def build_mosaic(tiles, path, pixel_size=None, blend='feather', chunk_rows=None, name='mosaic'):
+    if blend not in BLEND_MODES:
+        raise ValueError('Unknown blend mode "{}", options are: {}'.format(blend, ', '.join(BLEND_MODES)))
+    if not tiles:
+        raise ValueError('No tiles to build a mosaic from.')
+    sources = [tile if isinstance(tile, str) else tile.name for tile in tiles]
+    tiles = [_open_tile(tile) for tile in tiles]
+    start, pixel_size, shape = mosaic_grid(tiles, pixel_size)
+    ys = start[1] + pixel_size[1]*numpy.arange(shape[1])
+    if chunk_rows is None:
+        # total and weight of the chunk, and the tile values, weights and temporaries while one is added
+        chunk_rows = max(1, CHUNK_MEMORY // (8*8*shape[1]))
+    # same relation of scan_range to the number of pixels as Camera.scan_image
+    scan_range = (shape[0]*pixel_size[0], (shape[1] - 1)*pixel_size[1])
+    writer = ScanFileWriter(path, pixel_size, start, scan_range, shape, name=name,
+                            settings={'tiles': sources, 'blend': blend})
+    try:
+        for first in range(0, shape[0], chunk_rows):
+            xs = start[0] + pixel_size[0]*numpy.arange(first, min(first + chunk_rows, shape[0]))
+            total = numpy.zeros((len(xs), shape[1]))
+            weight = numpy.zeros((len(xs), shape[1]))
+            for tile in tiles:
+                _add_tile(tile, xs, ys, total, weight, blend)
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                writer.append_rows(numpy.where(weight > 0, total/weight, numpy.nan))
+    finally:
+        writer.close()
+    writer.finish(time.time())
+    return load_scan(path)
+
+
+if __name__ == '__main__':
+    options = {arg.split('=')[0]: arg.split('=', 1)[1] for arg in sys.argv[1:] if arg.startswith('--')}
+    paths = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if len(paths) < 2:
+        print('usage: python Mosaic.py mosaic.scanbin tile1.scanbin tile2.scanbin [...] [--pixel=0.1] '
+              '[--blend={}]'.format('|'.join(BLEND_MODES)))
+        sys.exit(2)
+    mosaic = build_mosaic(paths[1:], paths[0], float(options['--pixel']) if '--pixel' in options else None,
+                            options.get('--blend', 'feather'))
+    print('{} tiles -> {} ({} x {} pixels)'.format(len(paths) - 1, paths[0], *mosaic.data.shape))
@@ -1,20 +1,63 @@
-import visa
+import time
+import CustomExceptions
 from CustomExceptions import MotorControllerInvalidCommandError, MotorControllerError, MotorControllerConnectionError
 
+# VISA resource name for a GPIB primary address on board 0, resource names and None are returned unchanged
+def resource_name(address):
+    return 'GPIB0::{}::INSTR'.format(address) if isinstance(address, int) else address
+
+
 class MotorController:
-    # Initialisation
-    def __init__(self):
-        self.rm = visa.ResourceManager()
+    # connection is assumed good if a command succeeded within this many seconds, saving the *IDN? round trip
+    # of test_instrument_connection at the start of each scan
+    CONNECTION_CHECK_INTERVAL = 10
+    # Batching writes the move commands of several axes before reading their responses, so the axes move at
+    # the same time. The controller responds to MR once the move is complete (which move relies on), so
+    # reading the responses confirms the moves have finished. Off by default as the controller accepting a
+    # command before the response to the last is read hasn't been checked against the NANOSTEP manual for
+    # the controller in use (the simulated instrument accepts it)
+    BATCH_COMMANDS = False
+    # VISA resource name of the controller when no address is given
+    DEFAULT_ADDRESS = 'GPIB0::6::INSTR'
+
+    # Initialisation, resource_manager can be replaced by a simulated one (see SimulatedHardware)
+    # address is the VISA resource name, or the GPIB primary address as an int (board 0), of the controller to
+    # use when several are connected. If None DEFAULT_ADDRESS is used, falling back to the first instrument found
+    def __init__(self, resource_manager=None, address=None):
+        self._rm = resource_manager
+        self.address = resource_name(address)
         # empty variables show connection is not yet established
         self.instrument = None
         self.position = [None, None]
+        # GPIB queries (write and read) and writes without a response sent, to measure bus use per scan
+        self.round_trips = 0
+        self.writes = 0
+        self._last_response = None
+        # ScanProfile recording the latency of each GPIB query and write, set by Camera during scans
+        self.profile = None
+        # move commands written whose responses haven't been read, and when the moves are expected to finish
+        self._pending = []
+        self._expected_end = 0
+
+    # the VISA library is only loaded when the instrument is first opened, so creating a Camera (and showing
+    # the GUI) doesn't wait for it
+    @property
+    def rm(self):
+        if self._rm is None:
+            import pyvisa
+            self._rm = pyvisa.ResourceManager()
+        return self._rm
 
     # open connection to instrument
     def open_instrument(self):
-        expected_device_name = 'GPIB0::6::INSTR'
+        expected_device_name = self.DEFAULT_ADDRESS if self.address is None else self.address
         connected_devices = self.rm.list_resources()
         if expected_device_name in connected_devices:
             device_name = expected_device_name
+        elif self.address is not None:
+            # another rig's controller may be connected, so don't fall back to it
+            raise MotorControllerConnectionError('Motor controller {} not found, connected devices: {}'.format(
+                self.address, ', '.join(connected_devices) or 'none'))
         else:
             # try connecting to first connected device
             # will work if device name is changed and only one instrument is connected to computer
@@ -26,14 +69,20 @@ class MotorController:
             except IndexError:
                 raise MotorControllerConnectionError('No connected devices found while initialising MotorController connection.')
         self.instrument = self.rm.open_resource(device_name, timeout=6000)
+        self._last_response = None
+        self._pending = []
         self.test_instrument_connection()
         self.init_positions()
 
     # test connection to instrument, allow several attempts as errors may occur after connection established.
-    def test_instrument_connection(self, attempts=5):
+    # use_cache False always sends *IDN?, even if the controller responded recently
+    def test_instrument_connection(self, attempts=5, use_cache=True):
         # check connection has been established previously
         if self.instrument is None:
             raise MotorControllerError('Must connect controller before connection can be tested.')
+        # recent response shows connection still works
+        if use_cache and self._last_response is not None and time.perf_counter() - self._last_response < self.CONNECTION_CHECK_INTERVAL:
+            return
 
         EXPECTED_RESULT = 'MELLES GRIOT NANOSTEP'
         for i in range(attempts):
@@ -52,14 +101,59 @@ class MotorController:
         if self.instrument is not None:
             self.instrument.close()
             self.instrument = None
+            self._last_response = None
+            self._pending = []
 
-    # move axis by given distance (in mm)
-    def move(self, axis, distance, uncalibrated=False):
+    # move axis by given distance (in mm), if wait is False the command is written without waiting for the
+    # move to complete (wait_for_moves reads the response, starting after expected_duration seconds)
+    def move(self, axis, distance, uncalibrated=False, wait=True, expected_duration=0):
         if distance != 0:
-            self._query('MR{a}={d}'.format(a=axis, d=distance))
+            if wait:
+                self._query('MR{a}={d}'.format(a=axis, d=distance))
+            else:
+                self._write_move(axis, distance, expected_duration)
             if not uncalibrated:
                 self.position[axis] += distance
 
+    # move several axes, moves is a list of (axis, distance). With BATCH_COMMANDS every move is written before
+    # the responses are read so the axes move at the same time, otherwise one after another. The responses
+    # are read from expected_duration seconds after the moves are written
+    def move_batch(self, moves, wait=True, expected_duration=0):
+        moves = [(axis, distance) for axis, distance in moves if distance != 0]
+        if not self.BATCH_COMMANDS:
+            for axis, distance in moves:
+                self.move(axis, distance)
+            return
+        for axis, distance in moves:
+            self._write_move(axis, distance, expected_duration)
+        if wait:
+            self.wait_for_moves()
+
+    # wait for moves written without waiting to finish, reading the response the controller sends as each
+    # completes so later queries don't read them as their own
+    def wait_for_moves(self):
+        if not self._pending:
+            return
+        t = time.perf_counter()
+        time.sleep(max(self._expected_end - t, 0))
+        invalid = []
+        while self._pending:
+            message = self._pending.pop(0)
+            if self._read() == 'E':
+                invalid.append(message)
+        if self.profile is not None:
+            self.profile.record('motion_wait', time.perf_counter() - t)
+        if invalid:
+            raise MotorControllerInvalidCommandError('Invalid Command: "{}"'.format('", "'.join(invalid)))
+
+    # write a move without reading the response, it is read by wait_for_moves (or before the next query)
+    def _write_move(self, axis, distance, expected_duration):
+        message = 'MR{a}={d}'.format(a=axis, d=distance)
+        self._write(message)
+        self._pending.append(message)
+        self._expected_end = max(self._expected_end, time.perf_counter() + expected_duration)
+        self.position[axis] += distance
+
     # send axis to endstop (positive for max, negative for min), resets position to 0
     def goto_endstop(self, axis, end):
         # check sign of end
@@ -85,19 +179,53 @@ class MotorController:
             self.move(axis, distance)
 
     # Send a query via GPIB, returns response or raises MotorControllerInvalidCommandError if error returned
+    # responses to moves written without waiting are read first
     def _query(self, message):
+        self.wait_for_moves()
         try:
+            self.round_trips += 1
+            t = time.perf_counter()
             response = self.instrument.query(message)
             if response == 'E':
                 raise MotorControllerInvalidCommandError('Invalid Command: "{}"'.format(message))
             else:
+                self._last_response = time.perf_counter()
+                if self.profile is not None:
+                    self.profile.record('gpib_query', self._last_response - t)
                 return response
-        except visa.VisaIOError:
+        except CustomExceptions.VisaIOError:
             # timeout
             # reset connection next time use is needed
             self.instrument = None
+            self._last_response = None
+            self._pending = []
             raise
 
+    # Send a command via GPIB without reading a response
+    def _write(self, message):
+        try:
+            self.writes += 1
+            t = time.perf_counter()
+            self.instrument.write(message)
+            if self.profile is not None:
+                self.profile.record('gpib_write', time.perf_counter() - t)
+        except CustomExceptions.VisaIOError:
+            self.instrument = None
+            self._last_response = None
+            self._pending = []
+            raise
+
+    # Read the response to a command sent by _write
+    def _read(self):
+        try:
+            response = self.instrument.read()
+            self._last_response = time.perf_counter()
+            return response
+        except CustomExceptions.VisaIOError:
+            self.instrument = None
+            self._last_response = None
+            self._pending = []
+            raise
 
     # returns -1 if at axis min, 1 if at axis max, else 0
     def _check_endstop(self, axis):
@@ -0,0 +1,88 @@
+# Colour maps and interpolations of scan plots, shared by the GUI and headless image output. Doesn't import
+# Qt, and matplotlib only when an image is drawn, so it is cheap to import from scripts.
+from collections import OrderedDict
+
+from ImagePyramid import ImagePyramid
+
+# display name: matplotlib name
+INTERPOLATIONS = OrderedDict([
+    ('Nearest'              ,   'nearest'),
+    ('Linear'               ,   'bilinear'),
+    ('Cubic'                ,   'bicubic'),
+    ('Sinc'                 ,   'sinc')
+])
+CMAPS = OrderedDict([
+    ('Inferno'              ,   'inferno'),
+    ('Heat 1'               ,   'gist_heat'),
+    ('Grayscale'            ,   'gray'),
+    ('Heat 2'               ,   'hot'),
+    ('Grayscale Reversed'   ,   'Greys')
+])
+
+
+# imshow arguments for a 2d scan as displayed in the GUI, interp and cmap are display names
+def imshow_args(data, interp='Nearest', cmap='Inferno'):
+    return {
+        'X': data.data.T,
+        'interpolation': INTERPOLATIONS[interp],
+        'cmap': CMAPS[cmap],
+        'extent': [data.start[0], data.start[0]+data.scan_range[0], data.start[1]+data.scan_range[1], data.start[1]] }
+
+
+# draw a scan onto a matplotlib axis as displayed in the GUI, 2d scans at the resolution of the axis
+def draw_scan(axis, data, interp='Nearest', cmap='Inferno'):
+    if data.scan_axis is None:
+        draw_pyramid(axis, data, ImagePyramid(data.data), interp, cmap)
+        axis.set_xlabel('x position (mm)')
+        axis.set_ylabel('y position (mm)')
+    else:
+        axis.plot(data.positions, data.data)
+        axis.set_xlabel('{} position (mm)'.format('y' if data.scan_axis else 'x'))
+        axis.set_ylabel('Intensity')
+        axis.grid(True)
+
+
+# draw a 2d scan from its ImagePyramid at the resolution of the axis on screen rather than the scan's, so large
+# scans draw quickly. When the axis is zoomed (e.g. the toolbar of a pyplot window) the visible region is drawn
+# again from the level matching it. Returns the image
+def draw_pyramid(axis, data, pyramid, interp='Nearest', cmap='Inferno'):
+    x0, y0 = data.start[0], data.start[1]
+    # size (mm) of a data pixel in the image, as for imshow_args
+    pixel = (data.scan_range[0]/pyramid.shape[0], data.scan_range[1]/pyramid.shape[1])
+    extent = [x0, x0+data.scan_range[0], y0+data.scan_range[1], y0]
+    image = axis.imshow(pyramid.level(pyramid.n_levels - 1).T, interpolation=INTERPOLATIONS[interp],
+                        cmap=CMAPS[cmap], extent=extent)
+    axis.axis(extent)
+
+    def update(changed_axis=None):
+        # callbacks stay connected after the axis is cleared
+        if image.axes is not axis:
+            return
+        xlim, ylim = sorted(axis.get_xlim()), sorted(axis.get_ylim())
+        rows = (int((xlim[0] - x0)//pixel[0]), int(-(-(xlim[1] - x0)//pixel[0])))
+        columns = (int((ylim[0] - y0)//pixel[1]), int(-(-(ylim[1] - y0)//pixel[1]))) if pixel[1] else (0, 1)
+        box = axis.get_window_extent()
+        k = pyramid.choose_level((rows[1] - rows[0], columns[1] - columns[0]), (box.width, box.height))
+        part, (i0, i1, j0, j1) = pyramid.crop(k, rows, columns)
+        if part.size == 0:
+            return
+        image.set_data(part.T)
+        image.set_extent([x0 + i0*pixel[0], x0 + i1*pixel[0], y0 + j1*pixel[1], y0 + j0*pixel[1]])
+
+    update()
+    # colour scale of the whole scan, kept as the image is zoomed
+    image.autoscale()
+    axis.callbacks.connect('xlim_changed', update)
+    axis.callbacks.connect('ylim_changed', update)
+    return image
+
+
+# save a scan as an image (format from the extension of path) without a window, using the Agg backend rather
+# than pyplot so Qt isn't loaded
+def save_image(data, path, interp='Nearest', cmap='Inferno', dpi=100):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(dpi=dpi)
+    FigureCanvasAgg(fig)
+    draw_scan(fig.add_subplot(111), data, interp, cmap)
+    fig.savefig(path)
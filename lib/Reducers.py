@@ -0,0 +1,177 @@
+# Functions reducing the ADC samples taken at a pixel to a single value.
+# Reducers take a numpy array and reduce along axis (last by default), so the same function works on the
+# samples of one pixel or on an array of samples for many pixels at once.
+# New reducers are added with the register_reducer decorator, e.g.
+#
+#   @register_reducer('range')
+#   def reduce_range(samples, axis=-1):
+#       return numpy.ptp(samples, axis=axis)
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+REDUCERS = {}
+
+# fraction of samples removed from each end for the trimmed mean
+TRIM_FRACTION = 0.1
+# percentile used by the percentile reducer
+PERCENTILE = 90
+
+
+# reducers use ufunc reduce methods directly where possible as the numpy.mean etc wrappers add a
+# significant overhead for the small sample counts used per pixel
+
+# decorator registering a reducer under one or more names
+def register_reducer(*names):
+    def register(func):
+        for name in names:
+            REDUCERS[name] = func
+        return func
+    return register
+
+
+# returns reducer registered as name, raises ValueError if not found
+def get_reducer(name):
+    try:
+        return REDUCERS[name]
+    except KeyError:
+        raise ValueError('"{}" not valid value for "func", options are: {}'.format(
+            name, ', '.join(sorted(REDUCERS))))
+
+
+# apply reducer registered as name to samples
+def reduce_samples(samples, name, axis=-1):
+    return get_reducer(name)(samples, axis=axis)
+
+
+@register_reducer('max')
+def reduce_max(samples, axis=-1):
+    return numpy.maximum.reduce(samples, axis=axis)
+
+
+@register_reducer('average', 'mean')
+def reduce_mean(samples, axis=-1):
+    return numpy.add.reduce(samples, axis=axis, dtype=numpy.float64) / samples.shape[axis]
+
+
+# mean square of values
+@register_reducer('rms2')
+def reduce_rms2(samples, axis=-1):
+    return numpy.add.reduce(numpy.square(samples, dtype=numpy.float64), axis=axis) / samples.shape[axis]
+
+
+@register_reducer('rms')
+def reduce_rms(samples, axis=-1):
+    return numpy.sqrt(reduce_rms2(samples, axis))
+
+
+@register_reducer('sum')
+def reduce_sum(samples, axis=-1):
+    return numpy.add.reduce(samples, axis=axis, dtype=numpy.float64)
+
+
+@register_reducer('median')
+def reduce_median(samples, axis=-1):
+    return numpy.median(samples, axis=axis)
+
+
+# mean after removing TRIM_FRACTION of the samples from each end
+@register_reducer('trimmed_mean')
+def reduce_trimmed_mean(samples, axis=-1):
+    n = samples.shape[axis]
+    k = int(n * TRIM_FRACTION)
+    if k == 0:
+        return reduce_mean(samples, axis)
+    trimmed = numpy.partition(samples, (k, n - k - 1), axis=axis)
+    return reduce_mean(numpy.take(trimmed, range(k, n - k), axis=axis), axis)
+
+
+@register_reducer('percentile')
+def reduce_percentile(samples, axis=-1):
+    return numpy.percentile(samples, PERCENTILE, axis=axis)
+
+
+# cubes of raw samples with more samples than this are reduced in chunks of rows on several threads (numpy
+# releases the GIL inside its reductions so threads use multiple cores without copying the cube)
+PARALLEL_MIN_SAMPLES = 2**22
+
+
+# apply reducer registered as name to a cube of raw samples (..., samples), e.g. ScanData.raw_samples,
+# returning an array of the pixel values. sample_counts gives the number of valid samples of each pixel
+# when sampled sequentially (the rest are padding), pixels with a count of nan (not acquired, e.g. the rest of
+# a partial scan) or 0 are nan. workers: threads to use, defaults to the number of cores
+def reduce_raw(raw_samples, name, sample_counts=None, workers=None):
+    reducer = get_reducer(name)
+    raw_samples = numpy.asarray(raw_samples)
+    n = raw_samples.shape[-1]
+    if sample_counts is None:
+        return _reduce_parallel(reducer, raw_samples, workers)
+    sample_counts = numpy.asarray(sample_counts, dtype=numpy.float64)
+    acquired = numpy.isfinite(sample_counts) & (sample_counts > 0)
+    sample_counts = numpy.where(acquired, sample_counts, 0).astype(int)
+    values = numpy.full(raw_samples.shape[:-1], numpy.nan)
+    # pixels with the same number of samples are reduced together
+    for count in numpy.unique(sample_counts[acquired]):
+        mask = sample_counts == count
+        values[mask] = _reduce_parallel(reducer, raw_samples[mask][:, :min(count, n)], workers)
+    return values
+
+
+def _reduce_parallel(reducer, raw_samples, workers):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if raw_samples.size < PARALLEL_MIN_SAMPLES or workers == 1 or len(raw_samples) < 2:
+        return numpy.asarray(reducer(raw_samples), dtype=numpy.float64)
+    chunks = numpy.array_split(raw_samples, min(workers*4, len(raw_samples)))
+    with ThreadPoolExecutor(workers) as executor:
+        return numpy.concatenate([numpy.asarray(v, dtype=numpy.float64) for v in executor.map(reducer, chunks)])
+
+
+# Standard errors of reducer estimates, used by sequential sampling to decide when enough samples have been
+# taken. Each takes the 1d array of samples so far. Only reducers with an estimate that doesn't depend on the
+# number of samples can be used (not 'sum'), and 'max' and 'percentile' have no simple standard error.
+STANDARD_ERRORS = {}
+
+
+def register_standard_error(*names):
+    def register(func):
+        for name in names:
+            STANDARD_ERRORS[name] = func
+        return func
+    return register
+
+
+def get_standard_error(name):
+    try:
+        return STANDARD_ERRORS[name]
+    except KeyError:
+        raise ValueError('Sequential sampling not supported for "{}", options are: {}'.format(
+            name, ', '.join(sorted(STANDARD_ERRORS))))
+
+
+@register_standard_error('average', 'mean', 'trimmed_mean')
+def standard_error_mean(samples):
+    n = samples.shape[0]
+    return numpy.std(samples, ddof=1) / numpy.sqrt(n) if n > 1 else numpy.inf
+
+
+# asymptotic standard error of the median for normally distributed noise
+@register_standard_error('median')
+def standard_error_median(samples):
+    return 1.2533 * standard_error_mean(samples)
+
+
+@register_standard_error('rms2')
+def standard_error_rms2(samples):
+    return standard_error_mean(numpy.square(samples, dtype=numpy.float64))
+
+
+# propagated from the standard error of the mean square
+@register_standard_error('rms')
+def standard_error_rms(samples):
+    se = standard_error_rms2(samples)
+    rms = reduce_rms(samples)
+    if rms == 0:
+        return 0.0 if se == 0 else numpy.inf
+    return se / (2*rms)
@@ -0,0 +1,96 @@
+# Ordering of several image regions scanned as one job (Camera.scan_regions). Each region can be entered at
+# any of its 4 corners by choosing the order of its rows (ascending or descending along axis 0) and which end
+# of axis 1 its first row starts from. The order of the regions and the corner each is entered from are
+# planned to keep the stage travel between regions short: nearest neighbour tour, improved by 2-opt, with the
+# best corners for a given order found exactly by dynamic programming.
+import itertools
+
+# (descending, flip) ways of scanning a region, see Camera._acquire_image
+DIRECTIONS = tuple(itertools.product((False, True), repeat=2))
+
+
+# stage travel (mm) between two positions when each axis is moved in turn
+def manhattan(a, b):
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+
+# stage travel when both axes move at the same time (batched moves), as the time of the longest axis
+def chebyshev(a, b):
+    return max(abs(a[0] - b[0]), abs(a[1] - b[1]))
+
+
+# positions (entry, exit) of the first and last pixels of a region scanned in direction (descending, flip)
+# region is (start_pos, img_size, pixel_size) as for Camera.scan_image
+def region_corners(region, direction, serpentine=False):
+    start_pos, img_size, pixel_size = region
+    descending, flip = direction
+    rows = int(img_size[0]/pixel_size[0])
+    x = (start_pos[0], start_pos[0] + (rows - 1)*pixel_size[0])
+    y = (start_pos[1], start_pos[1] + int(img_size[1]/pixel_size[1])*pixel_size[1])
+    # the last row is reversed relative to the first if there is an even number of rows when serpentine, a
+    # reversed row ends at the start of axis 1 and a forward row at the far end
+    last_reversed = flip != (serpentine and (rows - 1) % 2 == 1)
+    return (x[int(descending)], y[int(flip)]), (x[int(not descending)], y[int(not last_reversed)])
+
+
+# best directions for regions visited in order from position, returns (travel, directions)
+def _best_directions(order, corners, position, distance):
+    # cost[d]: least travel to have scanned the regions so far ending with the last in direction d
+    cost = {d: distance(position, corners[order[0]][d][0]) for d in DIRECTIONS}
+    choices = []
+    for previous, region in zip(order, order[1:]):
+        new_cost, choice = {}, {}
+        for d in DIRECTIONS:
+            entry = corners[region][d][0]
+            new_cost[d], choice[d] = min((cost[p] + distance(corners[previous][p][1], entry), p) for p in DIRECTIONS)
+        cost = new_cost
+        choices.append(choice)
+    last = min(cost, key=cost.get)
+    directions = [last]
+    for choice in reversed(choices):
+        directions.append(choice[directions[-1]])
+    return cost[last], directions[::-1]
+
+
+# plan the order and directions to scan regions from the stage position (None if not homed, taken as 0, 0)
+# returns (list of (region index, (descending, flip)) in scan order, travel between regions)
+def plan_regions(regions, position=None, serpentine=False, distance=manhattan):
+    if not regions:
+        return [], 0
+    if position is None or None in position:
+        position = (0, 0)
+    corners = [{d: region_corners(region, d, serpentine) for d in DIRECTIONS} for region in regions]
+    # nearest neighbour tour: go to the closest corner of a region not yet scanned
+    order = []
+    remaining = set(range(len(regions)))
+    current = position
+    while remaining:
+        _, region, d = min((distance(current, corners[r][d][0]), r, d) for r in remaining for d in DIRECTIONS)
+        order.append(region)
+        remaining.remove(region)
+        current = corners[region][d][1]
+    travel, directions = _best_directions(order, corners, position, distance)
+    # 2-opt: reverse sections of the tour while that shortens it
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 2, len(order) + 1):
+                candidate = order[:i] + order[i:j][::-1] + order[j:]
+                candidate_travel, candidate_directions = _best_directions(candidate, corners, position, distance)
+                if candidate_travel < travel - 1e-9:
+                    order, travel, directions = candidate, candidate_travel, candidate_directions
+                    improved = True
+    return list(zip(order, directions)), travel
+
+
+# travel between regions scanned in the order given, all from their start corner
+def unplanned_travel(regions, position=None, serpentine=False, distance=manhattan):
+    if position is None or None in position:
+        position = (0, 0)
+    travel = 0
+    for region in regions:
+        entry, exit = region_corners(region, (False, False), serpentine)
+        travel += distance(position, entry)
+        position = exit
+    return travel
@@ -0,0 +1,157 @@
+# Runs scans on several rigs (motor controller and adc board pairs) connected to one workstation at the same
+# time. Each rig has a worker process holding its Camera: the K8055 dll reads from the board opened last in a
+# process, and scans on one rig don't wait on another's GPIB or adc calls. Scans submitted to a rig run one
+# after another in its process, scans on different rigs run concurrently. Results (ScanData) are returned to
+# the calling process.
+# A rig is a dict: name, gpib_address (VISA resource name or GPIB primary address), adc_card (0-3) and, to use
+# the simulated hardware instead, simulated (keyword arguments of simulated_controllers, e.g. {'seed': 1}).
+# usage (processes are spawned, so scripts must create the pool under if __name__ == '__main__'):
+#   rigs = [{'name': 'left', 'gpib_address': 6, 'adc_card': 0}, {'name': 'right', 'gpib_address': 7, 'adc_card': 1}]
+#   with RigPool(rigs) as pool:
+#       scans = pool.scan_all('scan_image', ((10, 10), (20, 20), (0.1, 0.1)))
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+
+from JobQueue import JOB_METHODS, apply_settings
+
+RIG_DIRECTORY = 'ScanData/rigs'
+
+# Camera methods which can be run on a rig
+RIG_METHODS = tuple(JOB_METHODS) + ('resume_scan',)
+
+# state of the rig in a worker process: its description, directory and Camera (created by the first scan)
+_rig = {}
+
+
+def _start_worker(rig, directory, keep_open, abort):
+    _rig.update(rig=rig, directory=directory, keep_open=keep_open, camera=None)
+    # abort is set by RigPool.abort, ending the scan running in this process
+    thread = threading.Thread(target=_watch_abort, args=(abort,), name='RigPool abort', daemon=True)
+    thread.start()
+
+
+def _watch_abort(abort):
+    while True:
+        abort.wait()
+        abort.clear()
+        if _rig['camera'] is not None:
+            _rig['camera'].end_flag = True
+
+
+# Camera of the rig, created in the worker so device errors are raised by the scan rather than breaking the pool
+def _camera():
+    if _rig['camera'] is None:
+        from Camera import Camera
+        from ScanPlanner import ScanPlanner
+        rig = _rig['rig']
+        if rig.get('simulated') is not None:
+            from SimulatedHardware import simulated_controllers
+            motors, adc, stage = simulated_controllers(address=rig.get('gpib_address'), card=rig.get('adc_card', 0),
+                                                        **rig['simulated'])
+            camera = Camera(motors=motors, adc=adc)
+        else:
+            camera = Camera(gpib_address=rig.get('gpib_address'), adc_card=rig.get('adc_card', 0))
+        # each rig has its own checkpoint, timing model and profile log
+        directory = _rig['directory']
+        os.makedirs(directory, exist_ok=True)
+        camera.CHECKPOINT_FILE = os.path.join(directory, 'last_image_backup.scanbin')
+        camera.PROFILE_FILE = os.path.join(directory, 'scan_profile.csv')
+        camera.planner = ScanPlanner.load(os.path.join(directory, 'timing_model.json'))
+        _rig['camera'] = camera
+    camera = _rig['camera']
+    if _rig['keep_open'] and camera.hardware_session is None:
+        camera.open_session()
+    return camera
+
+
+def _run_scan(method, args, kwargs, settings):
+    camera = _camera()
+    camera.end_flag = False
+    previous = apply_settings(camera, settings)
+    try:
+        return getattr(camera, method)(*args, **kwargs)
+    finally:
+        apply_settings(camera, previous)
+
+
+def _close_worker():
+    if _rig['camera'] is not None:
+        _rig['camera'].close()
+        _rig['camera'] = None
+
+
+class RigPool:
+
+    # rigs: list of rig dicts (see above). keep_open keeps each rig's devices open between its scans
+    # (see Camera.session)
+    def __init__(self, rigs, keep_open=True, directory=RIG_DIRECTORY):
+        names = [rig['name'] for rig in rigs]
+        if len(set(names)) != len(names):
+            raise ValueError('Rig names must be unique, got: {}'.format(', '.join(names)))
+        self.rigs = {rig['name']: rig for rig in rigs}
+        # spawned rather than forked on every platform, so workers don't inherit open devices or threads
+        context = multiprocessing.get_context('spawn')
+        self._aborts = {}
+        self._executors = {}
+        # futures of scans submitted to each rig not yet finished
+        self._futures = {name: [] for name in self.rigs}
+        for name, rig in self.rigs.items():
+            self._aborts[name] = context.Event()
+            self._executors[name] = concurrent.futures.ProcessPoolExecutor(
+                1, context, initializer=_start_worker,
+                initargs=(rig, os.path.join(directory, name), keep_open, self._aborts[name]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # run a Camera scan method (see RIG_METHODS) on a rig, returns a concurrent.futures.Future of its result
+    # settings: Camera settings (attribute: value) used for this scan only, as for JobQueue
+    def submit(self, rig, method, args=(), kwargs=None, settings=None):
+        if method not in RIG_METHODS:
+            raise ValueError('"{}" can not be run on a rig, options are: {}'.format(method, ', '.join(RIG_METHODS)))
+        if rig not in self._executors:
+            raise ValueError('No rig named "{}", rigs are: {}'.format(rig, ', '.join(self.rigs)))
+        kwargs = dict(kwargs) if kwargs is not None else {}
+        # progress of several rigs printed at once would be unreadable
+        if method != 'scan_row':
+            kwargs.setdefault('display_time', False)
+        future = self._executors[rig].submit(_run_scan, method, tuple(args), kwargs,
+                                            settings if settings is not None else {})
+        self._futures[rig] = [f for f in self._futures[rig] if not f.done()] + [future]
+        return future
+
+    # run the same scan on every rig, returns {rig name: result}
+    def scan_all(self, method, args=(), kwargs=None, settings=None):
+        futures = {rig: self.submit(rig, method, args, kwargs, settings) for rig in self.rigs}
+        return dict(zip(futures, self.gather(futures.values())))
+
+    # run scans given as (rig, method, args[, kwargs[, settings]]), returns their results in the same order
+    def run(self, scans):
+        return self.gather([self.submit(*scan) for scan in scans])
+
+    # results of futures in order, once all have finished. Raises the first error if any scan failed
+    @staticmethod
+    def gather(futures):
+        futures = list(futures)
+        concurrent.futures.wait(futures)
+        return [future.result() for future in futures]
+
+    # abort the scan running on a rig (all rigs if None), its result is None as for an aborted Camera scan.
+    # Scans still waiting to run are cancelled
+    def abort(self, rig=None):
+        for name in self.rigs if rig is None else [rig]:
+            for future in self._futures[name]:
+                future.cancel()
+            self._aborts[name].set()
+
+    # close each rig's devices and stop the worker processes, waiting for submitted scans to finish
+    def close(self):
+        for executor in self._executors.values():
+            executor.submit(_close_worker)
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
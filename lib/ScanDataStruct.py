@@ -1,7 +1,19 @@
+import numpy
+
+
 # data structure to store info about data for GUI
+# data and the other per pixel values are numpy arrays (2d for image scans, 1d for row scans), with the
+# positions (mm) of the pixels along each axis in x and y. Slicing (scan[10:20, ::2]) or roi gives a ScanData
+# viewing part of the arrays without copying
 class ScanData:
+    __slots__ = ('step', 'start', 'scan_range', 'data', 'timestamp', 'name', 'scan_axis', 'off_axis_pos',
+                'settle_times', 'sample_counts', 'cells', 'raw_samples', 'pixel_times', 'x', 'y')
+    # arrays with a value (or values) for each pixel
+    PIXEL_ARRAYS = ('data', 'settle_times', 'sample_counts', 'raw_samples', 'pixel_times')
+
     def __init__(self, step, start, scan_range, data, timestamp, scan_axis=None,
-                off_axis_pos=None, name=None):
+                off_axis_pos=None, name=None, settle_times=None, sample_counts=None, cells=None,
+                raw_samples=None, pixel_times=None):
         self.step = step
         self.start = start
         self.scan_range = scan_range
@@ -10,3 +22,93 @@ class ScanData:
         self.name = name
         self.scan_axis = scan_axis
         self.off_axis_pos = off_axis_pos
+        # time (s) waited for sensor to settle before each pixel, same shape as data
+        self.settle_times = settle_times
+        # samples taken at each pixel when sampling sequentially, otherwise None
+        self.sample_counts = sample_counts
+        # adaptive scans: list of (x, y, size, value) cells of different sizes that data was resampled from
+        self.cells = cells
+        # raw capture: every adc sample of each pixel (shape of data + (samples,)) and the time (s since epoch)
+        # each pixel was sampled, otherwise None. Values can be recalculated with Reducers.reduce_raw
+        self.raw_samples = raw_samples
+        self.pixel_times = pixel_times
+        self._init_arrays()
+
+    # convert per pixel values to arrays (no copy if they already are) and calculate coordinates
+    def _init_arrays(self):
+        self.data = numpy.asarray(self.data, dtype=numpy.float64)
+        for name in ('settle_times', 'sample_counts', 'pixel_times'):
+            if getattr(self, name) is not None:
+                setattr(self, name, numpy.asarray(getattr(self, name), dtype=numpy.float64))
+        if self.raw_samples is not None:
+            self.raw_samples = numpy.asarray(self.raw_samples)
+        if self.scan_axis is None:
+            self.x = self.start[0] + self.step[0]*numpy.arange(self.data.shape[0])
+            self.y = self.start[1] + self.step[1]*numpy.arange(self.data.shape[1])
+        else:
+            positions = self.start + self.step*numpy.arange(len(self.data))
+            other = numpy.array([self.off_axis_pos]) if self.off_axis_pos is not None else None
+            self.x, self.y = (other, positions) if self.scan_axis else (positions, other)
+
+    # positions along the scan axis of a 1d scan
+    @property
+    def positions(self):
+        return self.y if self.scan_axis else self.x
+
+    # view of part of the scan, key is a slice for 1d scans or up to 2 slices for 2d scans
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > self.data.ndim or not all(isinstance(k, slice) and (k.step or 1) > 0 for k in key):
+            raise IndexError('ScanData can only be indexed with {} slice(s) with positive steps'.format(
+                self.data.ndim))
+        key = key + (slice(None),)*(self.data.ndim - len(key))
+        view = ScanData.__new__(ScanData)
+        for name in self.__slots__:
+            setattr(view, name, getattr(self, name))
+        for name in self.PIXEL_ARRAYS:
+            if getattr(self, name) is not None:
+                setattr(view, name, getattr(self, name)[key])
+        if view.data.size == 0:
+            raise IndexError('Slice of ScanData contains no pixels')
+        if self.scan_axis is None:
+            view.x, view.y = self.x[key[0]], self.y[key[1]]
+            view.step = (self.step[0]*(key[0].step or 1), self.step[1]*(key[1].step or 1))
+            view.start = (float(view.x[0]), float(view.y[0]))
+            # same relation of scan_range to the number of pixels as Camera.scan_image
+            view.scan_range = (len(view.x)*view.step[0], (len(view.y) - 1)*view.step[1])
+        else:
+            positions = self.positions[key[0]]
+            view.step = self.step*(key[0].step or 1)
+            view.start = float(positions[0])
+            view.scan_range = (len(positions) - 1)*view.step
+            if self.scan_axis:
+                view.y = positions
+            else:
+                view.x = positions
+        return view
+
+    # view of the pixels with x_min <= x <= x_max and y_min <= y <= y_max (mm), None for no limit
+    # only the x limits are used for 1d scans, as positions along the scan axis
+    def roi(self, x_min=None, x_max=None, y_min=None, y_max=None):
+        if self.scan_axis is not None:
+            return self[self._range_slice(self.positions, x_min, x_max)]
+        return self[self._range_slice(self.x, x_min, x_max), self._range_slice(self.y, y_min, y_max)]
+
+    @staticmethod
+    def _range_slice(coordinates, low, high):
+        start = numpy.searchsorted(coordinates, low - 1e-9, 'left') if low is not None else None
+        stop = numpy.searchsorted(coordinates, high + 1e-9, 'right') if high is not None else None
+        return slice(start, stop)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name not in ('x', 'y')}
+
+    # also loads pickles of the previous (dict based) class, which stored nested lists and may not have
+    # the attributes added since
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._init_arrays()
@@ -0,0 +1,170 @@
+# Bulk export of scan files (.scanbin, or legacy .scandat) to csv with the pixel positions, npy or png images
+# drawn as in the GUI, without the GUI. Scan files are memory mapped and written a chunk of rows at a time, so
+# scans larger than memory can be exported, and files are exported in parallel by a pool of processes.
+# csv: the first line is the y positions (mm) and each following line an x position then that row of data,
+# for 1d scans a line per pixel of position and value. npy: the data array as ScanData.data (x, y).
+# usage: python ScanExport.py [files or directories, default ScanData] [--format=csv,npy,png] [--output=dir]
+#        [--processes=4] [--cmap=Inferno] [--interp=Nearest] [--overwrite]
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+
+import numpy
+
+from ScanFile import load_scan, load_legacy, SCAN_FILE_EXTENSION, LEGACY_EXTENSION
+import PlotStyles
+
+EXPORT_FORMATS = ('csv', 'npy', 'png')
+# directories (in the program directory) each format is saved to unless an output directory is given
+OUTPUT_DIRECTORIES = {'csv': 'CsvData', 'npy': 'NpyData', 'png': 'Images'}
+
+# memory (bytes) of the rows of data converted at once
+CHUNK_MEMORY = 64*2**20
+# %.17g keeps full precision without the exponent of numpy's default format
+CSV_FORMAT = '%.17g'
+
+
+# scan files in the given files and directories, sorted by name within each directory
+def find_scans(paths=('ScanData',)):
+    scans = []
+    for path in paths:
+        if os.path.isdir(path):
+            scans.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if os.path.splitext(name)[1] in (SCAN_FILE_EXTENSION, LEGACY_EXTENSION))
+        else:
+            scans.append(path)
+    return scans
+
+
+def open_scan(path):
+    if os.path.splitext(path)[1] == LEGACY_EXTENSION:
+        return load_legacy(path)
+    return load_scan(path)
+
+
+# rows of a 2d array converted at once, by default as many as fit in CHUNK_MEMORY
+def _chunk_rows(data, chunk_rows=None):
+    if chunk_rows is not None:
+        return chunk_rows
+    return max(1, CHUNK_MEMORY // (8*max(data.shape[1], 1)))
+
+
+def export_csv(scan, path, chunk_rows=None):
+    with open(path, 'w', newline='') as f:
+        if scan.scan_axis is not None:
+            f.write('{} position (mm),intensity\n'.format('y' if scan.scan_axis else 'x'))
+            numpy.savetxt(f, numpy.column_stack((scan.positions, scan.data)), fmt=CSV_FORMAT, delimiter=',')
+            return
+        f.write('x\\y (mm),' + ','.join(CSV_FORMAT % y for y in scan.y) + '\n')
+        rows = _chunk_rows(scan.data, chunk_rows)
+        for first in range(0, scan.data.shape[0], rows):
+            block = numpy.asarray(scan.data[first:first + rows])
+            numpy.savetxt(f, numpy.column_stack((scan.x[first:first + rows], block)), fmt=CSV_FORMAT,
+                          delimiter=',')
+
+
+def export_npy(scan, path, chunk_rows=None):
+    if scan.scan_axis is not None:
+        numpy.save(path, numpy.asarray(scan.data, dtype=numpy.float64))
+        return
+    out = numpy.lib.format.open_memmap(path, mode='w+', dtype=numpy.float64, shape=scan.data.shape)
+    rows = _chunk_rows(scan.data, chunk_rows)
+    for first in range(0, scan.data.shape[0], rows):
+        out[first:first + rows] = scan.data[first:first + rows]
+    out.flush()
+    del out
+
+
+def export_png(scan, path, interp='Nearest', cmap='Inferno', dpi=100):
+    PlotStyles.save_image(scan, path, interp, cmap, dpi)
+
+
+# path of the export of a scan file in a format, in directory or the format's OUTPUT_DIRECTORIES
+def export_path(path, export_format, directory=None):
+    if directory is None:
+        directory = OUTPUT_DIRECTORIES[export_format]
+    return os.path.join(directory, os.path.splitext(os.path.basename(path))[0] + '.' + export_format)
+
+
+# export one scan file in each format, returns the paths written. Exports newer than the scan file are kept
+# unless overwrite
+def export_scan(path, formats=('csv',), directory=None, interp='Nearest', cmap='Inferno', overwrite=False,
+                chunk_rows=None):
+    outputs = []
+    scan = None
+    for export_format in formats:
+        output = export_path(path, export_format, directory)
+        if not overwrite and os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(path):
+            continue
+        if scan is None:
+            scan = open_scan(path)
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        # written under another name first, so an export that fails part way isn't taken as up to date
+        root, extension = os.path.splitext(output)
+        part = root + '.part' + extension
+        try:
+            if export_format == 'csv':
+                export_csv(scan, part, chunk_rows)
+            elif export_format == 'npy':
+                export_npy(scan, part, chunk_rows)
+            else:
+                export_png(scan, part, interp, cmap)
+            os.replace(part, output)
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+        outputs.append(output)
+    return outputs
+
+
+# export scan files (see find_scans) in each format, using processes worker processes (all cpus if None, in
+# this process if 1). A file that fails doesn't stop the others. Returns ({path: paths written},
+# {path: error message}). Processes are spawned, so scripts must call this under if __name__ == '__main__'
+def export_scans(paths=('ScanData',), formats=('csv',), directory=None, interp='Nearest', cmap='Inferno',
+                 processes=None, overwrite=False, chunk_rows=None):
+    for export_format in formats:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError('Unknown export format "{}", options are: {}'.format(
+                export_format, ', '.join(EXPORT_FORMATS)))
+    # names as shown in the GUI, checked here rather than failing in each worker
+    if interp not in PlotStyles.INTERPOLATIONS:
+        raise ValueError('Unknown interpolation "{}", options are: {}'.format(
+            interp, ', '.join(PlotStyles.INTERPOLATIONS)))
+    if cmap not in PlotStyles.CMAPS:
+        raise ValueError('Unknown colour map "{}", options are: {}'.format(cmap, ', '.join(PlotStyles.CMAPS)))
+    scans = find_scans(paths)
+    args = (tuple(formats), directory, interp, cmap, overwrite, chunk_rows)
+    exported, failed = {}, {}
+    processes = min(processes or os.cpu_count() or 1, len(scans))
+    if processes <= 1:
+        for path in scans:
+            try:
+                exported[path] = export_scan(path, *args)
+            except Exception as e:
+                failed[path] = '{}: {}'.format(type(e).__name__, e)
+        return exported, failed
+    # spawned rather than forked so workers don't inherit the GUI's Qt state or open devices
+    with concurrent.futures.ProcessPoolExecutor(processes, multiprocessing.get_context('spawn')) as executor:
+        futures = {path: executor.submit(export_scan, path, *args) for path in scans}
+        for path, future in futures.items():
+            try:
+                exported[path] = future.result()
+            except Exception as e:
+                failed[path] = '{}: {}'.format(type(e).__name__, e)
+    return exported, failed
+
+
+if __name__ == '__main__':
+    options = {arg.split('=')[0]: arg.split('=', 1)[1] if '=' in arg else True
+               for arg in sys.argv[1:] if arg.startswith('--')}
+    paths = [arg for arg in sys.argv[1:] if not arg.startswith('--')] or ['ScanData']
+    exported, failed = export_scans(paths, options.get('--format', 'csv').split(','), options.get('--output'),
+                                    options.get('--interp', 'Nearest'), options.get('--cmap', 'Inferno'),
+                                    int(options['--processes']) if '--processes' in options else None,
+                                    '--overwrite' in options)
+    for path, outputs in exported.items():
+        print('{} -> {}'.format(path, ', '.join(outputs) if outputs else 'up to date'))
+    for path, error in failed.items():
+        print('{} failed: {}'.format(path, error))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,310 @@
+# Binary scan file format, rows are appended as they are acquired so a partial scan is kept if the
+# program stops mid-scan, and files are opened lazily by memory mapping the data.
+#
+# Layout (little endian):
+#   magic       8 bytes     b'MWIRSCAN'
+#   version     uint16
+#   header_size uint32      bytes reserved for the header
+#   header      header_size bytes of utf-8 JSON metadata, padded with spaces
+#   rows        one record per row: for each field in header['fields'], header['shape'][1] values, float64
+#               unless given in header['field_formats'] as [dtype, extra dimensions] (e.g. raw samples)
+#
+# The number of rows written is found from the file size, so an incomplete last row is ignored.
+# Legacy pickled .scandat files can be converted with: python ScanFile.py file.scandat [...]
+import json
+import os
+import pickle
+import struct
+import sys
+
+import numpy
+
+from ScanDataStruct import ScanData
+
+SCAN_FILE_EXTENSION = '.scanbin'
+LEGACY_EXTENSION = '.scandat'
+MAGIC = b'MWIRSCAN'
+VERSION = 2
+PREAMBLE = struct.Struct('<8sHI')
+# space reserved for the header so it can be updated in place when the scan completes
+HEADER_RESERVE = 4096
+
+
+class ScanFileError(Exception):
+    # file is not a valid scan file
+    pass
+
+
+def _json_value(value):
+    # tuples and numpy values to plain JSON types
+    if isinstance(value, (tuple, list)):
+        return [_json_value(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _json_value(v) for k, v in value.items()}
+    if isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+
+# numpy dtype of the row records described by a header
+def _record_dtype(header):
+    columns = header['shape'][1]
+    formats = header.get('field_formats', {})
+    return numpy.dtype([(name, formats[name][0], (columns,) + tuple(formats[name][1])) if name in formats
+                        else (name, '<f8', (columns,)) for name in header['fields']])
+
+
+class ScanFileWriter:
+
+    # shape: (rows, columns), a 1d scan is stored as a single row
+    # fields: names of per pixel values stored in each row, 'data' first. A field which isn't a single float
+    # per pixel is given as (name, dtype, shape of each pixel's values), e.g. ('raw', 'uint8', (20,))
+    # settings: dict of any other information to keep with the scan
+    def __init__(self, path, step, start, scan_range, shape, scan_axis=None, off_axis_pos=None, name=None,
+                    fields=('data',), settings=None):
+        self.path = path
+        self.header = {
+            'version': VERSION,
+            'step': _json_value(step),
+            'start': _json_value(start),
+            'scan_range': _json_value(scan_range),
+            'scan_axis': scan_axis,
+            'off_axis_pos': _json_value(off_axis_pos),
+            'name': name,
+            'shape': list(shape),
+            'fields': [f if isinstance(f, str) else f[0] for f in fields],
+            'field_formats': {f[0]: [numpy.dtype(f[1]).str, list(f[2])] for f in fields if not isinstance(f, str)},
+            'settings': settings if settings is not None else {},
+            'timestamp': None,
+            'complete': False,
+        }
+        self.dtype = _record_dtype(self.header)
+        self.rows_written = 0
+        header = self._encode_header()
+        self.header_size = max(HEADER_RESERVE, len(header))
+        self.file = open(path, 'wb')
+        self.file.write(PREAMBLE.pack(MAGIC, VERSION, self.header_size))
+        self.file.write(header.ljust(self.header_size))
+        self.file.flush()
+
+    # reopen an incomplete scan file to append the remaining rows, a partly written last row is removed
+    @classmethod
+    def resume(cls, path):
+        scan_file = ScanFile(path)
+        scan_file.check_resumable()
+        end = scan_file.offset + scan_file.rows_written*scan_file.dtype.itemsize
+        scan_file.close()
+        writer = cls.__new__(cls)
+        writer.path = path
+        writer.header = scan_file.header
+        writer.header_size = scan_file.offset - PREAMBLE.size
+        writer.dtype = scan_file.dtype
+        writer.rows_written = scan_file.rows_written
+        writer.file = open(path, 'r+b')
+        writer.file.truncate(end)
+        writer.file.seek(end)
+        return writer
+
+    def _encode_header(self):
+        return json.dumps(self.header).encode('utf-8')
+
+    # append a row, fields gives values of the other fields (by name) for the row
+    def append_row(self, row, **fields):
+        record = numpy.zeros(1, self.dtype)
+        record['data'] = row
+        for name in self.header['fields'][1:]:
+            record[name] = fields[name]
+        self.file.write(record.tobytes())
+        # flush so rows survive the program stopping
+        self.file.flush()
+        self.rows_written += 1
+
+    # append several rows at once (a 2d array), fields gives arrays of the other fields with a row for each
+    def append_rows(self, rows, **fields):
+        records = numpy.zeros(len(rows), self.dtype)
+        records['data'] = rows
+        for name in self.header['fields'][1:]:
+            records[name] = fields[name]
+        self.file.write(records.tobytes())
+        self.file.flush()
+        self.rows_written += len(rows)
+
+    # update header entries in place (e.g. settings as the scan progresses), the file can have been closed
+    def update_header(self, **entries):
+        self.header.update({k: _json_value(v) for k, v in entries.items()})
+        header = self._encode_header()
+        if len(header) > self.header_size:
+            raise ScanFileError('Header too large to update in place ({} > {} bytes)'.format(
+                len(header), self.header_size))
+        if self.file.closed:
+            with open(self.path, 'r+b') as f:
+                f.seek(PREAMBLE.size)
+                f.write(header.ljust(self.header_size))
+        else:
+            self.file.seek(PREAMBLE.size)
+            self.file.write(header.ljust(self.header_size))
+            self.file.seek(0, os.SEEK_END)
+            self.file.flush()
+
+    # mark scan complete, cells of adaptive scans are stored in the header
+    def finish(self, timestamp, cells=None):
+        self.close()
+        entries = {'timestamp': timestamp, 'complete': True}
+        if cells is not None:
+            entries['cells'] = cells
+        try:
+            self.update_header(**entries)
+        except ScanFileError:
+            # header has grown too large, rewrite file with a bigger header
+            self._rewrite()
+
+    def _rewrite(self):
+        scan_file = ScanFile(self.path)
+        records = numpy.array(scan_file.records)
+        scan_file.close()
+        header = self._encode_header()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+            f.write(header)
+            f.write(records.tobytes())
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class ScanFile:
+
+    # open file lazily, data is memory mapped rather than read
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            preamble = f.read(PREAMBLE.size)
+            if len(preamble) < PREAMBLE.size:
+                raise ScanFileError('File too short to be a scan file.')
+            magic, version, header_size = PREAMBLE.unpack(preamble)
+            if magic != MAGIC:
+                raise ScanFileError('Not a scan file (magic bytes {!r}).'.format(magic))
+            if version > VERSION:
+                raise ScanFileError('Scan file version {} is newer than supported version {}.'.format(
+                    version, VERSION))
+            try:
+                self.header = json.loads(f.read(header_size).decode('utf-8'))
+            except ValueError as e:
+                raise ScanFileError('Corrupted scan file header: {}'.format(e))
+        self.offset = PREAMBLE.size + header_size
+        self.dtype = _record_dtype(self.header)
+        self.rows_written = (os.path.getsize(path) - self.offset) // self.dtype.itemsize
+        if self.rows_written > 0:
+            self.records = numpy.memmap(path, dtype=self.dtype, mode='r', offset=self.offset,
+                                        shape=(self.rows_written,))
+        else:
+            self.records = numpy.zeros(0, dtype=self.dtype)
+
+    @property
+    def complete(self):
+        return self.header['complete']
+
+    # raises ScanFileError if the file isn't an incomplete 2d scan that can be continued
+    def check_resumable(self):
+        if self.complete:
+            raise ScanFileError('Scan in "{}" is already complete.'.format(self.path))
+        if self.header['scan_axis'] is not None or self.header.get('cells') is not None:
+            raise ScanFileError('Only 2D image scans can be resumed.')
+
+    # (rows written, columns) array of a field
+    def field(self, name):
+        return self.records[name]
+
+    # ScanData with data (and other fields) as memory mapped arrays, only the rows written so far, or read into
+    # memory if copy (for a file that will be written again, e.g. a checkpoint)
+    # incomplete scans have no timestamp so take the time the file was last written
+    def to_scandata(self, copy=False):
+        h = self.header
+        timestamp = h['timestamp'] if h['timestamp'] is not None else os.path.getmtime(self.path)
+        fields = {name: numpy.array(self.field(name)) if copy else self.field(name) for name in h['fields']}
+        # 1d scans are stored as a single row
+        if h['scan_axis'] is not None:
+            fields = {name: f[0] if len(f) else f for name, f in fields.items()}
+        tuple_or_value = lambda v: tuple(v) if isinstance(v, list) else v
+        scan = ScanData(tuple_or_value(h['step']), tuple_or_value(h['start']), tuple_or_value(h['scan_range']),
+                        fields['data'], timestamp, h['scan_axis'], h['off_axis_pos'], h['name'],
+                        settle_times=fields.get('settle_time'), sample_counts=fields.get('sample_count'),
+                        raw_samples=fields.get('raw'), pixel_times=fields.get('timestamp'),
+                        cells=[tuple(c) for c in h['cells']] if h.get('cells') is not None else None)
+        return scan
+
+    def close(self):
+        mm = getattr(self.records, '_mmap', None)
+        self.records = None
+        if mm is not None:
+            mm.close()
+
+
+# save a ScanData to path
+def save_scan(scan, path, settings=None):
+    # first scans performed didn't record scan_axis etc (but are all 2d)
+    scan_axis = getattr(scan, 'scan_axis', None)
+    # 1d scans are stored as a single row
+    as_rows = (lambda values: numpy.asarray(values)[numpy.newaxis]) if scan_axis is not None else numpy.asarray
+    data = as_rows(numpy.asarray(scan.data, dtype=numpy.float64))
+    extra = {name: as_rows(values) for name, values in (('settle_time', scan.settle_times),
+            ('sample_count', scan.sample_counts), ('timestamp', scan.pixel_times), ('raw', scan.raw_samples))
+            if values is not None}
+    fields = ['data'] + [(name, values.dtype, values.shape[2:]) if name == 'raw' else name
+                        for name, values in extra.items()]
+    writer = ScanFileWriter(path, scan.step, scan.start, scan.scan_range, data.shape, scan_axis,
+                            getattr(scan, 'off_axis_pos', None), getattr(scan, 'name', None), fields, settings)
+    for i, row in enumerate(data):
+        writer.append_row(row, **{name: values[i] for name, values in extra.items()})
+    writer.finish(scan.timestamp, scan.cells)
+
+
+# open a scan file, returns ScanData with memory mapped data
+def load_scan(path):
+    return ScanFile(path).to_scandata()
+
+
+# only allow the classes a legacy .scandat file should contain to be unpickled
+class _LegacyUnpickler(pickle.Unpickler):
+
+    ALLOWED = {
+        ('ScanDataStruct', 'ScanData'),
+        ('numpy', 'dtype'),
+        ('numpy', 'ndarray'),
+        ('numpy.core.multiarray', 'scalar'),
+        ('numpy.core.multiarray', '_reconstruct'),
+        ('numpy._core.multiarray', 'scalar'),
+        ('numpy._core.multiarray', '_reconstruct'),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError('"{}.{}" not allowed in scan data file.'.format(module, name))
+        if (module, name) == ('ScanDataStruct', 'ScanData'):
+            return ScanData
+        return super().find_class(module, name)
+
+
+# load a legacy pickled ScanData (.scandat), refusing anything other than scan data
+def load_legacy(path):
+    with open(path, 'rb') as f:
+        scan = _LegacyUnpickler(f).load()
+    if not isinstance(scan, ScanData):
+        raise pickle.UnpicklingError('File does not contain ScanData.')
+    return scan
+
+
+# convert a legacy .scandat file to the binary format, returns path of new file
+def convert_legacy(path, new_path=None):
+    if new_path is None:
+        new_path = os.path.splitext(path)[0] + SCAN_FILE_EXTENSION
+    save_scan(load_legacy(path), new_path)
+    return new_path
+
+
+if __name__ == '__main__':
+    for legacy_path in sys.argv[1:]:
+        print('{} -> {}'.format(legacy_path, convert_legacy(legacy_path)))
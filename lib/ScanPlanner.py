@@ -0,0 +1,288 @@
+# Scan duration estimates made before a scan starts.
+# Uses a model of the hardware timings (move time against distance, time per ADC sample, settle pause
+# and processing per pixel) which is refined from the timings measured during previous scans.
+import json
+import math
+import time
+
+from ScanProfile import ScanProfile
+
+TIMING_MODEL_FILE = 'ScanData/timing_model.json'
+
+# initial estimates before any scans have been timed
+DEFAULT_MODEL = {
+    'move_overhead'     :   0.03,       # seconds per move command (GPIB round trip + acceleration)
+    'move_per_mm'       :   0.2,        # seconds per mm travelled
+    'read_latency'      :   0.001,      # seconds per ADC sample
+    'pixel_overhead'    :   0.001,      # processing per pixel
+}
+
+# weight given to previous observations when adding timings from a new scan
+FORGET_FACTOR = 0.8
+
+# distance (mm) moved to each endstop when homing
+HOMING_DISTANCE = 60
+
+
+# seconds to a readable string
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    h, m, s = seconds // 3600, seconds // 60 % 60, seconds % 60
+    if h:
+        return '{}h {}m {}s'.format(h, m, s)
+    elif m:
+        return '{}m {}s'.format(m, s)
+    return '{}s'.format(s)
+
+
+# accumulates the timings of a single scan
+class ScanTimer:
+
+    def __init__(self, settle_mode='fixed', sampling_mode='fixed'):
+        self.settle_mode = settle_mode
+        self.sampling_mode = sampling_mode
+        # fly scans read the adc during moves, so only their moves are used to refine the model
+        self.fly = False
+        self.settles = 0
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        # sums for least squares fit of move time against distance
+        self.moves = {'n': 0, 'd': 0.0, 't': 0.0, 'dd': 0.0, 'dt': 0.0}
+        self.samples = 0
+        self.read_time = 0.0
+        self.settle_time = 0.0
+        self.pixels = 0
+        # GPIB traffic, from the motor controller's counters
+        self._gpib_start = (0, 0)
+        self.round_trips = 0
+        self.writes = 0
+        # latency histograms of moves, settles and reads, and of whatever else records into it during the scan
+        self.profile = ScanProfile()
+
+    def move(self, distance, duration):
+        self.profile.record('move', duration)
+        d = abs(distance)
+        self.moves['n'] += 1
+        self.moves['d'] += d
+        self.moves['t'] += duration
+        self.moves['dd'] += d*d
+        self.moves['dt'] += d*duration
+
+    def read(self, n_samples, duration):
+        self.profile.record('pixel_read', duration)
+        self.samples += n_samples
+        self.read_time += duration
+        self.pixels += 1
+
+    def settle(self, duration):
+        self.profile.record('settle', duration)
+        self.settles += 1
+        self.settle_time += duration
+
+    # counters of the motor controller at the start of the scan
+    def gpib_start(self, round_trips, writes):
+        self._gpib_start = (round_trips, writes)
+
+    # GPIB traffic since gpib_start from the current counters
+    def gpib_update(self, round_trips, writes):
+        self.round_trips = round_trips - self._gpib_start[0]
+        self.writes = writes - self._gpib_start[1]
+
+    def gpib_summary(self):
+        return 'GPIB: {} round trips ({:.2f} per pixel), {} writes'.format(
+            self.round_trips, self.round_trips/max(self.pixels, 1), self.writes)
+
+    def stop(self):
+        self.end_time = time.perf_counter()
+
+    def elapsed(self):
+        end = time.perf_counter() if self.end_time is None else self.end_time
+        return end - self.start_time
+
+
+class ScanPlanner:
+
+    # path None keeps the model in memory only (e.g. for simulated scans)
+    def __init__(self, path=TIMING_MODEL_FILE):
+        self.path = path
+        self.model = dict(DEFAULT_MODEL)
+        # weighted sums of previous observations
+        self.history = {'moves': {'n': 0, 'd': 0.0, 't': 0.0, 'dd': 0.0, 'dt': 0.0},
+                        'samples': 0, 'read_time': 0.0, 'pixels': 0, 'other_time': 0.0}
+        self.n_scans = 0
+
+    # load previous timings from file (falls back to defaults)
+    @classmethod
+    def load(cls, path=TIMING_MODEL_FILE):
+        planner = cls(path)
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            planner.model.update(saved['model'])
+            planner.history = saved['history']
+            planner.n_scans = saved['n_scans']
+        except (OSError, ValueError, KeyError):
+            pass
+        return planner
+
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({'model': self.model, 'history': self.history, 'n_scans': self.n_scans}, f, indent=4)
+        except OSError:
+            # estimates still work from the in memory model
+            pass
+
+    # refine the model using the timings of a completed scan
+    def record(self, timer):
+        if timer.pixels == 0:
+            return
+        h = self.history
+        for key in h['moves']:
+            h['moves'][key] = h['moves'][key]*FORGET_FACTOR + timer.moves[key]
+        if timer.fly:
+            self._fit()
+            self.n_scans += 1
+            self.save()
+            return
+        h['samples'] = h['samples']*FORGET_FACTOR + timer.samples
+        h['read_time'] = h['read_time']*FORGET_FACTOR + timer.read_time
+        h['pixels'] = h['pixels']*FORGET_FACTOR + timer.pixels
+        other = timer.elapsed() - timer.moves['t'] - timer.read_time - timer.settle_time
+        h['other_time'] = h['other_time']*FORGET_FACTOR + max(other, 0)
+        self._fit()
+        # mean wait when settling adaptively
+        if timer.settle_mode == 'adaptive' and timer.settles > 0:
+            mean_settle = timer.settle_time / timer.settles
+            previous = self.model.get('adaptive_settle', mean_settle)
+            self.model['adaptive_settle'] = previous*FORGET_FACTOR + mean_settle*(1 - FORGET_FACTOR)
+        # mean samples per pixel when sampling sequentially
+        if timer.sampling_mode == 'sequential':
+            mean_samples = timer.samples / timer.pixels
+            previous = self.model.get('sequential_samples', mean_samples)
+            self.model['sequential_samples'] = previous*FORGET_FACTOR + mean_samples*(1 - FORGET_FACTOR)
+        self.n_scans += 1
+        self.save()
+
+    def _fit(self):
+        h = self.history
+        m = h['moves']
+        if m['n'] > 0:
+            # least squares fit of t = overhead + per_mm*d, only keep intercept if distances don't vary
+            var = m['n']*m['dd'] - m['d']**2
+            if var > 1e-9 * max(m['n']*m['dd'], 1):
+                slope = (m['n']*m['dt'] - m['d']*m['t']) / var
+                self.model['move_per_mm'] = max(slope, 0)
+            self.model['move_overhead'] = max((m['t'] - self.model['move_per_mm']*m['d']) / m['n'], 0)
+        if h['samples'] > 0:
+            self.model['read_latency'] = h['read_time'] / h['samples']
+        if h['pixels'] > 0:
+            self.model['pixel_overhead'] = h['other_time'] / h['pixels']
+
+    # time for a number of moves covering a total distance
+    def _move_time(self, n_moves, distance):
+        return n_moves*self.model['move_overhead'] + distance*self.model['move_per_mm']
+
+    def _pixel_time(self, n_samples):
+        return n_samples*self.model['read_latency'] + self.model['pixel_overhead']
+
+    def _homing_time(self, position):
+        if position is None or None in position:
+            return self._move_time(2, 2*HOMING_DISTANCE), (0, 0)
+        return 0, position
+
+    # returns estimated seconds for Camera.scan_image
+    # position is the current stage position, None if the stage still needs homing
+    def estimate_2d(self, start, img_size, pixel_size, n_samples, settle_time=0.05,
+                    serpentine=False, position=None):
+        t, position = self._homing_time(position)
+        rows = int(img_size[0]/pixel_size[0])
+        steps = int(img_size[1]/pixel_size[1])
+        # move to start of x and y
+        t += self._move_time(2, abs(start[0] - position[0]) + abs(start[1] - position[1]))
+        # steps along each row and x step after each row
+        t += rows*self._move_time(steps, steps*pixel_size[1])
+        t += self._move_time(rows, rows*pixel_size[0])
+        if not serpentine:
+            # return to start of row
+            t += self._move_time(rows - 1, (rows - 1)*steps*pixel_size[1])
+        t += rows*(steps + 1)*self._pixel_time(n_samples)
+        t += rows*steps*settle_time
+        return t
+
+    # returns estimated seconds for Camera.scan_image fly scans, each row is one move of the whole row
+    # (plus half a pixel at each end) with the adc read during the move
+    def estimate_fly_2d(self, start, img_size, pixel_size, settle_time=0.05, serpentine=False, position=None):
+        t, position = self._homing_time(position)
+        rows = int(img_size[0]/pixel_size[0])
+        row_length = (int(img_size[1]/pixel_size[1]) + 1)*pixel_size[1]
+        t += self._move_time(2, abs(start[0] - position[0]) + abs(start[1] - position[1]))
+        t += self._move_time(rows, rows*row_length)
+        t += self._move_time(rows, rows*pixel_size[0])
+        if not serpentine:
+            t += self._move_time(rows - 1, (rows - 1)*row_length)
+        t += rows*settle_time
+        return t
+
+    # returns estimated seconds for Camera.scan_row
+    def estimate_1d(self, axis, other_axis_pos, start, scan_range, step_size, n_samples, settle_time=0.05,
+                    position=None):
+        t, position = self._homing_time(position)
+        steps = int(scan_range/step_size)
+        t += self._move_time(2, abs(other_axis_pos - position[int(not axis)]) + abs(start - position[axis]))
+        t += self._move_time(steps, steps*step_size)
+        t += (steps + 1)*self._pixel_time(n_samples) + steps*settle_time
+        return t
+
+    # largest number of samples per pixel that fits into budget seconds, None if 1 sample doesn't fit
+    def _suggest_n_samples(self, fixed, pixels, budget):
+        per_sample = pixels*self.model['read_latency']
+        if per_sample <= 0 or budget < fixed + per_sample:
+            return None
+        return int((budget - fixed) / per_sample)
+
+    def suggest_n_samples_2d(self, start, img_size, pixel_size, budget, settle_time=0.05,
+                            serpentine=False, position=None):
+        fixed = self.estimate_2d(start, img_size, pixel_size, 0, settle_time, serpentine, position)
+        pixels = int(img_size[0]/pixel_size[0]) * (int(img_size[1]/pixel_size[1]) + 1)
+        return self._suggest_n_samples(fixed, pixels, budget)
+
+    def suggest_n_samples_1d(self, axis, other_axis_pos, start, scan_range, step_size, budget, settle_time=0.05,
+                            position=None):
+        fixed = self.estimate_1d(axis, other_axis_pos, start, scan_range, step_size, 0, settle_time, position)
+        return self._suggest_n_samples(fixed, int(scan_range/step_size) + 1, budget)
+
+    # smallest square pixel size (multiple of resolution in mm) that fits the 2d scan into budget seconds
+    def suggest_pixel_size(self, start, img_size, n_samples, budget, settle_time=0.05,
+                            serpentine=False, position=None, resolution=0.01):
+        fits = lambda p: self.estimate_2d(start, img_size, (p, p), n_samples, settle_time,
+                                        serpentine, position) <= budget
+        # binary search over multiples of resolution, time decreases with pixel size
+        low, high = 1, int(math.floor(min(img_size) / resolution))
+        if high < 1 or not fits(high*resolution):
+            return None
+        while low < high:
+            mid = (low + high) // 2
+            if fits(mid*resolution):
+                high = mid
+            else:
+                low = mid + 1
+        return round(low*resolution, 6)
+
+    # smallest step size (multiple of resolution in mm) that fits the 1d scan into budget seconds
+    def suggest_step_size(self, axis, other_axis_pos, start, scan_range, n_samples, budget, settle_time=0.05,
+                            position=None, resolution=0.01):
+        fits = lambda s: self.estimate_1d(axis, other_axis_pos, start, scan_range, s, n_samples,
+                                        settle_time, position) <= budget
+        low, high = 1, int(math.floor(scan_range / resolution))
+        if high < 1 or not fits(high*resolution):
+            return None
+        while low < high:
+            mid = (low + high) // 2
+            if fits(mid*resolution):
+                high = mid
+            else:
+                low = mid + 1
+        return round(low*resolution, 6)
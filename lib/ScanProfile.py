@@ -0,0 +1,160 @@
+# Latency histograms of the operations on the scan's hot path (moves, settle waits, adc reads, reductions, GPIB
+# commands and GUI updates), to show where scan time goes. Recording a duration is a log and a list increment,
+# so profiling is left on for every scan. Each scan's profile is summarised by Camera and appended to a csv file
+# to follow timings across runs, and can be saved as json with the full histograms.
+import csv
+import json
+import math
+import os
+import time
+
+# histogram buckets are log spaced, BUCKETS_PER_DECADE per factor of 10 from 10**MIN_EXPONENT seconds up to
+# 10**MAX_EXPONENT seconds, durations outside go in the first or last bucket
+MIN_EXPONENT = -6
+MAX_EXPONENT = 3
+BUCKETS_PER_DECADE = 10
+N_BUCKETS = (MAX_EXPONENT - MIN_EXPONENT)*BUCKETS_PER_DECADE + 2
+
+# percentiles reported in summaries and exports
+PERCENTILES = (50, 90, 99)
+
+CSV_FIELDS = ('time', 'label', 'name', 'count', 'total', 'mean', 'min', 'max') + tuple(
+    'p{}'.format(p) for p in PERCENTILES)
+
+
+# lower edge (s) of bucket i, 0 for the first bucket
+def bucket_edge(i):
+    if i == 0:
+        return 0.0
+    return 10**(MIN_EXPONENT + (i - 1)/BUCKETS_PER_DECADE)
+
+
+class LatencyHistogram:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = [0]*N_BUCKETS
+
+    def record(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+        if duration > 0:
+            i = int((math.log10(duration) - MIN_EXPONENT)*BUCKETS_PER_DECADE) + 1
+            self.buckets[min(max(i, 0), N_BUCKETS - 1)] += 1
+        else:
+            self.buckets[0] += 1
+
+    def mean(self):
+        return self.total/self.count if self.count else 0.0
+
+    # estimate of the p-th percentile, the geometric middle of the bucket it falls in (within min and max)
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        rank = p/100*self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                break
+        if i == 0:
+            estimate = self.min
+        else:
+            estimate = math.sqrt(bucket_edge(i)*bucket_edge(i + 1))
+        return min(max(estimate, self.min), self.max)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def to_dict(self):
+        result = {'count': self.count, 'total': self.total, 'mean': self.mean(),
+                  'min': self.min if self.count else 0.0, 'max': self.max}
+        for p in PERCENTILES:
+            result['p{}'.format(p)] = self.percentile(p)
+        # only buckets with durations in, keyed by their lower edge
+        result['buckets'] = {'{:.3g}'.format(bucket_edge(i)): n for i, n in enumerate(self.buckets) if n}
+        return result
+
+    @classmethod
+    def from_dict(cls, d):
+        histogram = cls()
+        histogram.count = d['count']
+        histogram.total = d['total']
+        histogram.min = d['min'] if d['count'] else math.inf
+        histogram.max = d['max']
+        for edge, n in d['buckets'].items():
+            edge = float(edge)
+            i = 0 if edge == 0 else int(round((math.log10(edge) - MIN_EXPONENT)*BUCKETS_PER_DECADE)) + 1
+            histogram.buckets[i] += n
+        return histogram
+
+
+# latency histograms by name, e.g. profile.record('move', duration)
+class ScanProfile:
+
+    def __init__(self):
+        self.histograms = {}
+        self.created = time.time()
+
+    def record(self, name, duration):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, LatencyHistogram())
+        histogram.record(duration)
+
+    # add the durations recorded in another profile, e.g. to combine several scans
+    def merge(self, other):
+        for name, histogram in other.histograms.items():
+            self.histograms.setdefault(name, LatencyHistogram()).merge(histogram)
+
+    # table of the histograms, one line each
+    def summary(self):
+        lines = ['{:<12} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}'.format('', 'count', 'total', 'mean', 'p50', 'p99',
+                                                                   'max')]
+        for name, h in sorted(self.histograms.items()):
+            lines.append('{:<12} {:>7} {:>8.3f}s {:>7.2f}ms {:>7.2f}ms {:>7.2f}ms {:>7.2f}ms'.format(
+                name, h.count, h.total, 1000*h.mean(), 1000*h.percentile(50), 1000*h.percentile(99),
+                1000*h.max))
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        return {'time': self.created,
+                'histograms': {name: h.to_dict() for name, h in sorted(self.histograms.items())}}
+
+    @classmethod
+    def from_dict(cls, d):
+        profile = cls()
+        profile.created = d['time']
+        profile.histograms = {name: LatencyHistogram.from_dict(h) for name, h in d['histograms'].items()}
+        return profile
+
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    @classmethod
+    def load_json(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    # append a row per histogram to a csv file (header written if the file is new), label identifies the run
+    def append_csv(self, path, label=''):
+        new_file = not os.path.exists(path)
+        with open(path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(CSV_FIELDS)
+            for name, h in sorted(self.histograms.items()):
+                writer.writerow([self.created, label, name, h.count, h.total, h.mean(),
+                                 h.min if h.count else 0.0, h.max] + [h.percentile(p) for p in PERCENTILES])
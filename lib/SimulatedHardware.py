@@ -0,0 +1,237 @@
+# Simulated motor stage and ADC board with a timing model of the real hardware.
+# The simulated GPIB instrument and K8055 dll are passed to the real MotorController and
+# AdcController so the same driver code is exercised as when using the equipment.
+import math
+import random
+import time
+
+from MotorController import MotorController, resource_name
+from AdcController import AdcController, ADC_CHANNEL_USED
+
+DATA_PREFIX = 'sim'
+
+SIMULATED_DEVICE_NAME = 'GPIB0::6::INSTR'
+
+# default timing model (seconds, mm), approximate values for the NANOSTEP stage and K8055 board
+TIMING = {
+    'gpib_round_trip'   :   0.010,      # write + read of one GPIB query
+    'move_overhead'     :   0.020,      # acceleration/deceleration per move command
+    'move_velocity'     :   5.0,        # mm/s
+    'read_latency'      :   0.001,      # per ReadAnalogChannel call
+    'sensor_tau'        :   0.015,      # time constant of sensor response after a move
+    'sensor_noise'      :   1.5,        # standard deviation of reading noise (ADC counts)
+}
+
+# travel limits of the stage (mm)
+STAGE_LIMITS = ((0, 50), (0, 50))
+
+
+# GPIB timeout as raised by pyvisa, which is imported here rather than with this module as the real driver only
+# imports it once the instrument is opened
+def _timeout_error():
+    from pyvisa import constants
+    from pyvisa.errors import VisaIOError
+    return VisaIOError(constants.StatusCode.error_timeout)
+
+
+# wait for duration seconds, spinning for the last couple of ms as sleep is too coarse on Windows
+def _wait(duration):
+    end = time.perf_counter() + duration
+    if duration > 0.002:
+        time.sleep(duration - 0.002)
+    while time.perf_counter() < end:
+        pass
+
+
+# synthetic thermal scene: warm background with a number of gaussian hot spots
+class ThermalScene:
+
+    def __init__(self, n_spots=6, background=20, seed=0):
+        rand = random.Random(seed)
+        self.background = background
+        # (x, y, radius, peak) of each hot spot in mm and ADC counts
+        self.spots = [(rand.uniform(5, 45), rand.uniform(5, 45), rand.uniform(0.5, 4),
+                        rand.uniform(60, 220)) for i in range(n_spots)]
+
+    def value(self, x, y):
+        v = self.background
+        for sx, sy, r, peak in self.spots:
+            v += peak * math.exp(-((x - sx)**2 + (y - sy)**2) / (2*r*r))
+        return min(v, 255)
+
+
+# shared state of the stage and sensor, accumulates time spent in each hardware phase
+class SimulatedStage:
+
+    def __init__(self, scene=None, seed=0, **timing):
+        self.scene = ThermalScene(seed=seed) if scene is None else scene
+        self.timing = dict(TIMING)
+        self.timing.update(timing)
+        self.random = random.Random(seed)
+        # true position, starts part way along the axes before homing
+        self.position = [25.0, 25.0]
+        # current move of each axis: axis -> (from, to, start time, end time), axes move independently
+        self.motions = {}
+        # sensor response lags behind the scene value after a move
+        self.sensor_from = self.scene.value(*self.position)
+        self.sensor_since = time.perf_counter()
+        # set False to simulate the devices being unplugged (GPIB timeouts, adc board not found)
+        self.connected = True
+        self.reset_timings()
+
+    def reset_timings(self):
+        self.timings = {'gpib': 0.0, 'move': 0.0, 'adc': 0.0}
+        self.counts = {'gpib': 0, 'move': 0, 'adc': 0}
+
+    def _record(self, phase, duration):
+        self.timings[phase] += duration
+        self.counts[phase] += 1
+
+    # position at time t (linear motion at move_velocity)
+    def position_at(self, t):
+        pos = list(self.position)
+        for axis, (start, end, t0, t1) in self.motions.items():
+            if t < t1:
+                pos[axis] = start + (end - start) * max(t - t0, 0) / (t1 - t0)
+        return pos
+
+    # start a move, returns time the move will be complete
+    def start_move(self, axis, distance):
+        now = time.perf_counter()
+        self.sensor_from = self._sensor_value(now)
+        # stop any previous move of the axis where it has got to
+        self.position[axis] = self.position_at(now)[axis]
+        self.motions.pop(axis, None)
+        start = self.position[axis]
+        end = min(max(start + distance, STAGE_LIMITS[axis][0]), STAGE_LIMITS[axis][1])
+        duration = self.timing['move_overhead'] + abs(end - start) / self.timing['move_velocity']
+        self.motions[axis] = (start, end, now, now + duration)
+        self.position[axis] = end
+        # sensor settles once all axes have stopped
+        self.sensor_since = max(t1 for start, end, t0, t1 in self.motions.values())
+        self._record('move', duration)
+        return now + duration
+
+    def moving(self, axis=None):
+        now = time.perf_counter()
+        return any(now < t1 for a, (start, end, t0, t1) in self.motions.items() if axis is None or a == axis)
+
+    def at_endstop(self, axis):
+        pos = self.position_at(time.perf_counter())[axis]
+        return pos <= STAGE_LIMITS[axis][0], pos >= STAGE_LIMITS[axis][1]
+
+    # noiseless sensor value at time t: first order lag towards the scene value
+    def _sensor_value(self, t):
+        target = self.scene.value(*self.position_at(t))
+        if any(t < t1 for start, end, t0, t1 in self.motions.values()):
+            # moving, sensor follows the scene sensor_tau behind the stage
+            return self.scene.value(*self.position_at(t - self.timing['sensor_tau']))
+        decay = math.exp(-max(t - self.sensor_since, 0) / self.timing['sensor_tau'])
+        return target + (self.sensor_from - target) * decay
+
+    def read(self):
+        _wait(self.timing['read_latency'])
+        self._record('adc', self.timing['read_latency'])
+        value = self._sensor_value(time.perf_counter()) + self.random.gauss(0, self.timing['sensor_noise'])
+        return int(min(max(round(value), 0), 255))
+
+
+# GPIB instrument implementing the subset of the NANOSTEP commands used by MotorController. Every command
+# has a response, queued in order until read, so a response left unread is returned by the next read
+# (as on the bus) rather than lost. Responses to moves are sent once the move is complete
+class SimulatedInstrument:
+
+    def __init__(self, stage):
+        self.stage = stage
+        # (time available, response) of each command written and not yet read
+        self.responses = []
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    # moves start as soon as they are written, further commands are accepted while they run
+    def write(self, message):
+        if not self.stage.connected:
+            raise _timeout_error()
+        _wait(self.stage.timing['gpib_round_trip'] / 2)
+        self.stage._record('gpib', self.stage.timing['gpib_round_trip'] / 2)
+        self.responses.append(self._execute(message))
+
+    # oldest unread response, once it is available
+    def read(self):
+        if not self.stage.connected or not self.responses:
+            raise _timeout_error()
+        available, response = self.responses.pop(0)
+        _wait(available - time.perf_counter() + self.stage.timing['gpib_round_trip'] / 2)
+        self.stage._record('gpib', self.stage.timing['gpib_round_trip'] / 2)
+        return response
+
+    def close(self):
+        pass
+
+    # (time the response is available, response)
+    def _execute(self, message):
+        now = time.perf_counter()
+        if message == '*IDN?':
+            return now, 'MELLES GRIOT NANOSTEP'
+        elif message.startswith('MR'):
+            try:
+                axis, distance = message[2:].split('=')
+                return self.stage.start_move(int(axis), float(distance)), 'OK'
+            except ValueError:
+                return now, 'E'
+        elif message.startswith('?L'):
+            # first digit is the max endstop, second the min endstop
+            at_min, at_max = self.stage.at_endstop(int(message[2:]))
+            return now, '{}{}'.format(int(at_max), int(at_min))
+        else:
+            return now, 'E'
+
+
+class SimulatedResourceManager:
+
+    def __init__(self, stage, address=SIMULATED_DEVICE_NAME):
+        self.stage = stage
+        self.address = address
+
+    def list_resources(self):
+        return (self.address,) if self.stage.connected else ()
+
+    def open_resource(self, name, timeout=None):
+        return SimulatedInstrument(self.stage)
+
+
+# replacement for the K8055D.dll functions used by AdcController
+class SimulatedDll:
+
+    def __init__(self, stage, card=0):
+        self.stage = stage
+        self.card = card
+        self.opened = False
+
+    def SearchDevices(self):
+        return int(self.stage.connected) << self.card
+
+    def OpenDevice(self, card):
+        if card != self.card or not self.stage.connected:
+            return -1
+        self.opened = True
+        return card
+
+    def CloseDevice(self):
+        self.opened = False
+
+    def ReadAnalogChannel(self, channel):
+        return self.stage.read() if channel == ADC_CHANNEL_USED else 0
+
+
+# create a MotorController and AdcController sharing one simulated stage, with the controller at GPIB resource
+# address and the adc board at card (as for MotorController and AdcController)
+# usage: Camera(motors=motors, adc=adc)
+def simulated_controllers(stage=None, address=None, card=0, **kwargs):
+    stage = SimulatedStage(**kwargs) if stage is None else stage
+    device_name = SIMULATED_DEVICE_NAME if address is None else resource_name(address)
+    motors = MotorController(SimulatedResourceManager(stage, device_name), address)
+    adc = AdcController(SimulatedDll(stage, card), card)
+    return motors, adc, stage
@@ -0,0 +1,55 @@
+# Measures the pc side overhead of AdcController.read (sampling + reduction) for increasing numbers of
+# samples, using a simulated ADC with no latency, compared to the previous list based implementation.
+import sys, os, time, math
+sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
+from AdcController import AdcController
+from Reducers import REDUCERS
+
+# number of reads timed for each setting
+REPEATS = 200
+
+
+class ZeroLatencyDll:
+    def ReadAnalogChannel(self, channel):
+        return 100
+    def OpenDevice(self, card):
+        return 0
+    def CloseDevice(self):
+        pass
+    SearchDevices = None
+
+
+# previous implementation of AdcController.read for comparison
+def list_read(read_channel, n, func):
+    samples = []
+    for i in range(n):
+        samples += [read_channel()]
+    if func == 'max':
+        return max(samples)
+    elif func == 'average':
+        return sum(samples)/n
+    elif func == 'rms2':
+        return sum([s*s for s in samples])/n
+    elif func == 'rms':
+        return math.sqrt(sum([s*s for s in samples])/n)
+    elif func == 'sum':
+        return sum(samples)
+
+
+def time_per_read(func):
+    t1 = time.perf_counter()
+    for i in range(REPEATS):
+        func()
+    return (time.perf_counter() - t1)/REPEATS
+
+
+adc = AdcController(ZeroLatencyDll())
+for n in (20, 100, 1000, 10000):
+    print('{} samples per pixel:'.format(n))
+    for func in sorted(REDUCERS):
+        t = time_per_read(lambda: adc.read(n, func))
+        line = '    {:<14}{:9.1f}us'.format(func, t*1e6)
+        if func in ('max', 'average', 'rms2', 'rms', 'sum'):
+            t_old = time_per_read(lambda: list_read(adc.read_channel, n, func))
+            line += '    (list: {:9.1f}us)'.format(t_old*1e6)
+        print(line)
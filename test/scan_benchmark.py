@@ -0,0 +1,136 @@
+# Benchmark scan throughput using the simulated hardware backend (no equipment needed)
+# Reports pixels/second, time spent in each phase and the latency histograms of the scan's profile (see
+# ScanProfile), and compares against the stored baseline. The stage is homed and moved to the start of the
+# scan before timing, and the timing model, profile log and checkpoint of the benchmark's simulated scans go
+# to a temporary directory rather than ScanData.
+# usage: python scan_benchmark.py [--save-baseline] [--tolerance=0.1] [--profile-json=path] [--case=name ...]
+# --case runs only the named cases, with --save-baseline only their baselines are replaced
+import sys, os, time, json, tempfile
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
+from Camera import *
+from SimulatedHardware import simulated_controllers
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+# name: (scan method, arguments, camera settings), 'motors.' settings are set on the motor controller
+CASES = [
+    ('scan_image',              'scan_image',   ((10, 10), (1, 1), (0.2, 0.2)),     {}),
+    ('scan_image serpentine',   'scan_image',   ((10, 10), (1, 1), (0.2, 0.2)),     {'SERPENTINE': True}),
+    ('scan_image 100 samples',  'scan_image',   ((10, 10), (1, 1), (0.2, 0.2)),     {'N_SAMPLES': 100}),
+    ('scan_image adaptive settle', 'scan_image', ((10, 10), (1, 1), (0.2, 0.2)),   {'SETTLE_MODE': 'adaptive'}),
+    ('scan_image inline',       'scan_image',   ((10, 10), (1, 1), (0.2, 0.2)),     {'PIPELINED': False}),
+    ('scan_image batched',      'scan_image',   ((10, 10), (1, 1), (0.2, 0.2)),     {'motors.BATCH_COMMANDS': True}),
+    ('scan_image fly',          'scan_image',   ((10, 10), (1, 1), (0.2, 0.2)),     {'FLY_SCAN': True}),
+    ('scan_row',                'scan_row',     (0, 20, 10, 3, 0.1),                {}),
+]
+
+
+def count_pixels(data):
+    return data.data.size
+
+
+# (axis, position) the stage is at when a scan starts
+def start_positions(method, args):
+    if method == 'scan_row':
+        axis, other_axis_pos, start = args[:3]
+        return [(int(not axis), other_axis_pos), (axis, start)]
+    return [(0, args[0][0]), (1, args[0][1])]
+
+
+# each case starts from the default timing model, so cases don't depend on those run before them
+def run_case(method, args, settings, directory):
+    motors, adc, stage = simulated_controllers()
+    camera = Camera(motors=motors, adc=adc)
+    camera.planner = ScanPlanner(os.path.join(directory, 'timing_model.json'))
+    camera.CHECKPOINT_FILE = os.path.join(directory, 'last_image_backup.scanbin')
+    camera.PROFILE_FILE = None
+    # home stage and move to the start of the scan before timing
+    motors.open_instrument()
+    for axis, position in start_positions(method, args):
+        motors.move_absolute(axis, position)
+    for key, value in settings.items():
+        if key.startswith('motors.'):
+            setattr(motors, key[len('motors.'):], value)
+        else:
+            setattr(camera, key, value)
+    stage.reset_timings()
+    kwargs = {'display_time': False} if method == 'scan_image' else {}
+    t1 = time.perf_counter()
+    data = getattr(camera, method)(*args, **kwargs)
+    total = time.perf_counter() - t1
+    pixels = count_pixels(data)
+    phases = dict(stage.timings)
+    # remaining time is settle pauses and processing on the pc
+    phases['other'] = total - sum(stage.timings.values())
+    return {'pixels': pixels, 'total': total, 'pixels_per_second': pixels/total, 'phases': phases,
+            'calls': dict(stage.counts), 'pipeline': camera.pipeline, 'gpib': camera.scan_timer.gpib_summary(),
+            'profile': camera.scan_timer.profile}
+
+
+def main(argv):
+    save_baseline = '--save-baseline' in argv
+    tolerance = 0.1
+    profile_json = None
+    names = []
+    for arg in argv:
+        if arg.startswith('--tolerance='):
+            tolerance = float(arg.split('=')[1])
+        elif arg.startswith('--profile-json='):
+            profile_json = arg.split('=', 1)[1]
+        elif arg.startswith('--case='):
+            names.append(arg.split('=', 1)[1])
+    unknown = set(names) - set(case[0] for case in CASES)
+    if unknown:
+        print('Unknown case(s): {}, cases are: {}'.format(', '.join(sorted(unknown)),
+                                                        ', '.join(case[0] for case in CASES)))
+        return 2
+    try:
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    results = {}
+    regressions = []
+    directory = tempfile.TemporaryDirectory()
+    for name, method, args, settings in CASES:
+        if names and name not in names:
+            continue
+        r = run_case(method, args, settings, directory.name)
+        results[name] = r
+        print('{}: {} pixels in {:.2f}s, {:.2f} pixels/s'.format(name, r['pixels'], r['total'], r['pixels_per_second']))
+        for phase, t in r['phases'].items():
+            print('    {:<6} {:7.3f}s ({:5.1f}%) {}'.format(phase, t, 100*t/r['total'],
+                '{} calls'.format(r['calls'][phase]) if phase in r['calls'] else ''))
+        print('    ' + r['gpib'])
+        if r['pipeline'].threaded:
+            for line in r['pipeline'].summary().splitlines():
+                print('    queue ' + line)
+        for line in r['profile'].summary().splitlines():
+            print('    ' + line)
+        if name in baseline:
+            change = r['pixels_per_second']/baseline[name]['pixels_per_second'] - 1
+            print('    {:+.1f}% vs baseline'.format(100*change))
+            if change < -tolerance:
+                regressions.append(name)
+
+    directory.cleanup()
+    if save_baseline:
+        baseline.update({name: {'pixels_per_second': r['pixels_per_second']} for name, r in results.items()})
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print('Baseline saved to {}'.format(BASELINE_FILE))
+    if profile_json is not None:
+        # profiles of every case, to compare latencies between runs
+        with open(profile_json, 'w') as f:
+            json.dump({name: r['profile'].to_dict() for name, r in results.items()}, f, indent=4, sort_keys=True)
+        print('Profiles saved to {}'.format(profile_json))
+    if regressions:
+        print('Regressions (> {}% slower than baseline): {}'.format(100*tolerance, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,86 @@
+# Benchmark startup time: importing Camera, running the command line interface, the GUI showing its first
+# window and the GUI's plot canvas being ready (with the simulated hardware backend). Each case runs in a new interpreter several times and the
+# median is compared against the stored baseline.
+# usage: python startup_benchmark.py [--save-baseline] [--tolerance=0.2] [--repeats=5]
+# set QT_QPA_PLATFORM=offscreen to run the GUI case without a display
+import sys, os, time, json, statistics, subprocess
+
+PROGRAM_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'startup_baseline.json')
+
+# code run in a new interpreter, prints seconds taken
+SETUP = 'import time; t = time.perf_counter(); import sys\n'
+GUI_SETUP = (SETUP + 'from PyQt5.QtWidgets import QApplication\n'
+                'app = QApplication(sys.argv)\n'
+                'import CameraGui\n'
+                'from Camera import Camera\n'
+                'from SimulatedHardware import simulated_controllers\n'
+                'def camera():\n'
+                '    motors, adc, stage = simulated_controllers()\n'
+                '    return Camera(motors=motors, adc=adc)\n'
+                'CameraGui.Camera = camera\n'
+                'gui = CameraGui.CameraGUI()\n')
+CASES = [
+    ('import Camera', SETUP + 'import Camera\n'
+                        'print(time.perf_counter() - t)'),
+    ('CameraCLI --help', SETUP + 'import CameraCLI\n'
+                        'try:\n'
+                        '    CameraCLI.make_parser().parse_args(["2d", "--help"])\n'
+                        'except SystemExit:\n'
+                        '    pass\n'
+                        'print(time.perf_counter() - t)'),
+    ('GUI first window', GUI_SETUP + 'print(time.perf_counter() - t)'),
+    # the canvas is created once the event loop starts after the window is shown
+    ('GUI plot ready', GUI_SETUP + 'while gui._plot_canvas is None:\n'
+                        '    app.processEvents()\n'
+                        'print(time.perf_counter() - t)'),
+]
+
+
+def run_case(code):
+    result = subprocess.run([sys.executable, '-c', code], cwd=PROGRAM_DIRECTORY, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, universal_newlines=True, check=True)
+    return float(result.stdout.split()[-1])
+
+
+def main(argv):
+    save_baseline = '--save-baseline' in argv
+    tolerance = 0.2
+    repeats = 5
+    for arg in argv:
+        if arg.startswith('--tolerance='):
+            tolerance = float(arg.split('=')[1])
+        elif arg.startswith('--repeats='):
+            repeats = int(arg.split('=')[1])
+    try:
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    results = {}
+    regressions = []
+    for name, code in CASES:
+        # first run warms the disk cache
+        run_case(code)
+        times = [run_case(code) for i in range(repeats)]
+        results[name] = statistics.median(times)
+        print('{}: {:.3f}s (min {:.3f}s, max {:.3f}s)'.format(name, results[name], min(times), max(times)))
+        if name in baseline:
+            change = results[name]/baseline[name]['seconds'] - 1
+            print('    {:+.1f}% vs baseline'.format(100*change))
+            if change > tolerance:
+                regressions.append(name)
+
+    if save_baseline:
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump({name: {'seconds': t} for name, t in results.items()}, f, indent=4, sort_keys=True)
+        print('Baseline saved to {}'.format(BASELINE_FILE))
+    if regressions:
+        print('Regressions (> {}% slower than baseline): {}'.format(100*tolerance, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
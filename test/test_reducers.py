@@ -0,0 +1,59 @@
+# Tests of reducing raw sample captures (Reducers.reduce_raw), run with pytest or python test_reducers.py
+import sys, os, tempfile, warnings
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
+import numpy
+from Camera import Camera
+from Reducers import reduce_raw
+from ScanPlanner import ScanPlanner
+from SimulatedHardware import simulated_controllers
+
+
+# sequential raw capture of a 2d scan stopped after rows_done rows: the counts of the rest are nan and their
+# samples the zero padding, as in the arrays of a partial scan
+def partial_capture(rows_done):
+    motors, adc, stage = simulated_controllers(seed=1, move_velocity=500, move_overhead=0.001,
+                                                gpib_round_trip=0.0005, read_latency=0.0001)
+    camera = Camera(motors=motors, adc=adc)
+    camera.SETTLE_TIME = 0.001
+    camera.PROFILE_FILE = None
+    camera.CHECKPOINT_FILE = None
+    camera.set_sequential_sampling(True, target_se=1.0, n_min=5)
+    camera.set_raw_capture(True)
+    # the timing model of the simulated scan isn't kept
+    with tempfile.TemporaryDirectory() as directory:
+        camera.planner = ScanPlanner(os.path.join(directory, 'timing_model.json'))
+        scan = camera.scan_image((10, 10), (1, 1), (0.2, 0.2), display_time=False)
+    raw = numpy.array(scan.raw_samples)
+    counts = numpy.array(scan.sample_counts)
+    raw[rows_done:] = 0
+    counts[rows_done:] = numpy.nan
+    return scan, raw, counts
+
+
+def test_reduce_partial_sequential_capture():
+    scan, raw, counts = partial_capture(2)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        # rms is the camera's default sampling function
+        values = reduce_raw(raw, 'rms', counts)
+    assert values.shape == scan.data.shape
+    assert numpy.allclose(values[:2], scan.data[:2])
+    assert numpy.isnan(values[2:]).all()
+
+
+def test_reduce_partial_capture_with_empty_pixels():
+    raw = numpy.arange(24, dtype=numpy.uint8).reshape(2, 3, 4)
+    counts = numpy.array([[4, 2, 0], [numpy.nan, numpy.nan, numpy.nan]])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        values = reduce_raw(raw, 'max', counts)
+    assert values[0, 0] == 3 and values[0, 1] == 5
+    assert numpy.isnan(values[0, 2]) and numpy.isnan(values[1]).all()
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{} passed'.format(name))
@@ -0,0 +1,63 @@
+# Tests of the region corners used to plan multi-region scans (RegionPlanner), run with pytest or
+# python test_region_planner.py
+import sys, os, tempfile
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
+import numpy
+from Camera import Camera
+from AcquisitionPipeline import RowAssembler
+from RegionPlanner import region_corners, DIRECTIONS
+from ScanPlanner import ScanPlanner
+from SimulatedHardware import simulated_controllers
+
+# an odd and an even number of rows, so the last row of a serpentine scan is reversed in one of them
+REGIONS = [((10, 10), (0.6, 0.4), (0.2, 0.2)), ((20, 15), (0.8, 0.4), (0.2, 0.2))]
+
+
+def simulated_camera(directory, serpentine):
+    motors, adc, stage = simulated_controllers(seed=1, move_velocity=500, move_overhead=0.001,
+                                                gpib_round_trip=0.0005, read_latency=0.0001)
+    camera = Camera(motors=motors, adc=adc)
+    camera.planner = ScanPlanner(os.path.join(directory, 'timing_model.json'))
+    camera.SETTLE_TIME = 0.001
+    camera.PROFILE_FILE = None
+    camera.CHECKPOINT_FILE = None
+    camera.set_sampling_variables(2, camera.SAMPLING_FUNC)
+    camera.set_raster_mode(serpentine)
+    motors.open_instrument()
+    adc.open()
+    return camera
+
+
+# the stage is at the planned entry before the first pixel and the planned exit after the last
+def check_corners(serpentine):
+    with tempfile.TemporaryDirectory() as directory:
+        camera = simulated_camera(directory, serpentine)
+        for region in REGIONS:
+            start_pos, img_size, pixel_size = region
+            for direction in DIRECTIONS:
+                entry, exit = region_corners(region, direction, serpentine)
+                positions = []
+                emit = lambda item: positions.append(tuple(camera.motors.position)) or item
+                assembler = RowAssembler(int(img_size[0]/pixel_size[0]), int(img_size[1]/pixel_size[1]) + 1)
+                camera._run_pipeline(lambda put: camera._acquire_image(
+                    lambda item: put(emit(item)), start_pos, img_size, pixel_size, 0, *direction), assembler)
+                assert numpy.allclose(positions[0], entry), (region, direction, positions[0], entry)
+                assert numpy.allclose(positions[-1], exit), (region, direction, positions[-1], exit)
+                assert numpy.allclose(camera.motors.position, exit), (region, direction, camera.motors.position)
+        camera.adc.close()
+
+
+def test_region_corners():
+    check_corners(False)
+
+
+def test_region_corners_serpentine():
+    check_corners(True)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{} passed'.format(name))